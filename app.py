@@ -1,15 +1,85 @@
+import hmac
+import json
 import os
-from flask import Flask, request, jsonify, render_template
+import tarfile
+import tempfile
+import threading
+import traceback
+import zipfile
+from contextlib import nullcontext
+from itertools import islice
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as InferenceTimeout
+from flask import Flask, Response, request, jsonify, render_template, stream_with_context
 from flask_cors import CORS
+from werkzeug.exceptions import HTTPException
 
-# Import the inference module
-from src.inference import ArtDetector
+# torch, torchvision and src.inference are imported by load_detector, so importing
+# this module (and answering /livez) doesn't wait for them
+from src.cache import PredictionCache
+from src.metrics import RequestProfiler, register_collector, render_prometheus, timer
+from src.serving import QueueFullError, StartupState
+
+# Timed startup phases and readiness of this process (see /livez and /readyz)
+startup = StartupState()
 
 app = Flask(__name__)
 CORS(app)
+# Uploads larger than this are rejected with 413 while the body is still streaming in (None = unlimited)
+app.config['MAX_CONTENT_LENGTH'] = None
+# Token required by the /models admin endpoints (None disables them)
+app.config['ADMIN_TOKEN'] = None
+# Seconds a request waits for its queued inference before giving up with 503 (None = forever)
+app.config['INFERENCE_TIMEOUT'] = None
+# /predict_batch: images per forward pass, decode threads and maximum images per request
+app.config['BATCH_ENDPOINT_SIZE'] = 16
+app.config['DECODE_THREADS'] = 4
+app.config['MAX_BATCH_ITEMS'] = 256
+# /predict_batch archives: largest uncompressed image and uncompressed total read from one archive
+app.config['MAX_ARCHIVE_IMAGE_MB'] = 32
+app.config['MAX_ARCHIVE_TOTAL_MB'] = 1024
 
 # Global detector instance
 detector = None
+# Optional micro-batching scheduler in front of the detector. Its thread does not
+# survive fork, so each process starts its own on first use (see get_batcher).
+batcher = None
+batcher_config = None
+_batcher_pid = None
+_batcher_lock = threading.Lock()
+# Thread pool decoding /predict_batch images, created per process like the batcher
+decode_pool = None
+_decode_pool_pid = None
+# Optional sampling profiler for /predict (see configure_profiler)
+profiler = None
+# Loading deferred by schedule_loading: load_detector arguments (None if already loaded)
+# and warmup batch sizes. Every serving process runs it once via start_loading.
+_pending_load = None
+_warmup_batch_sizes = None
+_loader_pid = None
+# Checkpoint watching and candidate settings that load_detector hands to warm_up
+_registry_tasks = None
+
+@app.before_request
+def ensure_loading():
+    """Start this process's deferred load and warmup on its first request if nothing else has"""
+    start_loading()
+
+@app.route('/livez')
+def livez():
+    """Liveness probe: the process serves HTTP; fails only if the model can never load"""
+    if startup.status == 'failed':
+        return jsonify(startup.snapshot()), 500
+    return jsonify({'status': 'alive'})
+
+@app.route('/readyz')
+def readyz():
+    """
+    Readiness probe: 200 once the model is loaded and warmed up, 503 before
+    
+    Under gunicorn the probe reaches an arbitrary worker, so it only succeeds
+    once every worker is warm (see ``gunicorn.conf.py``).
+    """
+    return jsonify(startup.snapshot()), 200 if startup.all_ready else 503
 
 @app.route('/')
 def index():
@@ -19,43 +89,633 @@ def index():
 @app.route('/predict', methods=['POST'])
 def predict():
     """Predict image class"""
+    with timer('request'), (profiler.maybe_profile('predict') if profiler else nullcontext()):
+        return _predict()
+
+def _predict():
+    if detector is None:
+        return overloaded('Model is still loading, retry shortly')
     try:
-        if 'image' not in request.files:
-            return jsonify({'error': 'No image file provided'}), 400
+        active_batcher = get_batcher()
+        # Shed load before reading the upload body at all
+        if active_batcher is not None:
+            active_batcher.check_capacity()
         
-        file = request.files['image']
-        if file.filename == '':
+        # Read image bytes (parsing request.files is what consumes the upload)
+        with timer('read_upload'):
+            file = request.files.get('image')
+            image_bytes = file.read() if file is not None and file.filename != '' else None
+        if file is None:
+            return jsonify({'error': 'No image file provided'}), 400
+        if image_bytes is None:
             return jsonify({'error': 'No image selected'}), 400
         
-        # Read image bytes
-        image_bytes = file.read()
-        
         # Make prediction using the detector
-        result = detector.predict(image_bytes)
+        if active_batcher is not None:
+            result = active_batcher.predict(image_bytes, timeout=app.config['INFERENCE_TIMEOUT'])
+        else:
+            result = detector.predict(image_bytes)
         
-        return jsonify(result)
+        with timer('serialize'):
+            return jsonify(result)
     
+    except QueueFullError:
+        return overloaded('Server is at capacity, retry shortly')
+    except InferenceTimeout:
+        return overloaded('Inference timed out, retry shortly')
+    except HTTPException:
+        # e.g. 413 from MAX_CONTENT_LENGTH; let Flask's error handlers respond
+        raise
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+def overloaded(message):
+    """503 response asking the client to back off and retry"""
+    response = jsonify({'error': message})
+    response.status_code = 503
+    response.headers['Retry-After'] = '1'
+    return response
+
+@app.errorhandler(413)
+def upload_too_large(e):
+    """JSON response for uploads over MAX_CONTENT_LENGTH"""
+    limit = app.config['MAX_CONTENT_LENGTH']
+    return jsonify({'error': f'Upload exceeds the {limit / (1024 * 1024):.1f} MB limit'}), 413
+
+@app.route('/predict_batch', methods=['POST'])
+def predict_batch():
+    """
+    Predict many images in one request
+    
+    Accepts any number of ``images`` files, or one zip/tar ``archive`` file.
+    Images are decoded in parallel and scored in real batches; one NDJSON line
+    is streamed back per image as its batch finishes. Failures are reported per
+    line (``{"index": ..., "filename": ..., "error": ...}``) without aborting
+    the rest of the batch. Archive members are read only up to
+    ``MAX_ARCHIVE_IMAGE_MB`` each and ``MAX_ARCHIVE_TOTAL_MB`` in total
+    (uncompressed), since the upload limit only bounds the compressed size.
+    """
+    if detector is None:
+        return overloaded('Model is still loading, retry shortly')
+    try:
+        active_batcher = get_batcher()
+        if active_batcher is not None:
+            active_batcher.check_capacity()
+        
+        # Flask closes uploaded files when the view returns, before the response
+        # streams, so take ownership of the data here
+        if 'archive' in request.files:
+            archive = tempfile.TemporaryFile()
+            request.files['archive'].save(archive)
+            items = iter_archive_images(archive,
+                                        max_image_bytes=int(app.config['MAX_ARCHIVE_IMAGE_MB'] * 1024 * 1024),
+                                        max_total_bytes=int(app.config['MAX_ARCHIVE_TOTAL_MB'] * 1024 * 1024))
+        elif 'images' in request.files:
+            items = [(f.filename, f.read()) for f in request.files.getlist('images')]
+        else:
+            return jsonify({'error': "Provide 'images' files or an 'archive' upload"}), 400
+    except QueueFullError:
+        return overloaded('Server is at capacity, retry shortly')
+    except HTTPException:
+        raise
+    except Exception as e:
+        return jsonify({'error': str(e)}), 400
+    
+    lines = (json.dumps(result) + '\n' for result in predict_items(items))
+    return Response(stream_with_context(lines), mimetype='application/x-ndjson')
+
+def iter_archive_images(stream, max_image_bytes=None, max_total_bytes=None):
+    """
+    Yield (name, bytes) for each image in a zip or tar archive, one member at a time, then close it
+    
+    Members are checked against the limits by their uncompressed size before
+    anything is decompressed. An oversized member is yielded as (name,
+    ValueError) and skipped. Once the total would pass ``max_total_bytes``, an
+    error item is yielded and the rest of the archive is skipped.
+    
+    Args:
+        stream: Seekable file object holding the archive
+        max_image_bytes (int): Largest uncompressed member to read (None = unlimited)
+        max_total_bytes (int): Largest uncompressed total to read (None = unlimited)
+    """
+    from src.datasets import is_image_file
+    
+    def members():
+        stream.seek(0)
+        if zipfile.is_zipfile(stream):
+            stream.seek(0)
+            with zipfile.ZipFile(stream) as archive:
+                for info in archive.infolist():
+                    if not info.is_dir() and is_image_file(info.filename):
+                        # ZipExtFile never returns more than the declared file_size
+                        yield info.filename, info.file_size, lambda info=info: archive.read(info)
+            return
+        stream.seek(0)
+        with tarfile.open(fileobj=stream, mode='r:*') as archive:
+            for member in archive:
+                if member.isfile() and is_image_file(member.name):
+                    yield member.name, member.size, lambda member=member: archive.extractfile(member).read()
+    
+    total = 0
+    with stream:
+        for name, size, read in members():
+            if max_image_bytes is not None and size > max_image_bytes:
+                yield name, ValueError(f'Image is {size / (1024 * 1024):.1f} MB uncompressed, over the '
+                                       f'{max_image_bytes / (1024 * 1024):.1f} MB limit')
+                continue
+            total += size
+            if max_total_bytes is not None and total > max_total_bytes:
+                yield name, ValueError(f'Archive exceeds the {max_total_bytes / (1024 * 1024):.1f} MB '
+                                       f'uncompressed limit; remaining images were skipped')
+                return
+            try:
+                data = read()
+            except (zipfile.BadZipFile, tarfile.TarError, EOFError, OSError) as e:
+                data = ValueError(f'Could not read archive member: {e}')
+            yield name, data
+
+def predict_items(items):
+    """
+    Decode (name, bytes) items on the decode pool and score them batch by batch
+    
+    The next batch is already decoding while the current one runs through the
+    model. Every batch's uncached images count against the micro-batcher's
+    queue limit until the batch is answered; a batch that doesn't fit even
+    once the previous one is answered gets a per-image capacity error. Items whose bytes are an exception are reported
+    as errors. Yields one result dict per item, in input order.
+    """
+    batch_size = app.config['BATCH_ENDPOINT_SIZE']
+    max_items = app.config['MAX_BATCH_ITEMS']
+    pool = get_decode_pool()
+    active_batcher = get_batcher()
+    items = iter(items)
+    index = 0
+    pending, admitted = [], 0
+    try:
+        while True:
+            chunk = list(islice(items, min(batch_size, max_items - index)))
+            if not chunk:
+                break
+            lookups = []
+            for name, image_bytes in chunk:
+                if isinstance(image_bytes, Exception):
+                    lookups.append([name, None, None, {'error': str(image_bytes)}])
+                else:
+                    lookups.append([name, image_bytes, *detector.cache_lookup(image_bytes)])
+            needed = sum(1 for lookup in lookups if lookup[3] is None)
+            chunk_admitted = 0
+            if needed and active_batcher is not None:
+                for attempt in range(2):
+                    try:
+                        active_batcher.admit(needed)
+                        chunk_admitted = needed
+                        break
+                    except QueueFullError:
+                        if attempt == 0 and pending:
+                            # The previous batch may be what fills the queue: answer it first, then retry
+                            yield from finish_batch(pending)
+                            active_batcher.release(admitted)
+                            pending, admitted = [], 0
+                            continue
+                        for lookup in lookups:
+                            if lookup[3] is None:
+                                lookup[3] = {'error': 'Server is at capacity, retry shortly'}
+                        break
+            submitted = []
+            for name, image_bytes, cache_key, cached in lookups:
+                future = pool.submit(detector.preprocess_image, image_bytes) if cached is None else None
+                submitted.append((index, name, cache_key, cached, future))
+                index += 1
+            yield from finish_batch(pending)
+            if admitted:
+                active_batcher.release(admitted)
+            pending, admitted = submitted, chunk_admitted
+        yield from finish_batch(pending)
+    finally:
+        # Also reached when the client disconnects mid-stream
+        if admitted:
+            active_batcher.release(admitted)
+    
+    if index >= max_items and next(items, None) is not None:
+        yield {'index': index, 'error': f'Batch limit of {max_items} images reached; remaining images were skipped'}
+
+def finish_batch(submitted):
+    """Wait for a batch's decodes, run one forward pass and yield per-image results"""
+    import torch
+    
+    results, tensors, keys = {}, [], []
+    for index, name, cache_key, cached, future in submitted:
+        if cached is not None:
+            results[index] = {'index': index, 'filename': name, **cached}
+            continue
+        try:
+            tensors.append(future.result())
+            keys.append((index, name, cache_key))
+        except Exception as e:
+            results[index] = {'index': index, 'filename': name, 'error': f'Could not decode image: {e}'}
+    if tensors:
+        try:
+            predictions = detector.predict_tensors(torch.cat(tensors), views=[len(t) for t in tensors])
+        except Exception as e:
+            predictions = [{'error': str(e)}] * len(keys)
+        for (index, name, cache_key), prediction in zip(keys, predictions):
+            if 'error' not in prediction:
+                detector.cache_store(cache_key, prediction)
+            results[index] = {'index': index, 'filename': name, **prediction}
+    for index, _, _, _, _ in submitted:
+        yield results[index]
+
+def get_decode_pool():
+    """Return this process's decode thread pool, creating it after a fork if needed"""
+    global decode_pool, _decode_pool_pid
+    if decode_pool is None or _decode_pool_pid != os.getpid():
+        with _batcher_lock:
+            if decode_pool is None or _decode_pool_pid != os.getpid():
+                decode_pool = ThreadPoolExecutor(max_workers=app.config['DECODE_THREADS'],
+                                                 thread_name_prefix='decode')
+                _decode_pool_pid = os.getpid()
+    return decode_pool
+
 @app.route('/health')
 def health():
     """Health check endpoint"""
-    return jsonify({
+    health_info = {
         'status': 'healthy',
         'model_loaded': detector is not None,
-        'device': str(detector.device) if detector else 'unknown'
-    })
+        'device': str(detector.device) if detector else 'unknown',
+        'startup': startup.snapshot(),
+    }
+    active_batcher = get_batcher()
+    if active_batcher is not None:
+        health_info['batching'] = active_batcher.stats()
+    if detector is not None and detector.cache is not None:
+        health_info['cache'] = detector.cache.stats()
+    if detector is not None:
+        health_info['models'] = detector.status()
+    if detector is not None and detector.fast_model is not None:
+        health_info['cascade'] = {'threshold': detector.cascade_threshold, 'answered': dict(detector.stage_counts)}
+    return jsonify(health_info)
+
+@app.route('/models')
+def models():
+    """Active and candidate model versions, traffic split and shadow agreement for this worker"""
+    if detector is None:
+        return jsonify({'status': startup.status}), 503
+    return jsonify(detector.status())
 
-def load_detector(checkpoint_path='models/detector.pth'):
-    """Load the AI Art Detector"""
-    global detector
-    detector = ArtDetector(checkpoint_path)
+def require_admin():
+    """Error response unless the request carries the configured admin token"""
+    token = app.config['ADMIN_TOKEN']
+    if not token:
+        return jsonify({'error': 'Model admin endpoints are disabled; set ADMIN_TOKEN to enable them'}), 403
+    # Constant-time comparison, so response timing doesn't reveal how much of a guess matched
+    if not hmac.compare_digest(request.headers.get('X-Admin-Token', '').encode(), token.encode()):
+        return jsonify({'error': 'Invalid admin token'}), 403
+    if detector is None:
+        return overloaded('Model is still loading, retry shortly')
+    return None
+
+@app.route('/models/reload', methods=['POST'])
+def reload_model():
+    """
+    Load a checkpoint in the background, validate it and swap it in (this worker only)
+    
+    JSON or form fields: ``checkpoint`` (default: the active checkpoint),
+    ``role`` ('active' or 'candidate'), ``mode`` ('ab' or 'shadow') and
+    ``fraction`` for candidates.
+    """
+    denied = require_admin()
+    if denied is not None:
+        return denied
+    params = request.get_json(silent=True) or request.form
+    checkpoint = params.get('checkpoint') or detector.active.checkpoint_path
+    try:
+        detector.load(checkpoint, candidate=params.get('role', 'active') == 'candidate',
+                      mode=params.get('mode', 'shadow'), fraction=float(params.get('fraction', 0.1)))
+    except RuntimeError as e:
+        return jsonify({'error': str(e)}), 409
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    return jsonify({'status': 'loading', 'checkpoint': checkpoint}), 202
+
+@app.route('/models/promote', methods=['POST'])
+def promote_model():
+    """Make this worker's candidate the active model"""
+    denied = require_admin()
+    if denied is not None:
+        return denied
+    try:
+        detector.promote()
+    except RuntimeError as e:
+        return jsonify({'error': str(e)}), 409
+    return jsonify(detector.status())
+
+@app.route('/models/traffic', methods=['POST'])
+def model_traffic():
+    """Change the candidate's ``mode`` and/or ``fraction``; ``fraction`` 0 pauses it"""
+    denied = require_admin()
+    if denied is not None:
+        return denied
+    params = request.get_json(silent=True) or request.form
+    try:
+        fraction = params.get('fraction')
+        detector.set_traffic(params.get('mode'), None if fraction is None else float(fraction))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    return jsonify(detector.status())
+
+@app.route('/metrics')
+def metrics():
+    """Prometheus metrics for this worker process"""
+    return Response(render_prometheus(), mimetype='text/plain; version=0.0.4')
+
+def collect_serving_metrics():
+    """Batcher and cache counters, read at scrape time"""
+    samples = [
+        ('art_detector_ready', 'gauge', 'Whether the model is loaded and warmed up', int(startup.ready)),
+    ]
+    for phase in ('import', 'load_model', 'warmup', 'total'):
+        if phase in startup.phases:
+            samples.append((f'art_detector_startup_{phase}_seconds', 'gauge',
+                            f'Seconds spent in the {phase} startup phase', startup.phases[phase]))
+    active_batcher = get_batcher()
+    if active_batcher is not None:
+        stats = active_batcher.stats()
+        samples += [
+            ('art_detector_queue_depth', 'gauge', 'Requests waiting for a batch', stats['queue_depth']),
+            ('art_detector_inflight_requests', 'gauge', 'Requests admitted and not yet answered', stats['pending']),
+            ('art_detector_rejected_total', 'counter', 'Requests shed because the queue was full', stats['rejected']),
+            ('art_detector_batches_total', 'counter', 'Batched forward passes run', stats['batches']),
+            ('art_detector_batched_requests_total', 'counter', 'Requests served by batched forward passes', stats['requests']),
+        ]
+    if detector is not None and detector.cache is not None:
+        stats = detector.cache.stats()
+        samples += [
+            ('art_detector_cache_memory_hits_total', 'counter', 'Prediction cache hits in memory', stats['memory_hits']),
+            ('art_detector_cache_disk_hits_total', 'counter', 'Prediction cache hits in the sqlite tier', stats['disk_hits']),
+            ('art_detector_cache_misses_total', 'counter', 'Prediction cache misses', stats['misses']),
+            ('art_detector_cache_entries', 'gauge', 'Predictions held in memory', stats['entries']),
+        ]
+    if detector is not None:
+        status = detector.status()
+        samples.append(('art_detector_model_swaps_total', 'counter', 'Checkpoints swapped in without a restart',
+                        status['swaps']))
+        if 'shadow' in status:
+            samples += [
+                ('art_detector_shadow_compared_total', 'counter', 'Images also scored by the shadow candidate',
+                 status['shadow']['compared']),
+                ('art_detector_shadow_agreement', 'gauge', 'Share of shadowed images where the candidate agreed',
+                 status['shadow']['agreement']),
+            ]
+    if detector is not None and detector.fast_model is not None:
+        samples += [
+            ('art_detector_cascade_fast_total', 'counter', 'Images answered by the cascade first stage',
+             detector.stage_counts['fast']),
+            ('art_detector_cascade_full_total', 'counter', 'Images passed on to the full model',
+             detector.stage_counts['full']),
+        ]
+    return samples
+
+register_collector(collect_serving_metrics)
+
+def configure_profiler(every_n=0, output_dir='profiles', kind='cprofile'):
+    """
+    Profile every Nth /predict request and dump the trace to ``output_dir``
+    
+    Args:
+        every_n (int): Sampling interval; 0 disables profiling
+        output_dir (str): Directory receiving the trace files
+        kind (str): 'cprofile' or 'torch'
+    """
+    global profiler
+    profiler = RequestProfiler(every_n, output_dir, kind) if every_n > 0 else None
+
+def get_batcher():
+    """Return this process's micro-batcher, starting it after a fork if needed"""
+    global batcher, _batcher_pid
+    if batcher_config is None or detector is None:
+        return None
+    if batcher is None or _batcher_pid != os.getpid():
+        from src.inference import MicroBatcher
+        
+        with _batcher_lock:
+            if batcher is None or _batcher_pid != os.getpid():
+                batcher = MicroBatcher(detector, **batcher_config)
+                _batcher_pid = os.getpid()
+    return batcher
+
+def load_detector(checkpoint_path='models/detector.pth', max_batch_size=1, max_wait_ms=5.0,
+                  max_queue_size=0, mmap_weights=False, cache_size=0, cache_db=None, backend='eager', preprocess='pil',
+                  tta_tiles=0, tta_flip=False, tta_budget_ms=None, tta_max_side=1024, cascade_checkpoint=None,
+                  cascade_arch='resnet18', cascade_threshold=None, watch_interval=0.0, candidate_checkpoint=None,
+                  candidate_mode='shadow', candidate_fraction=0.1):
+    """
+    Load the AI Art Detector behind a ``ModelRegistry`` for zero-downtime checkpoint swaps
+    
+    Args:
+        checkpoint_path (str): Path to the trained model checkpoint
+        max_batch_size (int): Batch concurrent requests together when greater than 1
+        max_wait_ms (float): Maximum time a request waits for its batch to fill
+        max_queue_size (int): Run inference on the batcher thread and reject requests
+            with 503 once this many are in flight (0 disables the limit)
+        mmap_weights (bool): Memory-map the checkpoint so worker processes share the weights.
+            The live weights then read the file itself, so the checkpoint must only ever be
+            replaced by an atomic rename, never overwritten in place
+        cache_size (int): Number of predictions to keep in the in-memory LRU cache
+        cache_db (str): Optional sqlite file shared by all workers as a persistent cache tier
+        backend (str): 'eager', 'torchscript' or 'onnx' (see ``python -m src.export``)
+        preprocess (str): 'pil' or 'fast' image preprocessing
+        tta_tiles (int): Tiles classified alongside the resized image (0 disables)
+        tta_flip (bool): Also classify horizontally flipped copies of every view
+        tta_budget_ms (float): Drop views so a single image's forward pass fits this budget
+        tta_max_side (int): Cut tiles from the image capped at this shorter side (None keeps full resolution)
+        cascade_checkpoint (str): Small first-stage model that answers confident images
+        cascade_arch (str): Architecture of ``cascade_checkpoint``
+        cascade_threshold (float): First-stage confidence needed to answer (default: calibrated value)
+        watch_interval (float): Seconds between checks of the checkpoint file; a changed
+            file is loaded, validated and swapped in (0 disables watching). Watching
+            turns ``mmap_weights`` off, since the watched file may be overwritten in place
+        candidate_checkpoint (str): Optional second model that receives a share of the traffic
+        candidate_mode (str): 'shadow' (compare only) or 'ab' (the candidate answers its share)
+        candidate_fraction (float): Share of images routed to the candidate
+    """
+    global detector, batcher, batcher_config, _batcher_pid, _registry_tasks
+    startup.set_status('loading')
+    with startup.phase('import'):
+        from src.inference import ArtDetector, ModelRegistry
+    cache = PredictionCache(max_entries=cache_size, db_path=cache_db) if cache_size > 0 or cache_db else None
+    if mmap_weights and watch_interval > 0:
+        print("Not memory-mapping the weights: the watched checkpoint may be overwritten in place")
+        mmap_weights = False
+    detector_kwargs = dict(mmap_weights=mmap_weights, cache=cache, backend=backend,
+                           preprocess=preprocess, tta_tiles=tta_tiles, tta_flip=tta_flip,
+                           tta_budget_ms=tta_budget_ms, tta_max_side=tta_max_side,
+                           cascade_checkpoint=cascade_checkpoint,
+                           cascade_arch=cascade_arch, cascade_threshold=cascade_threshold)
+    with startup.phase('load_model'):
+        detector = ModelRegistry(ArtDetector(checkpoint_path, **detector_kwargs), detector_kwargs)
+    # Started by warm_up, in the process that serves requests
+    _registry_tasks = {'watch_interval': watch_interval, 'candidate_checkpoint': candidate_checkpoint,
+                       'candidate_mode': candidate_mode, 'candidate_fraction': candidate_fraction}
+    startup.set_status('loaded')
+    if batcher is not None and _batcher_pid == os.getpid():
+        batcher.close()
+    batcher = _batcher_pid = None
+    batcher_config = None
+    if max_batch_size > 1 or max_queue_size > 0:
+        batcher_config = {'max_batch_size': max_batch_size, 'max_wait_ms': max_wait_ms,
+                          'max_queue_size': max_queue_size}
     return detector
 
+def warm_up(batch_sizes=(1,)):
+    """
+    Run the detector's warmup passes in this process, then mark it ready
+    
+    Args:
+        batch_sizes: Images per warmup forward pass; empty skips the forward passes
+    """
+    startup.set_status('warming')
+    with startup.phase('warmup'):
+        timings = detector.warmup(batch_sizes)
+    for batch_size, seconds in timings.items():
+        startup.record(f'warmup_batch_{batch_size}', seconds)
+    startup.set_status('ready')
+    
+    # Reloaded and candidate models get the same warmup before they serve
+    detector.warmup_batch_sizes = tuple(batch_sizes)
+    detector.watch(_registry_tasks['watch_interval'])
+    if _registry_tasks['candidate_checkpoint'] and detector.candidate is None:
+        detector.load(_registry_tasks['candidate_checkpoint'], candidate=True,
+                      mode=_registry_tasks['candidate_mode'], fraction=_registry_tasks['candidate_fraction'])
+
+def schedule_loading(warmup_batch_sizes=(1,), **detector_args):
+    """
+    Defer loading and warmup until ``start_loading`` runs in the serving process
+    
+    Under gunicorn the master only records this; each forked worker then loads
+    (if ``detector_args`` are given) and warms up on its own background thread,
+    since threads and warmed thread pools don't survive fork.
+    
+    Args:
+        warmup_batch_sizes: Batch sizes passed to ``warm_up``
+        **detector_args: ``load_detector`` arguments; omit them if the detector
+            is already loaded and only needs warming up
+    """
+    global _pending_load, _warmup_batch_sizes
+    _pending_load = detector_args or None
+    _warmup_batch_sizes = tuple(warmup_batch_sizes)
+
+def start_loading():
+    """Start the scheduled load and warmup on a background thread, once per process"""
+    global _loader_pid
+    if _warmup_batch_sizes is None or _loader_pid == os.getpid():
+        return
+    with _batcher_lock:
+        if _loader_pid == os.getpid():
+            return
+        _loader_pid = os.getpid()
+    threading.Thread(target=_finish_loading, name='model-loader', daemon=True).start()
+
+def _finish_loading():
+    try:
+        if detector is None:
+            load_detector(**_pending_load)
+        warm_up(_warmup_batch_sizes)
+    except Exception as e:
+        traceback.print_exc()
+        startup.set_status('failed', f'{type(e).__name__}: {e}')
+
+def parse_batch_sizes(value):
+    """'1,8' -> (1, 8); empty or '0' disables the warmup forward passes"""
+    return tuple(sorted({int(v) for v in str(value).split(',') if v.strip() and int(v) > 0}))
+
+def create_app(checkpoint_path=None):
+    """
+    App factory for WSGI servers, e.g. ``gunicorn -c gunicorn.conf.py "app:create_app()"``
+    
+    Loads the detector once; with ``preload_app`` this happens in the gunicorn
+    master and the weights are shared copy-on-write by every forked worker.
+    Configuration comes from the environment:
+    
+    - ``MODEL_CHECKPOINT``: checkpoint path (default ``models/detector.pth``)
+    - ``MMAP_WEIGHTS``: memory-map the checkpoint instead of reading it into memory
+      (default off). Only safe if the checkpoint is replaced by atomic rename: a file
+      overwritten in place changes, or with a shorter file crashes (SIGBUS), live workers
+    - ``BATCH_MAX_SIZE`` / ``BATCH_MAX_WAIT_MS``: micro-batching settings
+    - ``MAX_QUEUE_DEPTH``: in-flight requests per worker before shedding load with 503 (default 64,
+      0 disables); only reachable if the worker has more request threads (see ``gunicorn.conf.py``)
+    - ``INFERENCE_TIMEOUT``: seconds to wait for a queued inference (default 30)
+    - ``MAX_UPLOAD_MB``: largest accepted upload (default 32)
+    - ``BATCH_ENDPOINT_SIZE`` / ``DECODE_THREADS`` / ``MAX_BATCH_ITEMS``: ``/predict_batch`` settings
+    - ``MAX_ARCHIVE_IMAGE_MB`` / ``MAX_ARCHIVE_TOTAL_MB``: uncompressed per-image and total limits
+      for ``/predict_batch`` archives (default 32 and 1024)
+    - ``PROFILE_EVERY_N`` / ``PROFILE_DIR`` / ``PROFILER``: sample every Nth ``/predict`` with
+      'cprofile' or 'torch' and write traces to ``PROFILE_DIR`` (default ``profiles``)
+    - ``PREDICTION_CACHE_SIZE``: in-memory prediction cache entries (default 1024, 0 disables)
+    - ``PREDICTION_CACHE_DB``: sqlite file for a cache tier shared by all workers
+    - ``MODEL_BACKEND``: 'eager' (default), 'torchscript' or 'onnx'
+    - ``PREPROCESS``: 'pil' (default) or 'fast'
+    - ``TTA_TILES`` / ``TTA_FLIP`` / ``TTA_BUDGET_MS``: test-time augmentation (tiles, flips, latency budget)
+    - ``TTA_MAX_SIDE``: tiles are cut from the image capped at this shorter side
+      (default 1024; 0 or empty keeps full resolution)
+    - ``CASCADE_CHECKPOINT`` / ``CASCADE_ARCH`` / ``CASCADE_THRESHOLD``: early-exit first stage
+    - ``BACKGROUND_LOAD``: load the model in each worker after it starts serving
+      instead of in the master before forking (``/readyz`` reports when it is done)
+    - ``MODEL_WATCH_INTERVAL``: seconds between checks of the checkpoint file; every
+      worker hot-swaps in a changed checkpoint after validating it (default 0, off)
+    - ``CANDIDATE_CHECKPOINT`` / ``CANDIDATE_MODE`` / ``CANDIDATE_FRACTION``: second model
+      receiving a share of the traffic, 'shadow' (default) or 'ab', default fraction 0.1
+    - ``ADMIN_TOKEN``: enables the ``/models/*`` admin endpoints for requests sending it
+      in ``X-Admin-Token``
+    - ``WARMUP_BATCH_SIZES``: comma-separated batch sizes of the warmup forward
+      passes every worker runs before ``/readyz`` succeeds (default ``1,BATCH_MAX_SIZE``)
+    """
+    if detector is None:
+        app.config['MAX_CONTENT_LENGTH'] = int(float(os.environ.get('MAX_UPLOAD_MB', 32)) * 1024 * 1024)
+        app.config['INFERENCE_TIMEOUT'] = float(os.environ.get('INFERENCE_TIMEOUT', 30))
+        app.config['ADMIN_TOKEN'] = os.environ.get('ADMIN_TOKEN') or None
+        for key in ('BATCH_ENDPOINT_SIZE', 'DECODE_THREADS', 'MAX_BATCH_ITEMS'):
+            app.config[key] = int(os.environ.get(key, app.config[key]))
+        for key in ('MAX_ARCHIVE_IMAGE_MB', 'MAX_ARCHIVE_TOTAL_MB'):
+            app.config[key] = float(os.environ.get(key, app.config[key]))
+        configure_profiler(int(os.environ.get('PROFILE_EVERY_N', 0)),
+                           os.environ.get('PROFILE_DIR', 'profiles'),
+                           os.environ.get('PROFILER', 'cprofile'))
+        max_batch_size = int(os.environ.get('BATCH_MAX_SIZE', 1))
+        detector_args = dict(
+            checkpoint_path=checkpoint_path or os.environ.get('MODEL_CHECKPOINT', 'models/detector.pth'),
+            max_batch_size=max_batch_size,
+            max_wait_ms=float(os.environ.get('BATCH_MAX_WAIT_MS', 5.0)),
+            max_queue_size=int(os.environ.get('MAX_QUEUE_DEPTH', 64)),
+            mmap_weights=os.environ.get('MMAP_WEIGHTS', '0').lower() in ('1', 'true', 'yes'),
+            cache_size=int(os.environ.get('PREDICTION_CACHE_SIZE', 1024)),
+            cache_db=os.environ.get('PREDICTION_CACHE_DB') or None,
+            backend=os.environ.get('MODEL_BACKEND', 'eager'),
+            preprocess=os.environ.get('PREPROCESS', 'pil'),
+            tta_tiles=int(os.environ.get('TTA_TILES', 0)),
+            tta_flip=os.environ.get('TTA_FLIP', '0').lower() in ('1', 'true', 'yes'),
+            tta_budget_ms=float(os.environ['TTA_BUDGET_MS']) if os.environ.get('TTA_BUDGET_MS') else None,
+            tta_max_side=int(os.environ.get('TTA_MAX_SIDE', 1024) or 0) or None,
+            cascade_checkpoint=os.environ.get('CASCADE_CHECKPOINT') or None,
+            cascade_arch=os.environ.get('CASCADE_ARCH', 'resnet18'),
+            cascade_threshold=float(os.environ['CASCADE_THRESHOLD']) if os.environ.get('CASCADE_THRESHOLD') else None,
+            watch_interval=float(os.environ.get('MODEL_WATCH_INTERVAL', 0)),
+            candidate_checkpoint=os.environ.get('CANDIDATE_CHECKPOINT') or None,
+            candidate_mode=os.environ.get('CANDIDATE_MODE', 'shadow'),
+            candidate_fraction=float(os.environ.get('CANDIDATE_FRACTION', 0.1)),
+        )
+        warmup_batch_sizes = parse_batch_sizes(os.environ.get('WARMUP_BATCH_SIZES', f'1,{max_batch_size}'))
+        if os.environ.get('BACKGROUND_LOAD', '0').lower() in ('1', 'true', 'yes'):
+            schedule_loading(warmup_batch_sizes, **detector_args)
+        else:
+            load_detector(**detector_args)
+            schedule_loading(warmup_batch_sizes)
+    return app
+
 if __name__ == '__main__':
     # Load detector on startup
     load_detector()
+    warm_up()
     # Get port from environment variable (for deployment) or use default
     port = int(os.environ.get('PORT', 5000))
     app.run(debug=False, host='0.0.0.0', port=port)
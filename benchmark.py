@@ -0,0 +1,326 @@
+#!/usr/bin/env python3
+"""
+Inference benchmark suite for the AI Art Detector
+
+Times each stage separately (image decode, preprocessing, model forward pass)
+and full /predict round-trips against a running server, then prints
+throughput and p50/p95/p99 latency as JSON.
+
+Examples:
+  python benchmark.py decode preprocess --images data/val
+  python benchmark.py forward --batch_sizes 1 8 32 --threads 1 4 --backends eager:models/detector.pth
+  python benchmark.py http --url http://localhost:5000 --concurrency 1 8 32 --requests 200
+  python benchmark.py all --output bench.json --compare baseline.json
+  python benchmark.py autotune --images data/val --target_p95_ms 50 --requests 400
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import torch
+from PIL import Image
+
+from src.datasets import walk_image_files
+from src.inference import ArtDetector, InferencePool
+from src.preprocess import open_image
+
+STAGES = ('decode', 'preprocess', 'forward', 'http')
+
+def summarize(latencies, items=None, wall_time=None):
+    """Latency percentiles in ms plus throughput in items per second"""
+    latencies = np.asarray(latencies, dtype=np.float64) * 1000.0
+    count = len(latencies)
+    items = count if items is None else items
+    wall_time = latencies.sum() / 1000.0 if wall_time is None else wall_time
+    return {
+        'count': count,
+        'mean_ms': float(latencies.mean()) if count else 0.0,
+        'p50_ms': float(np.percentile(latencies, 50)) if count else 0.0,
+        'p95_ms': float(np.percentile(latencies, 95)) if count else 0.0,
+        'p99_ms': float(np.percentile(latencies, 99)) if count else 0.0,
+        'throughput': items / wall_time if wall_time > 0 else 0.0,
+    }
+
+def timed(fn, *args):
+    start = time.perf_counter()
+    fn(*args)
+    return time.perf_counter() - start
+
+def load_images(args):
+    """Raw bytes of benchmark images: files from --images, or synthetic JPEGs"""
+    if args.images:
+        paths = []
+        for path in walk_image_files(args.images):
+            paths.append(path)
+            if len(paths) >= args.num_images:
+                break
+        images = []
+        for path in paths:
+            with open(path, 'rb') as f:
+                images.append(f.read())
+        return images
+    rng = np.random.default_rng(0)
+    images = []
+    for i in range(args.num_images):
+        width, height = args.synthetic_sizes[i % len(args.synthetic_sizes)]
+        # Smooth random content compresses like a photo rather than like noise
+        base = rng.integers(0, 256, (height // 50 + 1, width // 50 + 1, 3), dtype=np.uint8)
+        buf = io.BytesIO()
+        Image.fromarray(base).resize((width, height), Image.BICUBIC).save(buf, format='JPEG', quality=90)
+        images.append(buf.getvalue())
+    return images
+
+def bench_decode(args, images):
+    results = []
+    for mode, draft_size in (('full', None), ('draft', (224, 224))):
+        for _ in range(args.warmup):
+            open_image(images[0], draft_size)
+        latencies = [timed(open_image, image, draft_size) for _ in range(args.repeat) for image in images]
+        results.append({'stage': 'decode', 'mode': mode, **summarize(latencies)})
+    return results
+
+def bench_preprocess(args, images):
+    results = []
+    for mode in args.preprocess:
+        detector = ArtDetector(args.checkpoint, device='cpu', preprocess=mode)
+        for _ in range(args.warmup):
+            detector.preprocess_image(images[0])
+        latencies = [timed(detector.preprocess_image, image) for _ in range(args.repeat) for image in images]
+        results.append({'stage': 'preprocess', 'preprocess': mode, **summarize(latencies)})
+    return results
+
+def bench_forward(args):
+    results = []
+    original_threads = torch.get_num_threads()
+    for spec in args.backends:
+        backend, _, path = spec.partition(':')
+        detector = ArtDetector(path or args.checkpoint, device='cpu', backend=backend)
+        for threads in args.threads:
+            torch.set_num_threads(threads)
+            for batch_size in args.batch_sizes:
+                x = torch.randn(batch_size, 3, 224, 224)
+                for _ in range(args.warmup):
+                    detector.predict_tensors(x)
+                latencies = [timed(detector.predict_tensors, x) for _ in range(args.forward_iters)]
+                results.append({
+                    'stage': 'forward', 'backend': backend, 'model_id': detector.model_id,
+                    'threads': threads, 'batch_size': batch_size,
+                    **summarize(latencies, items=batch_size * len(latencies)),
+                })
+    torch.set_num_threads(original_threads)
+    return results
+
+def bench_http(args, images):
+    import requests
+
+    def post(image):
+        start = time.perf_counter()
+        response = session.post(f'{args.url}/predict', files={'image': ('bench.jpg', image, 'image/jpeg')})
+        return time.perf_counter() - start, response.status_code
+
+    results = []
+    session = requests.Session()
+    session.mount('http://', requests.adapters.HTTPAdapter(pool_maxsize=max(args.concurrency)))
+    for _ in range(args.warmup):
+        post(images[0])
+    for concurrency in args.concurrency:
+        work = [images[i % len(images)] for i in range(args.requests)]
+        if not args.allow_cache:
+            # Trailing bytes after the JPEG end marker are ignored by decoders but
+            # make every upload unique, so the server's prediction cache never hits
+            work = [image + os.urandom(16) for image in work]
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            outcomes = list(pool.map(post, work))
+        wall_time = time.perf_counter() - start
+        ok = [latency for latency, status in outcomes if status == 200]
+        status_counts = {}
+        for _, status in outcomes:
+            status_counts[str(status)] = status_counts.get(str(status), 0) + 1
+        results.append({
+            'stage': 'http', 'concurrency': concurrency, 'status_counts': status_counts,
+            **summarize(ok, wall_time=wall_time),
+        })
+    return results
+
+def bench_autotune(args, images):
+    """
+    Serve the images through an ``InferencePool`` at every replicas x threads split
+
+    Each split gets ``replicas * --pool_concurrency`` closed-loop clients. The
+    best split is the highest-throughput one whose p95 latency meets
+    ``--target_p95_ms``, or the lowest-latency one if none does.
+
+    Returns:
+        tuple: ``(results, best)``
+    """
+    from src.serving import usable_cpus
+
+    cpus = len(usable_cpus())
+    replica_counts = args.replicas or sorted({k for k in (1, 2, 4, 8, 16, 32, 64) if k <= cpus} | {cpus})
+    splits = [(replicas, threads) for replicas in replica_counts
+              for threads in (args.threads_per_replica or [cpus // replicas])
+              if threads >= 1 and replicas * threads <= cpus]
+
+    def request(image):
+        start = time.perf_counter()
+        pool.predict(image)
+        return time.perf_counter() - start
+
+    results = []
+    for replicas, threads in splits:
+        with InferencePool(args.checkpoint, replicas=replicas, threads_per_replica=threads,
+                           max_batch_size=args.pool_batch_size) as pool:
+            concurrency = replicas * args.pool_concurrency
+            work = [images[i % len(images)] for i in range(args.requests)]
+            with ThreadPoolExecutor(max_workers=concurrency) as clients:
+                list(clients.map(request, work[:args.warmup * replicas]))
+                start = time.perf_counter()
+                latencies = list(clients.map(request, work))
+                wall_time = time.perf_counter() - start
+        result = {
+            'stage': 'autotune', 'replicas': replicas, 'threads_per_replica': threads,
+            'concurrency': concurrency, 'max_batch_size': args.pool_batch_size,
+            **summarize(latencies, wall_time=wall_time),
+        }
+        result['meets_target'] = result['p95_ms'] <= args.target_p95_ms
+        print(f"{replicas} replicas x {threads} threads: {result['throughput']:.1f} img/s, "
+              f"p95 {result['p95_ms']:.1f} ms", file=sys.stderr)
+        results.append(result)
+
+    meeting = [r for r in results if r['meets_target']]
+    best = max(meeting, key=lambda r: r['throughput']) if meeting else min(results, key=lambda r: r['p95_ms'])
+    best = {
+        'replicas': best['replicas'],
+        'threads_per_replica': best['threads_per_replica'],
+        'throughput': best['throughput'],
+        'p95_ms': best['p95_ms'],
+        'meets_target': best['meets_target'],
+        'target_p95_ms': args.target_p95_ms,
+        # The same split for the web server: one pinned gunicorn worker per replica
+        'env': {'WEB_CONCURRENCY': best['replicas'], 'TORCH_NUM_THREADS': best['threads_per_replica'],
+                'PIN_WORKERS': 1},
+    }
+    verdict = 'meets' if best['meets_target'] else 'misses'
+    print(f"Best split: {best['replicas']} replicas x {best['threads_per_replica']} threads "
+          f"({best['throughput']:.1f} img/s, p95 {best['p95_ms']:.1f} ms, {verdict} the "
+          f"{args.target_p95_ms:g} ms target)", file=sys.stderr)
+    return results, best
+
+def environment(args):
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True,
+                                text=True, cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except OSError:
+        commit = ''
+    return {
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'git_commit': commit or None,
+        'checkpoint': args.checkpoint,
+        'python': platform.python_version(),
+        'torch': torch.__version__,
+        'cpu_count': os.cpu_count(),
+        'torch_threads': torch.get_num_threads(),
+        'platform': platform.platform(),
+    }
+
+def result_key(result):
+    """Identify a result by everything except its measurements"""
+    measured = {'count', 'mean_ms', 'p50_ms', 'p95_ms', 'p99_ms', 'throughput', 'status_counts', 'model_id',
+                'meets_target'}
+    return json.dumps({k: v for k, v in result.items() if k not in measured}, sort_keys=True)
+
+def compare(report, baseline_path, tolerance):
+    """Flag results whose p50 latency grew or throughput fell by more than ``tolerance``"""
+    with open(baseline_path) as f:
+        baseline = {result_key(r): r for r in json.load(f)['results']}
+    regressions = []
+    for result in report['results']:
+        base = baseline.get(result_key(result))
+        if base is None:
+            continue
+        latency_ratio = result['p50_ms'] / base['p50_ms'] if base['p50_ms'] else 1.0
+        throughput_ratio = result['throughput'] / base['throughput'] if base['throughput'] else 1.0
+        result['baseline'] = {'p50_ratio': latency_ratio, 'throughput_ratio': throughput_ratio}
+        if latency_ratio > 1 + tolerance or throughput_ratio < 1 - tolerance:
+            regressions.append(json.loads(result_key(result)))
+    report['regressions'] = regressions
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the AI Art Detector inference path')
+    parser.add_argument('stages', nargs='+', choices=STAGES + ('autotune', 'all'),
+                        help="Stages to run; 'all' covers every stage except autotune")
+    parser.add_argument('--checkpoint', type=str, default='models/detector.pth')
+    parser.add_argument('--images', type=str, default=None,
+                        help='Directory of images to use (default: synthetic JPEGs)')
+    parser.add_argument('--num_images', type=int, default=32)
+    parser.add_argument('--synthetic_sizes', type=lambda s: tuple(int(v) for v in s.split('x')), nargs='+',
+                        default=[(640, 480), (1920, 1080), (4000, 3000)],
+                        help='WIDTHxHEIGHT sizes of synthetic images')
+    parser.add_argument('--repeat', type=int, default=3, help='Passes over the images for decode/preprocess')
+    parser.add_argument('--warmup', type=int, default=3)
+    parser.add_argument('--preprocess', nargs='+', default=['pil', 'fast'], choices=['pil', 'fast'])
+    parser.add_argument('--backends', nargs='+', default=['eager'],
+                        help='BACKEND[:PATH] entries, e.g. eager torchscript:models/detector_int8.pt')
+    parser.add_argument('--batch_sizes', type=int, nargs='+', default=[1, 8, 32])
+    parser.add_argument('--threads', type=int, nargs='+', default=[torch.get_num_threads()])
+    parser.add_argument('--forward_iters', type=int, default=20)
+    parser.add_argument('--url', type=str, default='http://localhost:5000')
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 8])
+    parser.add_argument('--requests', type=int, default=100, help='Requests per concurrency level')
+    parser.add_argument('--allow_cache', action='store_true',
+                        help="Send repeated images as-is so the server's prediction cache can answer them")
+    parser.add_argument('--replicas', type=int, nargs='+', default=None,
+                        help='autotune: replica counts to try (default: powers of two up to the CPU count)')
+    parser.add_argument('--threads_per_replica', type=int, nargs='+', default=None,
+                        help='autotune: threads per replica to try (default: an even split of the CPUs)')
+    parser.add_argument('--target_p95_ms', type=float, default=100.0,
+                        help='autotune: p95 latency the chosen split must meet')
+    parser.add_argument('--pool_concurrency', type=int, default=1,
+                        help='autotune: closed-loop clients per replica')
+    parser.add_argument('--pool_batch_size', type=int, default=1,
+                        help='autotune: most queued requests a replica runs per forward pass')
+    parser.add_argument('--output', type=str, default=None, help='Also write the JSON report here')
+    parser.add_argument('--compare', type=str, default=None, help='Baseline JSON report to compare against')
+    parser.add_argument('--tolerance', type=float, default=0.1,
+                        help='Allowed relative slowdown before --compare reports a regression')
+    args = parser.parse_args()
+
+    stages = STAGES if 'all' in args.stages else args.stages
+    images = load_images(args) if set(stages) & {'decode', 'preprocess', 'http', 'autotune'} else []
+    report = {'environment': environment(args), 'results': []}
+    # Keep stdout clean for the JSON report; model loading messages go to stderr
+    with contextlib.redirect_stdout(sys.stderr):
+        if 'decode' in stages:
+            report['results'] += bench_decode(args, images)
+        if 'preprocess' in stages:
+            report['results'] += bench_preprocess(args, images)
+        if 'forward' in stages:
+            report['results'] += bench_forward(args)
+        if 'http' in stages:
+            report['results'] += bench_http(args, images)
+        if 'autotune' in stages:
+            results, report['autotune'] = bench_autotune(args, images)
+            report['results'] += results
+
+    regressions = compare(report, args.compare, args.tolerance) if args.compare else []
+    output = json.dumps(report, indent=2)
+    print(output)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output + '\n')
+    if regressions:
+        print(f"{len(regressions)} regression(s) beyond {args.tolerance:.0%}", file=sys.stderr)
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
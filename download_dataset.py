@@ -6,6 +6,11 @@ import os
 import shutil
 import argparse
 import csv
+import hashlib
+import json
+import random
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from pathlib import Path
 
 def download_via_kagglehub(dataset_name="alessandrasala79/ai-vs-human-generated-dataset"):
@@ -23,124 +28,213 @@ def download_via_kagglehub(dataset_name="alessandrasala79/ai-vs-human-generated-
         print(f"✗ Error downloading dataset: {e}")
         return None
 
-def organize_dataset(download_path, target_dir="data", val_split=0.2):
+CLASS_NAMES = ("AI", "Human")
+MANIFEST_NAME = "organize_manifest.jsonl"
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.gif', '.bmp', '.tiff', '.tif', '.webp')
+
+def walk_image_files(root):
+    """Yield the image files below ``root`` in a stable order (stdlib only, so no torch import)"""
+    for dirpath, dirnames, filenames in os.walk(root):
+        dirnames.sort()
+        for filename in sorted(filenames):
+            if filename.lower().endswith(IMAGE_EXTENSIONS):
+                yield Path(dirpath) / filename
+
+def collect_sources(download_path):
     """
-    Organize downloaded dataset into train/val splits with AI/Human folders
-    
+    List the images of a downloaded dataset as ``(source_path, class_name, split)``
+
+    ``split`` is None when the dataset has no validation split of its own, in
+    which case ``plan_split`` assigns one.
+
     This handles the Kaggle dataset structure with CSV files:
     - train.csv: maps file_name to label (0=Human, 1=AI)
     - train_data/: folder with training images
-    - test.csv: maps file_name to label for validation
-    - test_data_v2/: folder with test images
+    and falls back to ``train/{AI,Human}`` plus optional ``val/`` or ``test/`` folders.
     """
-    target_path = Path(target_dir)
-    train_ai = target_path / "train" / "AI"
-    train_human = target_path / "train" / "Human"
-    val_ai = target_path / "val" / "AI"
-    val_human = target_path / "val" / "Human"
-    
-    # Create directories
-    for dir_path in [train_ai, train_human, val_ai, val_human]:
-        dir_path.mkdir(parents=True, exist_ok=True)
-    
     download_path = Path(download_path)
-    
-    # Check for CSV-based structure (Kaggle dataset)
     train_csv = download_path / "train.csv"
-    test_csv = download_path / "test.csv"
-    train_data_dir = download_path / "train_data"
-    test_data_dir = download_path / "test_data_v2"
-    
-    if train_csv.exists() and train_data_dir.exists():
+    if train_csv.exists() and (download_path / "train_data").exists():
         print("Detected CSV-based dataset structure")
-        print("Organizing training set from train.csv...")
-        
-        # Process training data
-        train_ai_count = 0
-        train_human_count = 0
-        
-        with open(train_csv, 'r') as f:
-            reader = csv.DictReader(f)
-            for row in reader:
-                file_name = row['file_name']
-                label = int(row['label'])
-                
+        sources = []
+        with open(train_csv, 'r', newline='') as f:
+            for row in csv.DictReader(f):
                 # Label 0 = Human, Label 1 = AI
-                source_path = download_path / file_name
-                
-                if source_path.exists():
-                    if label == 1:  # AI
-                        dest_path = train_ai / Path(file_name).name
-                        shutil.copy2(source_path, dest_path)
-                        train_ai_count += 1
-                    else:  # Human (label == 0)
-                        dest_path = train_human / Path(file_name).name
-                        shutil.copy2(source_path, dest_path)
-                        train_human_count += 1
-        
-        print(f"  ✓ Copied {train_ai_count} AI images and {train_human_count} Human images to train/")
-        
-        # Split training data into train/val (80/20 split)
-        print("Splitting training data into train/val (80/20)...")
-        import random
-        random.seed(42)  # For reproducibility
-        
-        # Get all files
-        train_ai_files = list(train_ai.glob('*.jpg')) + list(train_ai.glob('*.jpeg')) + list(train_ai.glob('*.png'))
-        train_human_files = list(train_human.glob('*.jpg')) + list(train_human.glob('*.jpeg')) + list(train_human.glob('*.png'))
-        
-        # Shuffle
-        random.shuffle(train_ai_files)
-        random.shuffle(train_human_files)
-        
-        # Split 80/20
-        split_idx_ai = int(len(train_ai_files) * 0.8)
-        split_idx_human = int(len(train_human_files) * 0.8)
-        
-        val_ai_count = 0
-        val_human_count = 0
-        
-        # Move validation AI images
-        for img_file in train_ai_files[split_idx_ai:]:
-            dest_path = val_ai / img_file.name
-            shutil.move(str(img_file), str(dest_path))
-            val_ai_count += 1
-        
-        # Move validation Human images
-        for img_file in train_human_files[split_idx_human:]:
-            dest_path = val_human / img_file.name
-            shutil.move(str(img_file), str(dest_path))
-            val_human_count += 1
-        
-        print(f"  ✓ Moved {val_ai_count} AI images and {val_human_count} Human images to val/")
-    
-    else:
-        # Fallback to folder-based structure
-        print("Trying folder-based structure...")
-        if (download_path / "train").exists():
-            train_dir = download_path / "train"
-            val_dir = download_path / "val" if (download_path / "val").exists() else download_path / "test"
-            
-            if (train_dir / "AI").exists() and (train_dir / "Human").exists():
-                print("Organizing train set...")
-                shutil.copytree(train_dir / "AI", train_ai, dirs_exist_ok=True)
-                shutil.copytree(train_dir / "Human", train_human, dirs_exist_ok=True)
-                
-                if val_dir.exists():
-                    print("Organizing validation set...")
-                    if (val_dir / "AI").exists() and (val_dir / "Human").exists():
-                        shutil.copytree(val_dir / "AI", val_ai, dirs_exist_ok=True)
-                        shutil.copytree(val_dir / "Human", val_human, dirs_exist_ok=True)
-    
-    # Count actual image files (excluding .gitkeep)
-    def count_images(folder):
-        return len([f for f in folder.glob('*') if f.is_file() and f.suffix.lower() in ['.jpg', '.jpeg', '.png', '.gif', '.bmp', '.tiff', '.tif', '.webp']])
-    
+                class_name = "AI" if int(row['label']) == 1 else "Human"
+                sources.append((download_path / row['file_name'], class_name, None))
+        return sources
+
+    print("Trying folder-based structure...")
+    sources = []
+    train_dir = download_path / "train"
+    val_dir = download_path / "val" if (download_path / "val").exists() else download_path / "test"
+    has_val = all((val_dir / c).is_dir() for c in CLASS_NAMES)
+    for split, folder in (("train", train_dir), ("val", val_dir if has_val else None)):
+        if folder is None:
+            continue
+        for class_name in CLASS_NAMES:
+            if (folder / class_name).is_dir():
+                for path in walk_image_files(folder / class_name):
+                    sources.append((path, class_name, split if has_val else None))
+    return sources
+
+def plan_split(sources, val_split=0.2, seed=42):
+    """
+    Decide the split of every image before any file is written
+
+    Images without a split are shuffled per class with a seeded RNG and the
+    last ``val_split`` fraction of each class goes to ``val``, so the split is
+    stratified and identical across runs.
+
+    Returns:
+        list: ``(source_path, split, class_name)`` jobs
+    """
+    rng = random.Random(seed)
+    jobs = []
+    unassigned = {c: [] for c in CLASS_NAMES}
+    for source, class_name, split in sources:
+        if split is None:
+            unassigned[class_name].append(source)
+        else:
+            jobs.append((source, split, class_name))
+    for class_name, files in unassigned.items():
+        rng.shuffle(files)
+        split_idx = int(len(files) * (1 - val_split))
+        jobs.extend((source, "train", class_name) for source in files[:split_idx])
+        jobs.extend((source, "val", class_name) for source in files[split_idx:])
+    return jobs
+
+def assign_names(jobs, root):
+    """
+    Name every job's file inside ``<split>/<class>/``
+
+    Files keep their own name unless another file bound for the same folder
+    shares it (e.g. ``a/1.jpg`` and ``b/1.jpg`` in nested class folders).
+    Those get a short hash of their path below ``root`` as a prefix, so no file
+    overwrites another and the names are the same on every run.
+
+    Returns:
+        list: ``(source_path, split, class_name, name)`` jobs
+    """
+    counts = Counter((split, class_name, source.name) for source, split, class_name in jobs)
+    named = []
+    for source, split, class_name in jobs:
+        name = source.name
+        if counts[(split, class_name, name)] > 1:
+            digest = hashlib.sha1(source.relative_to(root).as_posix().encode()).hexdigest()[:8]
+            name = f"{digest}_{name}"
+        named.append((source, split, class_name, name))
+    return named
+
+def link_or_copy(source, dest, mode="auto"):
+    """
+    Place ``source`` at ``dest``
+
+    ``mode='auto'`` hardlinks when source and target share a filesystem and
+    falls back to ``shutil.copy2`` otherwise; ``'copy'`` always copies.
+    """
+    if dest.exists():
+        # Left over from an interrupted run that never recorded it
+        dest.unlink()
+    if mode == "auto":
+        try:
+            os.link(source, dest)
+            return "link"
+        except OSError:
+            pass
+    shutil.copy2(source, dest)
+    return "copy"
+
+def read_manifest(manifest_path, plan):
+    """Destinations already finished by a previous run with the same ``plan``"""
+    done = set()
+    if not manifest_path.exists():
+        return done
+    with open(manifest_path) as f:
+        lines = f.read().splitlines()
+    if lines and json.loads(lines[0]) != plan:
+        raise ValueError(f"{manifest_path} was written with different settings {lines[0]}; "
+                         f"use a fresh --target_dir or delete the manifest")
+    # A crash can truncate the last line; that file is simply redone
+    for line in lines[1:]:
+        try:
+            done.add(json.loads(line)['dest'])
+        except (ValueError, KeyError):
+            pass
+    return done
+
+def write_index(target_path, split, jobs):
+    """Write ``<split>_index.csv`` (path relative to the split folder, label) for ``ArtDataset``"""
+    index_path = target_path / f"{split}_index.csv"
+    tmp_path = index_path.with_suffix(".csv.tmp")
+    with open(tmp_path, 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(["path", "label"])
+        for _, job_split, class_name, name in jobs:
+            if job_split == split:
+                writer.writerow([f"{class_name}/{name}", class_name])
+    os.replace(tmp_path, index_path)
+    return index_path
+
+def organize_dataset(download_path, target_dir="data", val_split=0.2, seed=42, workers=16, mode="auto"):
+    """
+    Organize downloaded dataset into train/val splits with AI/Human folders
+
+    Single pass: the split is planned up front, files are hardlinked or copied
+    straight into ``<split>/<class>/`` by a thread pool, and each finished file
+    is appended to ``organize_manifest.jsonl`` so an interrupted run resumes
+    where it stopped. Finally ``train_index.csv`` and ``val_index.csv`` are
+    written so ``ArtDataset`` can load the splits without listing directories.
+    """
+    target_path = Path(target_dir)
+    for split in ("train", "val"):
+        for class_name in CLASS_NAMES:
+            (target_path / split / class_name).mkdir(parents=True, exist_ok=True)
+
+    # Plan over every listed file, found or not, so a file appearing or
+    # vanishing between resumed runs never moves another image across splits
+    jobs = assign_names(plan_split(collect_sources(download_path), val_split, seed), Path(download_path))
+    missing = [source for source, _, _, _ in jobs if not source.exists()]
+    if missing:
+        print(f"  Skipping {len(missing)} files listed but not found (e.g. {missing[0]})")
+        missing = set(missing)
+        jobs = [job for job in jobs if job[0] not in missing]
+
+    manifest_path = target_path / MANIFEST_NAME
+    plan = {"source": str(Path(download_path).resolve()), "val_split": val_split, "seed": seed}
+    done = read_manifest(manifest_path, plan)
+    pending = [(source, target_path / split / class_name / name) for source, split, class_name, name in jobs]
+    pending = [(source, dest) for source, dest in pending if str(dest.relative_to(target_path)) not in done]
+    print(f"Organizing {len(jobs)} images ({len(jobs) - len(pending)} already done) with {workers} threads...")
+
+    counts = {"link": 0, "copy": 0}
+    size = manifest_path.stat().st_size if manifest_path.exists() else 0
+    with open(manifest_path, 'a') as manifest, ThreadPoolExecutor(max_workers=workers) as pool:
+        if size == 0:
+            manifest.write(json.dumps(plan) + "\n")
+        else:
+            with open(manifest_path, 'rb') as f:
+                f.seek(size - 1)
+                if f.read(1) != b"\n":
+                    manifest.write("\n")
+        futures = {pool.submit(link_or_copy, source, dest, mode): dest for source, dest in pending}
+        for i, future in enumerate(as_completed(futures), 1):
+            counts[future.result()] += 1
+            manifest.write(json.dumps({"dest": str(futures[future].relative_to(target_path))}) + "\n")
+            if i % 1000 == 0:
+                manifest.flush()
+                print(f"  {i}/{len(pending)}")
+    if pending:
+        print(f"  ✓ Hardlinked {counts['link']} and copied {counts['copy']} files")
+
+    for split in ("train", "val"):
+        print(f"  ✓ Wrote {write_index(target_path, split, jobs)}")
+
     print(f"\n✓ Dataset organized in {target_dir}/")
-    print(f"  Train AI: {count_images(train_ai)} images")
-    print(f"  Train Human: {count_images(train_human)} images")
-    print(f"  Val AI: {count_images(val_ai)} images")
-    print(f"  Val Human: {count_images(val_human)} images")
+    for split in ("train", "val"):
+        for class_name in CLASS_NAMES:
+            count = sum(1 for _, s, c, _ in jobs if s == split and c == class_name)
+            print(f"  {split.capitalize()} {class_name}: {count} images")
 
 def main():
     parser = argparse.ArgumentParser(description='Download and organize AI vs Human dataset')
@@ -153,13 +247,25 @@ def main():
                        help='Target directory for organized dataset')
     parser.add_argument('--organize', action='store_true',
                        help='Automatically organize dataset into train/val structure')
+    parser.add_argument('--source', type=str, default=None,
+                       help='Organize an already downloaded/extracted dataset at this path')
+    parser.add_argument('--val_split', type=float, default=0.2,
+                       help='Fraction of each class held out for validation')
+    parser.add_argument('--seed', type=int, default=42, help='Seed for the train/val split')
+    parser.add_argument('--workers', type=int, default=16, help='Copy threads')
+    parser.add_argument('--copy', action='store_true',
+                       help='Always copy files instead of hardlinking when on the same filesystem')
     
     args = parser.parse_args()
     
-    if args.method == 'kagglehub':
+    options = dict(target_dir=args.target_dir, val_split=args.val_split, seed=args.seed,
+                   workers=args.workers, mode='copy' if args.copy else 'auto')
+    if args.source:
+        organize_dataset(args.source, **options)
+    elif args.method == 'kagglehub':
         download_path = download_via_kagglehub(args.dataset)
         if download_path and args.organize:
-            organize_dataset(download_path, args.target_dir)
+            organize_dataset(download_path, **options)
         elif download_path:
             print(f"\nDataset downloaded to: {download_path}")
             print("To organize it, run with --organize flag")
@@ -168,7 +274,7 @@ def main():
         print("1. Go to: https://www.kaggle.com/datasets/alessandrasala79/ai-vs-human-generated-dataset")
         print("2. Click 'Download' button")
         print("3. Extract the zip file")
-        print("4. Run this script with --organize and provide the extracted path")
+        print("4. Run this script with --source <extracted path>")
 
 if __name__ == '__main__':
     main()
@@ -0,0 +1,88 @@
+"""
+Gunicorn configuration for the AI Art Detector
+
+The app is preloaded in the master so the checkpoint is read once; workers are
+forked afterwards and share its weights copy-on-write. Each
+worker then pins its PyTorch thread pool to its share of the CPU cores and
+warms the model up on a background thread. The workers share readiness
+flags created in the master, so ``/readyz`` answers 503 until every worker
+has warmed up, whichever worker the probe reaches. With ``BACKGROUND_LOAD=1`` the master only imports the (torch-free) app
+module, so workers bind immediately and load the checkpoint themselves. With
+``PIN_WORKERS=1`` each worker is also pinned to its own disjoint, NUMA-local
+set of cores (``python benchmark.py autotune`` suggests the workers x threads
+split).
+
+Usage: gunicorn -c gunicorn.conf.py
+"""
+import gc
+import os
+import sys
+
+bind = f"0.0.0.0:{os.environ.get('PORT', '5000')}"
+workers = int(os.environ.get('WEB_CONCURRENCY', 2))
+timeout = 120
+# Threaded workers: a sync worker handles one request at a time, so the
+# micro-batcher would never see two requests to batch together and the
+# MAX_QUEUE_DEPTH limit could never be reached. Each worker gets enough request
+# threads to fill a batch twice over and a few more than the queue depth, so
+# threads are left to answer 503 once the queue is full instead of excess
+# requests waiting unseen in the listen backlog (GUNICORN_THREADS overrides).
+worker_class = 'gthread'
+threads = int(os.environ.get('GUNICORN_THREADS', 0)) or max(
+    4, 2 * int(os.environ.get('BATCH_MAX_SIZE', 1)), int(os.environ.get('MAX_QUEUE_DEPTH', 64)) + 4)
+preload_app = True
+wsgi_app = 'app:create_app()'
+# Readiness flag per worker slot, created in the master before any worker is forked
+readiness = None
+
+def available_cpus():
+    """Number of CPU cores this process may run on"""
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+def on_starting(server):
+    global readiness
+    from src.serving import WorkerReadiness
+
+    readiness = WorkerReadiness(server.cfg.workers)
+
+def pre_fork(server, worker):
+    # A stable slot per worker (reused when a worker is replaced) picks its core set
+    taken = {getattr(w, 'slot', None) for w in server.WORKERS.values()}
+    worker.slot = min(slot for slot in range(len(taken) + 1) if slot not in taken)
+    # Move everything allocated so far (model, modules) out of the garbage
+    # collector's reach so its bookkeeping doesn't dirty shared pages in workers
+    gc.freeze()
+
+def post_fork(server, worker):
+    # Split the cores between workers instead of letting every worker spin up
+    # a full-size intra-op pool. TORCH_NUM_THREADS overrides the split.
+    num_threads = int(os.environ.get('TORCH_NUM_THREADS', 0)) or max(1, available_cpus() // server.cfg.workers)
+    if os.environ.get('PIN_WORKERS') == '1':
+        from src.serving import plan_core_sets
+
+        try:
+            cores = plan_core_sets(server.cfg.workers, num_threads)[worker.slot % server.cfg.workers]
+            os.sched_setaffinity(0, cores)
+            server.log.info("Worker %s pinned to cores %s", worker.pid, cores)
+        except (ValueError, AttributeError, OSError) as e:
+            server.log.warning("Worker %s not pinned: %s", worker.pid, e)
+    if 'torch' in sys.modules:
+        import torch
+
+        torch.set_num_threads(num_threads)
+    else:
+        # torch is imported later by the background loader; its thread pools start at this size
+        os.environ['OMP_NUM_THREADS'] = os.environ['MKL_NUM_THREADS'] = str(num_threads)
+    server.log.info("Worker %s using %d torch threads", worker.pid, num_threads)
+
+    from app import start_loading, startup
+
+    startup.join_workers(readiness, worker.slot)
+    start_loading()
+
+def child_exit(server, worker):
+    # Not ready again until the replacement worker in this slot has warmed up
+    readiness.set(worker.slot, False)
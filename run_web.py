@@ -5,12 +5,36 @@ Startup script for the AI Art Detector web application
 import os
 import sys
 import argparse
-from app import app, load_detector
+from app import app, configure_profiler, load_detector, parse_batch_sizes, schedule_loading, start_loading, warm_up
 
 def main():
     parser = argparse.ArgumentParser(description='AI Art Detector Web Application')
     parser.add_argument('--checkpoint', type=str, default='models/detector.pth',
                        help='Path to the trained model checkpoint')
+    parser.add_argument('--backend', type=str, default='eager', choices=['eager', 'torchscript', 'onnx'],
+                       help='Checkpoint format: eager state_dict or an artifact from python -m src.export')
+    parser.add_argument('--preprocess', type=str, default='pil', choices=['pil', 'fast'],
+                       help="'fast' decodes JPEGs at reduced size and resizes/normalizes on tensors")
+    parser.add_argument('--tta_tiles', type=int, default=0,
+                       help='Also classify this many 224x224 tiles and average all views (0 disables)')
+    parser.add_argument('--tta_flip', action='store_true',
+                       help='Add horizontally flipped copies of every view')
+    parser.add_argument('--tta_budget_ms', type=float, default=None,
+                       help='Drop views (flips first) so one image stays within this forward-pass budget')
+    parser.add_argument('--tta_max_side', type=int, default=1024,
+                       help='Cut tiles from the image scaled to at most this shorter side (0 keeps full resolution)')
+    parser.add_argument('--cascade_checkpoint', type=str, default=None,
+                       help='Small first-stage model; only images it is unsure about reach --checkpoint')
+    parser.add_argument('--cascade_arch', type=str, default='resnet18',
+                       help='Architecture of --cascade_checkpoint')
+    parser.add_argument('--cascade_threshold', type=float, default=None,
+                       help='First-stage confidence needed to answer (default: calibrated by python -m src.cascade)')
+    parser.add_argument('--profile_every', type=int, default=0,
+                       help='Profile every Nth /predict request (0 disables)')
+    parser.add_argument('--profile_dir', type=str, default='profiles',
+                       help='Directory for profiler traces')
+    parser.add_argument('--profiler', type=str, default='cprofile', choices=['cprofile', 'torch'],
+                       help='Profiler used for sampled requests')
     parser.add_argument('--host', type=str, default='0.0.0.0',
                        help='Host to bind the server to')
     parser.add_argument('--port', type=int, default=5000,
@@ -19,6 +43,34 @@ def main():
                        help='Run in debug mode')
     parser.add_argument('--workers', type=int, default=1,
                        help='Number of worker processes (for production)')
+    parser.add_argument('--batch_size', type=int, default=1,
+                       help='Batch up to this many concurrent requests per forward pass (1 disables batching)')
+    parser.add_argument('--batch_wait_ms', type=float, default=5.0,
+                       help='Maximum milliseconds a request waits for its batch to fill')
+    parser.add_argument('--max_queue', type=int, default=0,
+                       help='Reject requests with 503 once this many are in flight (0 = unbounded)')
+    parser.add_argument('--inference_timeout', type=float, default=None,
+                       help='Seconds a request waits for queued inference before returning 503')
+    parser.add_argument('--max_upload_mb', type=float, default=None,
+                       help='Reject uploads larger than this many MB with 413')
+    parser.add_argument('--cache_size', type=int, default=1024,
+                       help='Number of predictions cached in memory by image content (0 disables)')
+    parser.add_argument('--cache_db', type=str, default=None,
+                       help='Optional sqlite file used as a persistent prediction cache')
+    parser.add_argument('--watch_interval', type=float, default=0.0,
+                       help='Hot-swap the checkpoint when its file changes, checking every N seconds (0 disables)')
+    parser.add_argument('--candidate_checkpoint', type=str, default=None,
+                       help='Second model that receives --candidate_fraction of the traffic')
+    parser.add_argument('--candidate_mode', type=str, default='shadow', choices=['shadow', 'ab'],
+                       help="'shadow' scores the candidate's share off the request path for comparison; 'ab' lets it answer")
+    parser.add_argument('--candidate_fraction', type=float, default=0.1,
+                       help='Share of images routed to the candidate')
+    parser.add_argument('--admin_token', type=str, default=None,
+                       help='Enable the /models admin endpoints for requests sending this X-Admin-Token')
+    parser.add_argument('--warmup_batch_sizes', type=str, default=None,
+                       help='Comma-separated warmup forward-pass batch sizes (default: 1 and --batch_size; 0 disables)')
+    parser.add_argument('--background_load', action='store_true',
+                       help='Start serving immediately and load the model on a background thread (/readyz reports progress)')
     
     args = parser.parse_args()
     
@@ -29,14 +81,46 @@ def main():
         print("To train a model, run: python -m src.train")
         print()
     
+    # Request limits
+    if args.max_upload_mb:
+        app.config['MAX_CONTENT_LENGTH'] = int(args.max_upload_mb * 1024 * 1024)
+    app.config['INFERENCE_TIMEOUT'] = args.inference_timeout
+    app.config['ADMIN_TOKEN'] = args.admin_token
+    configure_profiler(args.profile_every, args.profile_dir, args.profiler)
+    
+    detector_args = dict(checkpoint_path=args.checkpoint, max_batch_size=args.batch_size,
+                         max_wait_ms=args.batch_wait_ms, max_queue_size=args.max_queue,
+                         cache_size=args.cache_size,
+                         cache_db=args.cache_db, backend=args.backend,
+                         preprocess=args.preprocess, tta_tiles=args.tta_tiles,
+                         tta_flip=args.tta_flip, tta_budget_ms=args.tta_budget_ms,
+                         tta_max_side=args.tta_max_side,
+                         cascade_checkpoint=args.cascade_checkpoint, cascade_arch=args.cascade_arch,
+                         cascade_threshold=args.cascade_threshold, watch_interval=args.watch_interval,
+                         candidate_checkpoint=args.candidate_checkpoint, candidate_mode=args.candidate_mode,
+                         candidate_fraction=args.candidate_fraction)
+    warmup_batch_sizes = parse_batch_sizes(args.warmup_batch_sizes or f'1,{args.batch_size}')
+    
     # Load the detector
-    print("Loading AI Art Detector...")
-    try:
-        detector = load_detector(args.checkpoint)
-        print(f"✓ Detector loaded successfully on {detector.device}")
-    except Exception as e:
-        print(f"✗ Failed to load detector: {e}")
-        sys.exit(1)
+    if args.background_load:
+        print("Loading AI Art Detector in the background (GET /readyz reports when it is ready)...")
+        schedule_loading(warmup_batch_sizes, **detector_args)
+        start_loading()
+    else:
+        print("Loading AI Art Detector...")
+        try:
+            detector = load_detector(**detector_args)
+            warm_up(warmup_batch_sizes)
+            print(f"✓ Detector loaded successfully on {detector.device}")
+            if args.batch_size > 1:
+                print(f"✓ Micro-batching up to {args.batch_size} requests ({args.batch_wait_ms}ms max wait)")
+            if detector.tta:
+                print(f"✓ Test-time augmentation: {detector.transform.num_views} views per image")
+            if args.max_queue > 0:
+                print(f"✓ Shedding load above {args.max_queue} in-flight requests")
+        except Exception as e:
+            print(f"✗ Failed to load detector: {e}")
+            sys.exit(1)
     
     # Start the application
     print(f"Starting web server on {args.host}:{args.port}")
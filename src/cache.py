@@ -0,0 +1,137 @@
+"""
+Prediction cache keyed by image content and model identity
+"""
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+from collections import OrderedDict
+
+class PredictionCache:
+    """
+    Size-bounded LRU cache of prediction results with an optional sqlite tier
+    
+    The in-memory tier is private to each process. When ``db_path`` is given,
+    results are also written to a sqlite database that every process (e.g.
+    each gunicorn worker) reads from, so an image scored by one worker is a hit
+    in all the others. A failing sqlite tier (locked, full or unreadable
+    disk) only costs hits: lookups fall back to a miss and writes are dropped.
+    """
+    def __init__(self, max_entries=1024, db_path=None, max_db_entries=1_000_000):
+        """
+        Args:
+            max_entries (int): Maximum number of results kept in memory
+            db_path (str): Optional sqlite file for the shared persistent tier
+            max_db_entries (int): Prune the oldest rows once the database grows past this
+        """
+        self.max_entries = max_entries
+        self.db_path = db_path
+        self.max_db_entries = max_db_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        # Serializes the shared sqlite connection without blocking memory-tier lookups
+        self._db_lock = threading.Lock()
+        self._db = None
+        self._db_pid = None
+        self._db_writes = 0
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.disk_errors = 0
+    
+    @staticmethod
+    def make_key(image_bytes, model_id):
+        """Hash the raw image bytes together with the identity of the model that scores them"""
+        digest = hashlib.sha256(model_id.encode())
+        digest.update(image_bytes)
+        return digest.hexdigest()
+    
+    def get(self, key):
+        """Return the cached result for ``key``, or None on a miss"""
+        with self._lock:
+            value = self._entries.get(key)
+            if value is not None:
+                self._entries.move_to_end(key)
+                self.memory_hits += 1
+                return json.loads(value)
+        row = None
+        if self.db_path is not None:
+            with self._db_lock:
+                try:
+                    row = self._connection().execute(
+                        'SELECT result FROM predictions WHERE key = ?', (key,)).fetchone()
+                except sqlite3.Error:
+                    self._disk_error()
+        with self._lock:
+            if row is None:
+                self.misses += 1
+                return None
+            self._remember(key, row[0])
+            self.disk_hits += 1
+        return json.loads(row[0])
+    
+    def put(self, key, result):
+        """Store a prediction result under ``key``"""
+        value = json.dumps(result)
+        with self._lock:
+            self._remember(key, value)
+        if self.db_path is None:
+            return
+        with self._db_lock:
+            try:
+                db = self._connection()
+                db.execute('INSERT OR REPLACE INTO predictions (key, result) VALUES (?, ?)', (key, value))
+                self._db_writes += 1
+                if self._db_writes % 1000 == 0:
+                    self._prune(db)
+                db.commit()
+            except sqlite3.Error:
+                self._disk_error()
+    
+    def stats(self):
+        """Return hit/miss counters and occupancy"""
+        with self._lock:
+            lookups = self.memory_hits + self.disk_hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'max_entries': self.max_entries,
+                'persistent': self.db_path is not None,
+                'memory_hits': self.memory_hits,
+                'disk_hits': self.disk_hits,
+                'misses': self.misses,
+                'disk_errors': self.disk_errors,
+                'hit_rate': (self.memory_hits + self.disk_hits) / lookups if lookups else 0.0,
+            }
+    
+    def _remember(self, key, value):
+        if self.max_entries <= 0:
+            return
+        self._entries[key] = value
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+    
+    def _disk_error(self):
+        """Count a failed sqlite operation; the caller holds ``_db_lock``"""
+        with self._lock:
+            self.disk_errors += 1
+    
+    def _connection(self):
+        """Open the sqlite tier lazily, once per process, since connections must not cross a fork"""
+        if self._db is None or self._db_pid != os.getpid():
+            db = sqlite3.connect(self.db_path, timeout=5.0, check_same_thread=False)
+            db.execute('PRAGMA journal_mode=WAL')
+            db.execute('PRAGMA synchronous=NORMAL')
+            db.execute('CREATE TABLE IF NOT EXISTS predictions (key TEXT PRIMARY KEY, result TEXT NOT NULL)')
+            db.commit()
+            self._db, self._db_pid = db, os.getpid()
+        return self._db
+    
+    def _prune(self, db):
+        """Drop the oldest rows (lowest rowid) beyond ``max_db_entries``"""
+        db.execute(
+            'DELETE FROM predictions WHERE rowid IN '
+            '(SELECT rowid FROM predictions ORDER BY rowid DESC LIMIT -1 OFFSET ?)',
+            (self.max_db_entries,),
+        )
@@ -0,0 +1,156 @@
+"""
+Calibrate the early-exit cascade on the val split
+
+Runs the small first-stage model and the full model over the val split once,
+then sweeps the first-stage confidence threshold. Each threshold is reported
+with its accuracy, the share of images the first stage answers and the
+estimated throughput gain. The fastest threshold whose accuracy stays within
+``--max_accuracy_drop`` of the full model is saved next to the first-stage
+checkpoint, where ``ArtDetector`` picks it up.
+
+Example:
+  python -m src.train --arch resnet18 --checkpoint models/detector_resnet18.pth
+  python -m src.cascade --fast_checkpoint models/detector_resnet18.pth --fast_arch resnet18
+  python run_web.py --cascade_checkpoint models/detector_resnet18.pth --cascade_arch resnet18
+"""
+import argparse
+import json
+import time
+import numpy as np
+import torch
+
+from .export import load_fp32_model, val_loader
+from .inference import cascade_calibration_path
+from .model import ARCHITECTURES
+
+def predict_probabilities(model, loader, warmup=1):
+    """
+    Softmax probabilities for every image in ``loader``
+
+    Returns:
+        tuple: ``(probs, labels, seconds_per_image)``, timing the forward passes
+        after the first ``warmup`` batches
+    """
+    n = len(loader.dataset)
+    probs, labels = None, np.empty(n, dtype=np.int64)
+    elapsed, timed, offset = 0.0, 0, 0
+    with torch.no_grad():
+        for i, (x, y) in enumerate(loader):
+            start = time.perf_counter()
+            p = torch.softmax(model(x), 1).numpy()
+            if i >= warmup:
+                elapsed += time.perf_counter() - start
+                timed += len(x)
+            if probs is None:
+                probs = np.empty((n, p.shape[1]), dtype=np.float32)
+            probs[offset:offset + len(x)] = p
+            labels[offset:offset + len(x)] = y.numpy()
+            offset += len(x)
+    if timed == 0:
+        # Too few batches to skip warmup; fall back to timing everything once more
+        start = time.perf_counter()
+        with torch.no_grad():
+            for x, _ in loader:
+                model(x)
+        elapsed, timed = time.perf_counter() - start, offset
+    return probs[:offset], labels[:offset], elapsed / max(timed, 1)
+
+def sweep(fast_probs, full_probs, labels, fast_time, full_time, thresholds):
+    """
+    Cascade accuracy and cost at every threshold
+
+    Cost per image is the first stage for every image plus the full model for
+    the share it does not answer, so the gain is an estimate from the measured
+    per-image times of each model.
+    """
+    fast_conf = fast_probs.max(1)
+    fast_pred, full_pred = fast_probs.argmax(1), full_probs.argmax(1)
+    rows = []
+    for threshold in thresholds:
+        confident = fast_conf >= threshold
+        pred = np.where(confident, fast_pred, full_pred)
+        fast_share = float(confident.mean()) if len(confident) else 0.0
+        cost = fast_time + (1.0 - fast_share) * full_time
+        rows.append({
+            'threshold': float(threshold),
+            'accuracy': float((pred == labels).mean()) if len(labels) else 0.0,
+            'fast_share': fast_share,
+            'ms_per_image': cost * 1000.0,
+            'speedup': full_time / cost if cost > 0 else 0.0,
+        })
+    return rows
+
+def choose_threshold(rows, full_accuracy, max_accuracy_drop):
+    """The fastest row within the accuracy budget (None if no threshold qualifies)"""
+    allowed = [r for r in rows if r['accuracy'] >= full_accuracy - max_accuracy_drop]
+    if not allowed:
+        return None
+    # Prefer the higher threshold among equally fast ones: same speed, fewer risky exits
+    return max(allowed, key=lambda r: (round(r['speedup'], 6), r['threshold']))
+
+def calibrate(args):
+    torch.set_num_threads(args.threads or torch.get_num_threads())
+    loader = val_loader(args)
+    full_model = load_fp32_model(args.checkpoint, args.num_classes)
+    fast_model = load_fp32_model(args.fast_checkpoint, args.num_classes, arch=args.fast_arch)
+
+    full_probs, labels, full_time = predict_probabilities(full_model, loader)
+    fast_probs, _, fast_time = predict_probabilities(fast_model, loader)
+    full_accuracy = float((full_probs.argmax(1) == labels).mean())
+    fast_accuracy = float((fast_probs.argmax(1) == labels).mean())
+
+    thresholds = np.round(np.arange(args.min_threshold, 1.0, args.step), 6).tolist() + [1.0]
+    rows = sweep(fast_probs, full_probs, labels, fast_time, full_time, thresholds)
+    best = choose_threshold(rows, full_accuracy, args.max_accuracy_drop)
+
+    print(f"Full model ({args.checkpoint}): accuracy {full_accuracy:.4f}, {full_time * 1000:.2f} ms/img")
+    print(f"First stage ({args.fast_arch}): accuracy {fast_accuracy:.4f}, {fast_time * 1000:.2f} ms/img")
+    print(f"{'threshold':>9} {'accuracy':>9} {'acc cost':>9} {'fast %':>7} {'ms/img':>8} {'speedup':>8}")
+    for row in rows[::max(1, len(rows) // 20)] + ([best] if best else []):
+        print(f"{row['threshold']:>9.3f} {row['accuracy']:>9.4f} {full_accuracy - row['accuracy']:>+9.4f} "
+              f"{row['fast_share'] * 100:>6.1f}% {row['ms_per_image']:>8.2f} {row['speedup']:>7.2f}x")
+
+    report = {
+        'checkpoint': args.checkpoint,
+        'fast_checkpoint': args.fast_checkpoint,
+        'fast_arch': args.fast_arch,
+        'num_images': int(len(labels)),
+        'full_accuracy': full_accuracy,
+        'fast_accuracy': fast_accuracy,
+        'full_ms_per_image': full_time * 1000.0,
+        'fast_ms_per_image': fast_time * 1000.0,
+        'max_accuracy_drop': args.max_accuracy_drop,
+        'threshold': best['threshold'] if best else 1.0,
+        'chosen': best,
+        'sweep': rows,
+    }
+    if best is None:
+        print(f"No threshold keeps accuracy within {args.max_accuracy_drop}; every image will use the full model")
+    else:
+        print(f"Chosen threshold {best['threshold']:.3f}: {best['speedup']:.2f}x throughput for "
+              f"{full_accuracy - best['accuracy']:+.4f} accuracy")
+    if not args.dry_run:
+        path = cascade_calibration_path(args.fast_checkpoint)
+        with open(path, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f"Saved calibration -> {path}")
+    return report
+
+if __name__ == '__main__':
+    p = argparse.ArgumentParser(description='Calibrate the early-exit cascade threshold on the val split')
+    p.add_argument('--fast_checkpoint', type=str, required=True, help='First-stage checkpoint (small backbone)')
+    p.add_argument('--fast_arch', choices=ARCHITECTURES, default='resnet18')
+    p.add_argument('--checkpoint', type=str, default='models/detector.pth', help='Full model checkpoint')
+    p.add_argument('--data_dir', type=str, default='data')
+    p.add_argument('--batch_size', type=int, default=32)
+    p.add_argument('--num_workers', type=int, default=4)
+    p.add_argument('--image_size', type=int, default=224)
+    p.add_argument('--num_classes', type=int, default=2)
+    p.add_argument('--threads', type=int, default=0, help='torch threads for timing (default: all)')
+    p.add_argument('--max_accuracy_drop', type=float, default=0.005,
+                   help='Largest accuracy loss versus the full model the chosen threshold may cost')
+    p.add_argument('--min_threshold', type=float, default=0.5)
+    p.add_argument('--step', type=float, default=0.005)
+    p.add_argument('--dry_run', action='store_true', help='Report only; do not write the calibration file')
+    args = p.parse_args()
+    calibrate(args)
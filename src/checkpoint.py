@@ -0,0 +1,120 @@
+"""
+Resumable training checkpoints
+
+A training checkpoint holds everything needed to continue a run exactly:
+model weights, optimizer state, the number of finished epochs, the best
+validation accuracy so far and the RNG states. Tensors are snapshotted to CPU
+on the training thread and written by ``CheckpointWriter`` in the background,
+via a temporary file and ``os.replace`` so a crash never leaves a truncated
+checkpoint behind.
+"""
+import os
+import random
+import threading
+
+import numpy as np
+import torch
+
+def snapshot(obj):
+    """Copy every tensor in a nested state to CPU so training can keep mutating the originals"""
+    if isinstance(obj, torch.Tensor):
+        return obj.detach().to('cpu', copy=True)
+    if isinstance(obj, dict):
+        return {k: snapshot(v) for k, v in obj.items()}
+    if isinstance(obj, (list, tuple)):
+        return type(obj)(snapshot(v) for v in obj)
+    return obj
+
+def capture_rng_state():
+    """RNG states of torch, CUDA, NumPy and ``random``, in a form ``weights_only`` loading accepts"""
+    name, keys, pos, has_gauss, cached_gaussian = np.random.get_state()
+    return {
+        'torch': torch.get_rng_state(),
+        'cuda': torch.cuda.get_rng_state_all() if torch.cuda.is_available() else [],
+        'numpy': [name, torch.from_numpy(keys.astype(np.int64)), pos, has_gauss, cached_gaussian],
+        'python': random.getstate(),
+    }
+
+def restore_rng_state(state):
+    torch.set_rng_state(state['torch'])
+    if state['cuda'] and torch.cuda.is_available():
+        torch.cuda.set_rng_state_all(state['cuda'])
+    name, keys, pos, has_gauss, cached_gaussian = state['numpy']
+    np.random.set_state((name, keys.numpy().astype(np.uint32), pos, has_gauss, cached_gaussian))
+    version, internal, gauss_next = state['python']
+    random.setstate((version, tuple(internal), gauss_next))
+
+def training_state(model, optimizer, epoch, best_acc, args=None):
+    """
+    Snapshot of a run after ``epoch`` finished epochs
+
+    Args:
+        model: Unwrapped module (not the DDP or ``torch.compile`` wrapper)
+        optimizer: Optimizer whose state is saved alongside the weights
+        epoch: Number of completed epochs; training resumes at this index
+        best_acc: Best validation accuracy so far
+        args: Optional argparse namespace recorded for reference
+
+    Returns:
+        dict: CPU-only state ready for ``CheckpointWriter.save``
+    """
+    return {
+        'model': snapshot(model.state_dict()),
+        'optimizer': snapshot(optimizer.state_dict()),
+        'epoch': epoch,
+        'best_acc': best_acc,
+        'rng': capture_rng_state(),
+        'args': {k: v for k, v in vars(args).items() if isinstance(v, (str, int, float, bool, type(None)))} if args else {},
+    }
+
+def load_training_state(path, map_location='cpu'):
+    return torch.load(path, map_location=map_location, weights_only=True)
+
+def atomic_save(obj, path):
+    """``torch.save`` to a temporary file in the same directory, then rename it over ``path``"""
+    directory = os.path.dirname(path) or '.'
+    os.makedirs(directory, exist_ok=True)
+    tmp_path = os.path.join(directory, f'.{os.path.basename(path)}.{os.getpid()}.tmp')
+    try:
+        with open(tmp_path, 'wb') as f:
+            torch.save(obj, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+class CheckpointWriter:
+    """
+    Write checkpoints from a background thread
+
+    One write is in flight at a time: ``save`` waits for the previous write
+    before starting the next, which bounds memory to one pending snapshot.
+    Errors from a background write are raised by the next ``save`` or ``wait``.
+    """
+    def __init__(self):
+        self._thread = None
+        self._error = None
+
+    def save(self, obj, path):
+        """Write ``obj`` (already snapshotted to CPU) to ``path`` in the background"""
+        self.wait()
+        self._thread = threading.Thread(target=self._write, args=(obj, path), daemon=False)
+        self._thread.start()
+
+    def wait(self):
+        """Block until the pending write finishes, re-raising its error"""
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        if self._error is not None:
+            error, self._error = self._error, None
+            raise error
+
+    def _write(self, obj, path):
+        try:
+            atomic_save(obj, path)
+        except BaseException as e:
+            self._error = e
@@ -1,8 +1,15 @@
+import csv
+import hashlib
+import json
 import os
-from PIL import Image
-from torch.utils.data import Dataset
+import time
+import numpy as np
+import torch
+from torch.utils.data import Dataset, IterableDataset, get_worker_info
 from torchvision import transforms
 
+from .preprocess import fast_transforms, open_image
+
 # Common image file extensions
 IMAGE_EXTENSIONS = {'.jpg', '.jpeg', '.png', '.gif', '.bmp', '.tiff', '.tif', '.webp'}
 
@@ -10,24 +17,198 @@ def is_image_file(filename):
     """Check if a file is an image based on its extension"""
     return any(filename.lower().endswith(ext) for ext in IMAGE_EXTENSIONS)
 
+def scan_image_files(folder):
+    """Yield paths of the image files directly inside ``folder`` without building a list"""
+    with os.scandir(folder) as entries:
+        for entry in entries:
+            # Only include actual image files, skip .gitkeep and other non-image files
+            if is_image_file(entry.name) and entry.is_file():
+                yield entry.path
+
+def walk_image_files(root):
+    """Yield paths of all image files below ``root``, one directory at a time"""
+    for dirpath, dirnames, _ in os.walk(root):
+        dirnames.sort()
+        yield from scan_image_files(dirpath)
+
+# Kaggle train.csv labels: 1 = AI-generated, 0 = Human-made
+CSV_LABELS = {'1': 'AI', '0': 'Human'}
+
+def read_csv_samples(csv_path):
+    """
+    Read ``(relative_path, class_name)`` rows from a split CSV
+
+    Accepts the ``path,label`` indexes written by ``download_dataset.py`` and
+    Kaggle-style ``file_name,label`` files whose labels are 1/0.
+    """
+    with open(csv_path, newline='') as f:
+        reader = csv.DictReader(f)
+        column = 'path' if 'path' in reader.fieldnames else 'file_name'
+        return [(row[column], CSV_LABELS.get(row['label'], row['label'])) for row in reader]
+
+def stratified_split(labels, split, val_split=0.2, seed=42):
+    """Indices of ``split`` ('train' or 'val') after a seeded per-class shuffle"""
+    rng = np.random.default_rng(seed)
+    chosen = []
+    for label in np.unique(labels):
+        idx = rng.permutation(np.flatnonzero(labels == label))
+        split_idx = int(len(idx) * (1 - val_split))
+        chosen.append(idx[:split_idx] if split == 'train' else idx[split_idx:])
+    return np.sort(np.concatenate(chosen)) if chosen else np.zeros(0, dtype=np.int64)
+
+def index_is_fresh(index_path, class_dirs):
+    """True when the index exists and no class folder changed after it was written"""
+    try:
+        index_mtime = os.stat(index_path).st_mtime_ns
+    except FileNotFoundError:
+        return False
+    return all(os.stat(d).st_mtime_ns <= index_mtime for d in class_dirs if os.path.isdir(d))
+
+def mtime_ns(path):
+    try:
+        return os.stat(path).st_mtime_ns
+    except FileNotFoundError:
+        return None
+
+class SampleTable:
+    """
+    Image paths and labels packed into NumPy arrays
+
+    Relative paths are stored as UTF-8 bytes in one uint8 buffer with int64
+    offsets. DataLoader workers therefore receive three arrays instead of
+    millions of pickled tuples, and forked workers never touch per-sample
+    refcounts, so the pages stay shared. Indexing and iteration yield
+    ``(path, label)`` like the list of tuples it replaces.
+    """
+    def __init__(self, root, data, offsets, labels):
+        self.root = root
+        self.data = data
+        self.offsets = offsets
+        self.labels = labels
+
+    @classmethod
+    def from_pairs(cls, root, pairs):
+        """Build from ``(path relative to root, label index)`` pairs"""
+        encoded = [path.encode('utf-8') for path, _ in pairs]
+        lengths = np.array([len(b) for b in encoded], dtype=np.int64)
+        # 32-bit offsets cover path buffers up to 4 GiB
+        offsets = np.zeros(len(encoded) + 1, dtype=np.uint32 if lengths.sum() < 2 ** 32 else np.int64)
+        np.cumsum(lengths, out=offsets[1:])
+        data = np.frombuffer(b''.join(encoded), dtype=np.uint8)
+        labels = np.array([label for _, label in pairs], dtype=np.int16)
+        return cls(root, data, offsets, labels)
+
+    def __len__(self):
+        return len(self.labels)
+
+    def __getitem__(self, idx):
+        path = self.data[self.offsets[idx]:self.offsets[idx + 1]].tobytes().decode('utf-8')
+        return os.path.join(self.root, path), int(self.labels[idx])
+
+    def __iter__(self):
+        for idx in range(len(self)):
+            yield self[idx]
+
+    def subset(self, indices):
+        pairs = [(self.data[self.offsets[i]:self.offsets[i + 1]].tobytes().decode('utf-8'), self.labels[i])
+                 for i in indices]
+        return SampleTable.from_pairs(self.root, pairs)
+
+    def save(self, path, key):
+        """Write to ``path`` atomically, tagged with ``key`` for invalidation"""
+        tmp_path = f'{path}.{os.getpid()}.tmp'
+        with open(tmp_path, 'wb') as f:
+            np.savez(f, data=self.data, offsets=self.offsets, labels=self.labels, key=np.array(key))
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path, root, key):
+        """The cached table at ``path``, or None when it is missing or was built from different inputs"""
+        try:
+            with np.load(path, allow_pickle=False) as f:
+                if str(f['key']) != key:
+                    return None
+                return cls(root, f['data'], f['offsets'], f['labels'])
+        except (OSError, KeyError, ValueError):
+            return None
+
 class ArtDataset(Dataset):
-    def __init__(self, root_dir, split='train', transform=None, class_names=None):
-        self.root_dir = os.path.join(root_dir, split)
+    """
+    Labeled images from ``<root_dir>/<split>/<class>/`` folders or a split CSV
+
+    Sample lists are cached in ``<root_dir>/<split>_manifest.npz`` and rebuilt
+    only when a class folder's mtime, the index or the CSV changes, so large or
+    network-mounted datasets are not re-listed on every run. With ``csv_path``
+    (e.g. the Kaggle ``train.csv``), images are read in place relative to the
+    CSV and split into train/val by a seeded stratified shuffle, without
+    copying any files. Rows whose file does not exist are skipped before the
+    split; the manifest goes to ``root_dir`` rather than the (possibly
+    read-only) dataset folder, and files restored later are only picked up
+    once the CSV changes or ``cache_manifest=False``.
+    """
+    def __init__(self, root_dir, split='train', transform=None, class_names=None,
+                 csv_path=None, val_split=0.2, seed=42, cache_manifest=True):
         self.transform = transform
-        self.samples = []
-        if class_names is None:
-            class_names = sorted([d for d in os.listdir(self.root_dir) if os.path.isdir(os.path.join(self.root_dir, d))])
+        if csv_path:
+            self.root_dir = os.path.dirname(os.path.abspath(csv_path))
+            # One manifest per CSV, kept with the caller's data rather than the source dataset
+            csv_id = hashlib.sha1(os.path.abspath(csv_path).encode()).hexdigest()[:8]
+            stem = os.path.splitext(os.path.basename(csv_path))[0]
+            manifest_path = os.path.join(root_dir, f'{stem}-{csv_id}_{split}_manifest.npz')
+            rows = None
+            if class_names is None:
+                rows = read_csv_samples(csv_path)
+                class_names = sorted({label for _, label in rows})
+            sources = {csv_path: mtime_ns(csv_path), 'val_split': val_split, 'seed': seed}
+        else:
+            self.root_dir = os.path.join(root_dir, split)
+            if class_names is None:
+                class_names = sorted([d for d in os.listdir(self.root_dir) if os.path.isdir(os.path.join(self.root_dir, d))])
+            manifest_path = os.path.join(root_dir, f'{split}_manifest.npz')
+            index_path = os.path.join(root_dir, f'{split}_index.csv')
+            class_dirs = [os.path.join(self.root_dir, c) for c in class_names]
+            # Adding or removing a file bumps its folder's mtime, which invalidates the cache
+            sources = {path: mtime_ns(path) for path in class_dirs + [index_path]}
         self.class_names = class_names
         self.class_to_idx = {c: i for i, c in enumerate(self.class_names)}
-        for cls in self.class_names:
-            folder = os.path.join(self.root_dir, cls)
-            if not os.path.isdir(folder):
-                continue
-            for name in os.listdir(folder):
-                path = os.path.join(folder, name)
-                # Only include actual image files, skip .gitkeep and other non-image files
-                if os.path.isfile(path) and is_image_file(name):
-                    self.samples.append((path, self.class_to_idx[cls]))
+        key = json.dumps({'classes': list(class_names), 'sources': sources}, sort_keys=True)
+
+        self.samples = SampleTable.load(manifest_path, self.root_dir, key) if cache_manifest else None
+        if self.samples is not None:
+            return
+        if csv_path:
+            rows = rows if rows is not None else read_csv_samples(csv_path)
+            pairs = [(path, self.class_to_idx[label]) for path, label in rows if label in self.class_to_idx]
+            missing = [path for path, _ in pairs if not os.path.isfile(os.path.join(self.root_dir, path))]
+            if missing:
+                print(f"Skipping {len(missing)} files listed in {csv_path} but not found (e.g. {missing[0]})")
+                missing = set(missing)
+                pairs = [pair for pair in pairs if pair[0] not in missing]
+            table = SampleTable.from_pairs(self.root_dir, pairs)
+            self.samples = table.subset(stratified_split(table.labels, split, val_split, seed))
+        elif index_is_fresh(index_path, class_dirs):
+            self.samples = SampleTable.from_pairs(self.root_dir, [
+                (path, self.class_to_idx[label]) for path, label in read_csv_samples(index_path)
+                if label in self.class_to_idx])
+        else:
+            pairs = []
+            for cls in self.class_names:
+                folder = os.path.join(self.root_dir, cls)
+                if not os.path.isdir(folder):
+                    continue
+                for entry_path in scan_image_files(folder):
+                    pairs.append((f'{cls}/{os.path.basename(entry_path)}', self.class_to_idx[cls]))
+            self.samples = SampleTable.from_pairs(self.root_dir, pairs)
+        # A folder modified within the last couple of seconds could change again without
+        # its (coarse, on some filesystems) mtime moving, so such listings are not cached
+        recent = time.time_ns() - 2_000_000_000
+        if cache_manifest and all(not isinstance(v, int) or v < recent for v in sources.values()):
+            try:
+                os.makedirs(os.path.dirname(manifest_path) or '.', exist_ok=True)
+                self.samples.save(manifest_path, key)
+            except OSError:
+                # Read-only dataset locations just skip the cache
+                pass
 
     def __len__(self):
         return len(self.samples)
@@ -35,7 +216,8 @@ class ArtDataset(Dataset):
     def __getitem__(self, idx):
         path, label = self.samples[idx]
         try:
-            img = Image.open(path).convert('RGB')
+            # Tensor transforms expose draft_size so JPEGs can be decoded at reduced size
+            img = open_image(path, draft_size=getattr(self.transform, 'draft_size', None))
             if self.transform:
                 img = self.transform(img)
             return img, label
@@ -45,6 +227,109 @@ class ArtDataset(Dataset):
             print(f"Warning: Could not load image {path}: {e}")
             raise
 
+class PackedDataset(Dataset):
+    """
+    Dataset over arrays written by ``python -m src.pack_dataset``
+
+    Images are served as zero-copy CHW uint8 tensor views of the memory-mapped
+    file, so the transform must accept tensors (see ``preprocess.TensorTransform``).
+    The mapping is opened lazily so DataLoader workers each map the file
+    instead of receiving a pickled copy of the pixels.
+    """
+    def __init__(self, packed_dir, split='train', transform=None, class_names=None):
+        self.images_path = os.path.join(packed_dir, f'{split}_images.npy')
+        self.transform = transform
+        with open(os.path.join(packed_dir, f'{split}_meta.json')) as f:
+            meta = json.load(f)
+        if class_names is not None and list(class_names) != meta['class_names']:
+            raise ValueError(f"Packed classes {meta['class_names']} do not match {list(class_names)}")
+        self.class_names = meta['class_names']
+        self.class_to_idx = {c: i for i, c in enumerate(self.class_names)}
+        self.image_size = meta['image_size']
+        self.labels = np.load(os.path.join(packed_dir, f'{split}_labels.npy'))
+        self._images = None
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_images'] = None
+        return state
+
+    def __len__(self):
+        return len(self.labels)
+
+    def __getitem__(self, idx):
+        if self._images is None:
+            # Copy-on-write mapping: writable views for torch, the file is never modified
+            self._images = np.load(self.images_path, mmap_mode='c')
+        img = torch.from_numpy(self._images[idx]).permute(2, 0, 1)
+        if self.transform:
+            img = self.transform(img)
+        return img, int(self.labels[idx])
+
+def make_dataset(data_dir, split, transform=None, class_names=None, packed_dir=None,
+                 csv_path=None, val_split=0.2, seed=42):
+    """Build a ``PackedDataset`` when ``packed_dir`` is given, otherwise an ``ArtDataset``"""
+    if packed_dir:
+        return PackedDataset(packed_dir, split=split, transform=transform, class_names=class_names)
+    return ArtDataset(data_dir, split=split, transform=transform, class_names=class_names,
+                      csv_path=csv_path, val_split=val_split, seed=seed)
+
+class ImageStreamDataset(IterableDataset):
+    """
+    Stream unlabeled images for batch inference without materializing the input list
+
+    ``source`` can be a directory (walked recursively), a text file listing one
+    image path per line, or an in-memory sequence of paths or raw image bytes.
+    DataLoader workers each take every ``num_workers``-th item, so directories
+    and list files are read lazily by every worker instead of being pickled.
+    Each item is ``(key, tensor, error)`` where ``key`` is the path (or the
+    index for raw bytes) and ``error`` is an empty string on success.
+    """
+    def __init__(self, source, transform, image_size=224):
+        self.source = source
+        self.transform = transform
+        self.image_size = image_size
+
+    def _items(self):
+        if isinstance(self.source, (str, os.PathLike)):
+            source = os.fspath(self.source)
+            if os.path.isdir(source):
+                yield from walk_image_files(source)
+            else:
+                with open(source) as f:
+                    for line in f:
+                        line = line.strip()
+                        if line:
+                            yield line
+        else:
+            yield from self.source
+
+    def __iter__(self):
+        info = get_worker_info()
+        worker_id, num_workers = (info.id, info.num_workers) if info else (0, 1)
+        for i, item in enumerate(self._items()):
+            if i % num_workers == worker_id:
+                yield self._load(i, item)
+
+    def _load(self, index, item):
+        if isinstance(item, (bytes, bytearray)):
+            key, source = str(index), item
+        else:
+            key = source = os.fspath(item)
+        try:
+            img = open_image(source, draft_size=getattr(self.transform, 'draft_size', None))
+            return key, self.transform(img), ''
+        except Exception as e:
+            # Keep going: a corrupt file yields an error record instead of stopping the run
+            shape = getattr(self.transform, 'output_shape', (3, self.image_size, self.image_size))
+            return key, torch.zeros(shape), str(e) or type(e).__name__
+
+def get_transforms(image_size=224, preprocess='pil'):
+    """Return (train, val) transforms for the 'pil' (torchvision) or 'fast' (tensor) pipeline"""
+    if preprocess == 'fast':
+        return fast_transforms(image_size)
+    return default_transforms(image_size)
+
 def default_transforms(image_size=224):
     train_tfms = transforms.Compose([
         transforms.Resize((image_size, image_size)),
@@ -0,0 +1,121 @@
+"""
+Knowledge distillation from a trained teacher into a smaller student
+
+The teacher's logits for every training image are computed once with the
+eval transforms and stored in ``<cache_dir>/<split>_teacher_logits.npy``.
+Later runs reuse that file as long as the teacher checkpoint, the image size
+and the dataset's sample list are unchanged, so the teacher never runs inside
+the training loop.
+"""
+import hashlib
+import json
+import os
+import numpy as np
+import torch
+import torch.nn.functional as F
+from torch.utils.data import DataLoader, Dataset
+from tqdm import tqdm
+
+from .model import checkpoint_digest, load_model
+
+def dataset_fingerprint(dataset):
+    """Identify a dataset's samples and their order"""
+    digest = hashlib.sha256()
+    samples = getattr(dataset, 'samples', None)
+    if samples is not None and hasattr(samples, 'data'):
+        for array in (samples.data, samples.offsets, samples.labels):
+            digest.update(np.ascontiguousarray(array).tobytes())
+    else:
+        # PackedDataset: the packed file and its labels pin down the samples
+        images_path = getattr(dataset, 'images_path', '')
+        if images_path:
+            stat = os.stat(images_path)
+            digest.update(f'{images_path}:{stat.st_size}:{stat.st_mtime_ns}'.encode())
+        digest.update(np.ascontiguousarray(getattr(dataset, 'labels', np.zeros(0))).tobytes())
+    digest.update(str(len(dataset)).encode())
+    return digest.hexdigest()[:16]
+
+def teacher_logits_path(cache_dir, split='train'):
+    return os.path.join(cache_dir, f'{split}_teacher_logits.npy')
+
+def cache_teacher_logits(teacher_checkpoint, dataset, cache_dir, split='train', batch_size=64,
+                         num_workers=4, device='cpu', image_size=224, preprocess='pil'):
+    """
+    Write the teacher's logits for ``dataset`` (built with eval transforms) unless a valid cache exists
+
+    Returns:
+        str: Path of the ``(N, num_classes)`` float32 logits file, row ``i`` for sample ``i``
+    """
+    path = teacher_logits_path(cache_dir, split)
+    meta_path = path.replace('.npy', '.json')
+    meta = {
+        'teacher': checkpoint_digest(teacher_checkpoint),
+        'dataset': dataset_fingerprint(dataset),
+        'image_size': image_size,
+        'preprocess': preprocess,
+    }
+    if os.path.exists(path) and os.path.exists(meta_path):
+        with open(meta_path) as f:
+            if json.load(f) == meta:
+                print(f"Using cached teacher logits {path}")
+                return path
+
+    os.makedirs(cache_dir, exist_ok=True)
+    teacher, arch = load_model(teacher_checkpoint, num_classes=len(dataset.class_names), map_location=device)
+    teacher.eval()
+    loader = DataLoader(dataset, batch_size=batch_size, shuffle=False, num_workers=num_workers)
+    tmp_path = f'{path}.{os.getpid()}.tmp.npy'
+    logits = np.lib.format.open_memmap(tmp_path, mode='w+', dtype=np.float32,
+                                       shape=(len(dataset), len(dataset.class_names)))
+    offset = 0
+    with torch.no_grad():
+        for x, _ in tqdm(loader, desc=f"Teacher logits ({arch})"):
+            out = teacher(x.to(device)).float().cpu().numpy()
+            logits[offset:offset + len(out)] = out
+            offset += len(out)
+    logits.flush()
+    del logits
+    os.replace(tmp_path, path)
+    with open(meta_path, 'w') as f:
+        json.dump(meta, f)
+    print(f"Cached teacher logits for {offset} images -> {path}")
+    return path
+
+class SoftTargetDataset(Dataset):
+    """
+    Wrap a dataset so each item also carries its cached teacher logits
+
+    The logits file is memory-mapped lazily, once per DataLoader worker.
+    """
+    def __init__(self, dataset, logits_path):
+        self.dataset = dataset
+        self.logits_path = logits_path
+        self._logits = None
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_logits'] = None
+        return state
+
+    def __len__(self):
+        return len(self.dataset)
+
+    def __getitem__(self, idx):
+        if self._logits is None:
+            self._logits = np.load(self.logits_path, mmap_mode='r')
+        x, y = self.dataset[idx]
+        return x, y, torch.from_numpy(np.array(self._logits[idx]))
+
+def distillation_loss(student_logits, teacher_logits, labels, temperature=4.0, alpha=0.7):
+    """
+    Hinton et al. distillation loss
+
+    ``alpha`` weights the KL divergence between temperature-softened teacher
+    and student distributions (scaled by T^2 to keep gradient magnitudes
+    comparable); the rest is ordinary cross-entropy on the labels.
+    """
+    soft = F.kl_div(F.log_softmax(student_logits / temperature, dim=1),
+                    F.softmax(teacher_logits / temperature, dim=1),
+                    reduction='batchmean') * temperature ** 2
+    hard = F.cross_entropy(student_logits, labels)
+    return alpha * soft + (1 - alpha) * hard
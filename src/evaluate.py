@@ -1,44 +1,289 @@
 import argparse
+import json
+import os
+import time
 import torch
 from torch.utils.data import DataLoader
-from sklearn.metrics import classification_report, confusion_matrix
-import matplotlib.pyplot as plt
 import numpy as np
 
-from .datasets import ArtDataset, default_transforms
-from .model import get_model
+from .datasets import get_transforms, make_dataset
+from .model import ARCHITECTURES, load_model
 
-def evaluate(args):
-    device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
-    _, val_tfms = default_transforms(args.image_size)
-    class_names = ['AI', 'Human'] if args.num_classes == 2 else None
-    ds = ArtDataset(args.data_dir, split='val', transform=val_tfms, class_names=class_names)
-    loader = DataLoader(ds, batch_size=args.batch_size, shuffle=False, num_workers=4, pin_memory=True)
+class StreamingMetrics:
+    """
+    Evaluation metrics accumulated batch by batch in fixed-size arrays
+
+    Keeps a confusion matrix plus, for every class, histograms of its
+    predicted probability split by whether the sample belongs to that class.
+    ROC and PR curves, calibration and optimal thresholds are all derived from
+    the histograms. Memory use therefore does not grow with the dataset, and
+    thresholds are resolved to ``1 / num_bins``.
+    """
+    def __init__(self, class_names, num_bins=1000):
+        self.class_names = list(class_names)
+        self.num_classes = len(self.class_names)
+        self.num_bins = num_bins
+        self.confusion = np.zeros((self.num_classes, self.num_classes), dtype=np.int64)
+        # [class, is_positive, bin] counts of that class's probability
+        self.score_hist = np.zeros((self.num_classes, 2, num_bins), dtype=np.int64)
+        # Sum of probabilities per [class, bin], for calibration
+        self.prob_sum = np.zeros((self.num_classes, num_bins), dtype=np.float64)
+        self.nll_sum = 0.0
+        self.brier_sum = 0.0
+        self.count = 0
+
+    def update(self, probs, labels):
+        """
+        Add a batch
+
+        Args:
+            probs: ``(N, num_classes)`` float array of class probabilities
+            labels: ``(N,)`` integer array of true classes
+        """
+        probs = np.asarray(probs, dtype=np.float64)
+        labels = np.asarray(labels, dtype=np.int64)
+        n, c, nb = len(labels), self.num_classes, self.num_bins
+        preds = probs.argmax(1)
+        self.confusion += np.bincount(labels * c + preds, minlength=c * c).reshape(c, c)
+        bins = np.minimum((probs * nb).astype(np.int64), nb - 1)
+        onehot = labels[:, None] == np.arange(c)
+        offsets = np.arange(c) * nb
+        self.score_hist += np.bincount((offsets * 2 + onehot * nb + bins).ravel(),
+                                       minlength=c * 2 * nb).reshape(c, 2, nb)
+        self.prob_sum += np.bincount((offsets + bins).ravel(), weights=probs.ravel(),
+                                     minlength=c * nb).reshape(c, nb)
+        self.nll_sum -= np.log(np.clip(probs[np.arange(n), labels], 1e-12, None)).sum()
+        self.brier_sum += ((probs - onehot) ** 2).sum()
+        self.count += n
+
+    def curves(self, cls):
+        """
+        One-vs-rest ROC/PR curves for class index ``cls`` at every bin edge
+
+        Returns:
+            dict: ``thresholds``, ``tp``, ``fp``, ``tpr``, ``fpr``, ``precision`` and ``recall`` arrays
+            (predict positive when probability >= threshold), plus ``auc`` and ``average_precision``
+        """
+        neg, pos = self.score_hist[cls]
+        # Count of scores in bins >= k for k = 0..num_bins
+        tp = np.concatenate([np.cumsum(pos[::-1])[::-1], [0]])
+        fp = np.concatenate([np.cumsum(neg[::-1])[::-1], [0]])
+        n_pos, n_neg = max(pos.sum(), 1), max(neg.sum(), 1)
+        tpr, fpr = tp / n_pos, fp / n_neg
+        precision = np.divide(tp, tp + fp, out=np.ones(len(tp)), where=(tp + fp) > 0)
+        return {
+            'thresholds': np.arange(self.num_bins + 1) / self.num_bins,
+            'tp': tp, 'fp': fp, 'tpr': tpr, 'fpr': fpr, 'precision': precision, 'recall': tpr,
+            # fpr and recall decrease as the threshold rises
+            'auc': float(np.sum((fpr[:-1] - fpr[1:]) * (tpr[:-1] + tpr[1:]) / 2)),
+            'average_precision': float(np.sum((tpr[:-1] - tpr[1:]) * precision[:-1])),
+        }
+
+    def thresholds(self, cls):
+        """Thresholds on class ``cls`` probability that maximize Youden's J, F1 and accuracy"""
+        curve = self.curves(cls)
+        tp, fp = curve['tp'], curve['fp']
+        n_pos, n_neg = self.score_hist[cls, 1].sum(), self.score_hist[cls, 0].sum()
+        f1 = np.divide(2 * tp, 2 * tp + fp + (n_pos - tp), out=np.zeros(len(tp)), where=(2 * tp + fp + n_pos - tp) > 0)
+        accuracy = (tp + n_neg - fp) / max(n_pos + n_neg, 1)
+        best = {}
+        for name, score in (('youden', curve['tpr'] - curve['fpr']), ('f1', f1), ('accuracy', accuracy)):
+            k = int(np.argmax(score))
+            best[name] = {'threshold': float(curve['thresholds'][k]), 'value': float(score[k]),
+                          'tpr': float(curve['tpr'][k]), 'fpr': float(curve['fpr'][k]),
+                          'precision': float(curve['precision'][k])}
+        return best
 
-    model = get_model(num_classes=args.num_classes, pretrained=False).to(device)
-    model.load_state_dict(torch.load(args.checkpoint, map_location=device))
-    model.eval()
+    def calibration(self, cls, num_bins=10):
+        """
+        Reliability diagram for class ``cls`` over ``num_bins`` equal-width bins
 
-    y_true, y_pred = [], []
+        Returns:
+            dict: per-bin ``mean_predicted``, ``fraction_positive`` and ``count``, plus ``ece``
+        """
+        neg, pos = self.score_hist[cls]
+        starts = np.arange(num_bins) * self.num_bins // num_bins
+        count = np.add.reduceat(neg + pos, starts)
+        positives = np.add.reduceat(pos, starts)
+        prob_sum = np.add.reduceat(self.prob_sum[cls], starts)
+        mean_pred = np.divide(prob_sum, count, out=np.zeros(num_bins), where=count > 0)
+        frac_pos = np.divide(positives, count, out=np.zeros(num_bins), where=count > 0)
+        ece = float(np.sum(count * np.abs(mean_pred - frac_pos)) / max(count.sum(), 1))
+        return {'mean_predicted': mean_pred, 'fraction_positive': frac_pos, 'count': count, 'ece': ece}
+
+    def per_class(self):
+        tp = np.diag(self.confusion)
+        support = self.confusion.sum(1)
+        predicted = self.confusion.sum(0)
+        precision = np.divide(tp, predicted, out=np.zeros(len(tp)), where=predicted > 0)
+        recall = np.divide(tp, support, out=np.zeros(len(tp)), where=support > 0)
+        f1 = np.divide(2 * precision * recall, precision + recall, out=np.zeros(len(tp)), where=(precision + recall) > 0)
+        return {name: {'precision': float(precision[i]), 'recall': float(recall[i]), 'f1': float(f1[i]),
+                       'support': int(support[i])} for i, name in enumerate(self.class_names)}
+
+    def report(self, calibration_bins=10):
+        """Everything as a JSON-serializable dict"""
+        classes = {}
+        for i, name in enumerate(self.class_names):
+            curve = self.curves(i)
+            calibration = self.calibration(i, calibration_bins)
+            classes[name] = {
+                'roc_auc': curve['auc'],
+                'average_precision': curve['average_precision'],
+                'optimal_thresholds': self.thresholds(i),
+                'calibration': {k: v.tolist() if isinstance(v, np.ndarray) else v for k, v in calibration.items()},
+                'curves': {k: curve[k].tolist() for k in ('thresholds', 'tpr', 'fpr', 'precision')},
+            }
+        return {
+            'count': self.count,
+            'accuracy': float(np.trace(self.confusion) / max(self.count, 1)),
+            'log_loss': self.nll_sum / max(self.count, 1),
+            'brier': self.brier_sum / max(self.count, 1),
+            'class_names': self.class_names,
+            'confusion_matrix': self.confusion.tolist(),
+            'per_class': self.per_class(),
+            'classes': classes,
+        }
+
+    def text_report(self):
+        """Per-class precision/recall/F1 table in the style of sklearn's classification_report"""
+        width = max(len(n) for n in self.class_names + ['accuracy'])
+        lines = [f"{'':>{width}} {'precision':>9} {'recall':>9} {'f1-score':>9} {'support':>9}", '']
+        for name, m in self.per_class().items():
+            lines.append(f"{name:>{width}} {m['precision']:>9.2f} {m['recall']:>9.2f} {m['f1']:>9.2f} {m['support']:>9}")
+        accuracy = np.trace(self.confusion) / max(self.count, 1)
+        lines += ['', f"{'accuracy':>{width}} {'':>9} {'':>9} {accuracy:>9.2f} {self.count:>9}"]
+        return '\n'.join(lines)
+
+def stream_predictions(model, loader, device, metrics, warmup=0):
+    """
+    Run ``model`` over ``loader``, adding softmax probabilities to ``metrics``
+
+    Returns:
+        float: Forward-pass seconds, excluding the first ``warmup`` batches
+    """
+    elapsed = 0.0
     with torch.no_grad():
-        for x, y in loader:
+        for i, (x, y) in enumerate(loader):
             x = x.to(device)
+            start = time.perf_counter()
             logits = model(x)
-            y_true.extend(y.numpy().tolist())
-            y_pred.extend(logits.argmax(1).cpu().numpy().tolist())
+            if i >= warmup:
+                elapsed += time.perf_counter() - start
+            metrics.update(torch.softmax(logits.float(), 1).cpu().numpy(), y.numpy())
+    return elapsed
 
-    names = class_names if class_names else [str(i) for i in range(args.num_classes)]
-    print(classification_report(y_true, y_pred, target_names=names))
-    cm = confusion_matrix(y_true, y_pred)
-    plt.imshow(cm, cmap='Blues')
-    plt.title('Confusion Matrix')
-    plt.xlabel('Predicted'); plt.ylabel('True')
-    plt.xticks(range(len(names)), names, rotation=45)
-    plt.yticks(range(len(names)), names)
+def collect_predictions(model, loader, device, warmup=0):
+    """
+    Run ``model`` over ``loader`` and gather labels and argmax predictions
+
+    Returns:
+        tuple: ``(y_true, y_pred, seconds)`` as preallocated int64 arrays, where
+        ``seconds`` excludes the first ``warmup`` batches
+    """
+    y_true = np.empty(len(loader.dataset), dtype=np.int64)
+    y_pred = np.empty(len(loader.dataset), dtype=np.int64)
+    elapsed = 0.0
+    offset = 0
+    with torch.no_grad():
+        for i, (x, y) in enumerate(loader):
+            x = x.to(device)
+            start = time.perf_counter()
+            logits = model(x)
+            if i >= warmup:
+                elapsed += time.perf_counter() - start
+            y_true[offset:offset + len(y)] = y.numpy()
+            y_pred[offset:offset + len(y)] = logits.argmax(1).cpu().numpy()
+            offset += len(y)
+    return y_true[:offset], y_pred[:offset], elapsed
+
+def write_plots(report, path, positive_class):
+    """Confusion matrix, ROC, PR and reliability diagram in one PNG, rendered without a display"""
+    import matplotlib
+    matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+
+    names = report['class_names']
+    cls = report['classes'][positive_class]
+    fig, axes = plt.subplots(2, 2, figsize=(10, 9))
+
+    ax = axes[0, 0]
+    cm = np.array(report['confusion_matrix'])
+    ax.imshow(cm, cmap='Blues')
+    ax.set_title('Confusion Matrix')
+    ax.set_xlabel('Predicted'); ax.set_ylabel('True')
+    ax.set_xticks(range(len(names)), names, rotation=45)
+    ax.set_yticks(range(len(names)), names)
     for (i, j), v in np.ndenumerate(cm):
-        plt.text(j, i, str(v), ha='center', va='center')
-    plt.tight_layout()
-    plt.show()
+        ax.text(j, i, str(v), ha='center', va='center')
+
+    ax = axes[0, 1]
+    ax.plot(cls['curves']['fpr'], cls['curves']['tpr'], label=f"AUC = {cls['roc_auc']:.3f}")
+    ax.plot([0, 1], [0, 1], '--', color='gray')
+    youden = cls['optimal_thresholds']['youden']
+    ax.scatter([youden['fpr']], [youden['tpr']], color='red', zorder=3, label=f"Youden t = {youden['threshold']:.3f}")
+    ax.set_title(f'ROC ({positive_class})'); ax.set_xlabel('False positive rate'); ax.set_ylabel('True positive rate')
+    ax.legend(loc='lower right')
+
+    ax = axes[1, 0]
+    ax.plot(cls['curves']['tpr'], cls['curves']['precision'], label=f"AP = {cls['average_precision']:.3f}")
+    ax.set_title(f'Precision-Recall ({positive_class})'); ax.set_xlabel('Recall'); ax.set_ylabel('Precision')
+    ax.set_ylim(0, 1.05)
+    ax.legend(loc='lower left')
+
+    ax = axes[1, 1]
+    calibration = cls['calibration']
+    filled = np.array(calibration['count']) > 0
+    ax.plot([0, 1], [0, 1], '--', color='gray')
+    ax.plot(np.array(calibration['mean_predicted'])[filled], np.array(calibration['fraction_positive'])[filled],
+            marker='o', label=f"ECE = {calibration['ece']:.3f}")
+    ax.set_title(f'Calibration ({positive_class})'); ax.set_xlabel('Mean predicted probability')
+    ax.set_ylabel('Fraction positive')
+    ax.legend(loc='upper left')
+
+    fig.tight_layout()
+    fig.savefig(path, dpi=120)
+    plt.close(fig)
+
+def evaluate(args):
+    device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
+    # Packed arrays hold uint8 pixels, which only the tensor-native transforms accept
+    _, val_tfms = get_transforms(args.image_size, 'fast' if args.packed_dir else args.preprocess)
+    class_names = ['AI', 'Human'] if args.num_classes == 2 else None
+    ds = make_dataset(args.data_dir, 'val', val_tfms, class_names, args.packed_dir,
+                      csv_path=args.split_csv, val_split=args.val_split, seed=args.split_seed)
+    loader = DataLoader(ds, batch_size=args.batch_size, shuffle=False, num_workers=args.num_workers, pin_memory=True)
+
+    if args.backend == 'eager':
+        model, _ = load_model(args.checkpoint, num_classes=args.num_classes, map_location=device,
+                              default_arch=args.arch)
+        model.eval()
+    else:
+        from .export import load_artifact
+        device = torch.device('cpu')
+        model = load_artifact(args.checkpoint, args.backend)
+
+    names = class_names if class_names else [str(i) for i in range(args.num_classes)]
+    metrics = StreamingMetrics(names, num_bins=args.threshold_bins)
+    stream_predictions(model, loader, device, metrics)
+
+    report = metrics.report(calibration_bins=args.calibration_bins)
+    report['checkpoint'] = args.checkpoint
+    positive = args.positive_class or names[0]
+    print(metrics.text_report())
+    cls = report['classes'][positive]
+    print(f"\n{positive} vs rest: ROC AUC {cls['roc_auc']:.4f} | AP {cls['average_precision']:.4f} "
+          f"| ECE {cls['calibration']['ece']:.4f} | log loss {report['log_loss']:.4f}")
+    for name, best in cls['optimal_thresholds'].items():
+        print(f"  best {name}: threshold {best['threshold']:.3f} -> {best['value']:.4f}")
+
+    os.makedirs(args.report_dir, exist_ok=True)
+    json_path = os.path.join(args.report_dir, 'metrics.json')
+    with open(json_path, 'w') as f:
+        json.dump(report, f, indent=2)
+    png_path = os.path.join(args.report_dir, 'evaluation.png')
+    write_plots(report, png_path, positive)
+    print(f"Wrote {json_path} and {png_path}")
 
 if __name__ == '__main__':
     p = argparse.ArgumentParser()
@@ -47,5 +292,24 @@ if __name__ == '__main__':
     p.add_argument('--batch_size', type=int, default=32)
     p.add_argument('--image_size', type=int, default=224)
     p.add_argument('--num_classes', type=int, default=2)
+    p.add_argument('--arch', choices=ARCHITECTURES, default='resnet50', help='Backbone of a plain state_dict checkpoint (tagged checkpoints record their own)')
+    p.add_argument('--backend', choices=['eager', 'torchscript', 'onnx'], default='eager',
+                   help='How to load --checkpoint: eager state_dict or an artifact from src.export')
+    p.add_argument('--preprocess', choices=['pil', 'fast'], default='pil',
+                   help="'fast' decodes JPEGs at reduced size and resizes/normalizes on tensors")
+    p.add_argument('--packed_dir', type=str, default=None,
+                   help='Read pre-decoded arrays written by python -m src.pack_dataset instead of image files')
+    p.add_argument('--num_workers', type=int, default=4)
+    p.add_argument('--split_csv', type=str, default=None,
+                   help='CSV of file_name/path,label (e.g. Kaggle train.csv) read in place instead of data_dir folders')
+    p.add_argument('--val_split', type=float, default=0.2, help='Validation fraction when splitting --split_csv')
+    p.add_argument('--split_seed', type=int, default=42, help='Seed for the stratified --split_csv split')
+    p.add_argument('--report_dir', type=str, default='reports',
+                   help='Where metrics.json and evaluation.png are written')
+    p.add_argument('--positive_class', type=str, default=None,
+                   help='Class whose ROC/PR/calibration is plotted and summarized (default: first class)')
+    p.add_argument('--threshold_bins', type=int, default=1000,
+                   help='Probability histogram resolution; thresholds are multiples of 1/bins')
+    p.add_argument('--calibration_bins', type=int, default=10)
     args = p.parse_args()
     evaluate(args)
@@ -0,0 +1,136 @@
+"""
+Export optimized inference artifacts (TorchScript, INT8, ONNX) for CPU serving
+"""
+import argparse
+import torch
+import torch.nn as nn
+from torch.utils.data import DataLoader
+
+from .datasets import ArtDataset, default_transforms
+from .model import load_model
+
+FORMATS = ('torchscript', 'int8-dynamic', 'int8-static', 'onnx')
+BACKENDS = ('eager', 'torchscript', 'onnx')
+
+class OnnxModel:
+    """Callable wrapper that runs an ONNX artifact with ONNX Runtime like a torch module"""
+    def __init__(self, path, num_threads=None):
+        try:
+            import onnxruntime as ort
+        except ImportError:
+            raise ImportError("The onnx backend requires onnxruntime. Install it with: pip install onnxruntime")
+        options = ort.SessionOptions()
+        if num_threads:
+            options.intra_op_num_threads = num_threads
+        self.session = ort.InferenceSession(path, sess_options=options, providers=['CPUExecutionProvider'])
+        self.input_name = self.session.get_inputs()[0].name
+
+    def __call__(self, x):
+        logits = self.session.run(None, {self.input_name: x.detach().cpu().numpy()})[0]
+        return torch.from_numpy(logits)
+
+def load_artifact(path, backend, device='cpu'):
+    """
+    Load an exported artifact for inference
+
+    Args:
+        path (str): Artifact written by this module
+        backend (str): 'torchscript' (also used for INT8 artifacts) or 'onnx'
+        device (str): Device for TorchScript artifacts; ONNX always runs on CPU
+    """
+    if backend == 'torchscript':
+        return torch.jit.load(path, map_location=device).eval()
+    if backend == 'onnx':
+        return OnnxModel(path, num_threads=torch.get_num_threads())
+    raise ValueError(f"Unknown backend {backend!r}, expected one of {BACKENDS}")
+
+def load_fp32_model(checkpoint, num_classes=2, arch='resnet50'):
+    """Load an eager checkpoint; ``arch`` is used only if the checkpoint does not record one"""
+    model, _ = load_model(checkpoint, num_classes=num_classes, default_arch=arch)
+    return model.eval()
+
+def val_loader(args):
+    _, val_tfms = default_transforms(args.image_size)
+    class_names = ['AI', 'Human'] if args.num_classes == 2 else None
+    ds = ArtDataset(args.data_dir, split='val', transform=val_tfms, class_names=class_names)
+    return DataLoader(ds, batch_size=args.batch_size, shuffle=False, num_workers=args.num_workers)
+
+def quantize_static(model, loader, num_batches):
+    """Post-training static INT8 quantization (FX graph mode) calibrated on ``num_batches`` val batches"""
+    from torch.ao.quantization import get_default_qconfig_mapping
+    from torch.ao.quantization.quantize_fx import convert_fx, prepare_fx
+
+    example = next(iter(loader))[0]
+    prepared = prepare_fx(model, get_default_qconfig_mapping(torch.backends.quantized.engine), (example,))
+    with torch.no_grad():
+        for i, (x, _) in enumerate(loader):
+            if i >= num_batches:
+                break
+            prepared(x)
+    return convert_fx(prepared)
+
+def export(args):
+    model = load_fp32_model(args.checkpoint, args.num_classes)
+    example = torch.randn(1, 3, args.image_size, args.image_size)
+
+    if args.format == 'onnx':
+        torch.onnx.export(
+            model, (example,), args.output,
+            input_names=['image'], output_names=['logits'],
+            dynamic_axes={'image': {0: 'batch'}, 'logits': {0: 'batch'}},
+        )
+    else:
+        if args.format == 'int8-dynamic':
+            # Only Linear layers have dynamic INT8 kernels; the convolutions stay fp32
+            model = torch.ao.quantization.quantize_dynamic(model, {nn.Linear}, dtype=torch.qint8)
+        elif args.format == 'int8-static':
+            model = quantize_static(model, val_loader(args), args.calibration_batches)
+        with torch.no_grad():
+            scripted = torch.jit.freeze(torch.jit.trace(model, example).eval())
+        scripted.save(args.output)
+    print(f"Exported {args.format} artifact -> {args.output}")
+
+def run_model(model, loader, warmup=1):
+    """Return (accuracy, predictions, seconds per image) of ``model`` on ``loader``"""
+    from .evaluate import collect_predictions
+
+    y_true, y_pred, elapsed = collect_predictions(model, loader, torch.device('cpu'), warmup=warmup)
+    correct = sum(int(t == p) for t, p in zip(y_true, y_pred))
+    return correct / max(len(y_true), 1), y_pred, elapsed / max(len(y_true), 1)
+
+def verify(args):
+    """Compare the exported artifact against the fp32 checkpoint on the val split"""
+    loader = val_loader(args)
+    backend = 'onnx' if args.format == 'onnx' else 'torchscript'
+    fp32_acc, fp32_pred, fp32_time = run_model(load_fp32_model(args.checkpoint, args.num_classes), loader)
+    art_acc, art_pred, art_time = run_model(load_artifact(args.output, backend), loader)
+    agreement = sum(int(a == b) for a, b in zip(fp32_pred, art_pred)) / max(len(fp32_pred), 1)
+
+    print(f"fp32 accuracy:     {fp32_acc:.4f} ({fp32_time * 1000:.2f} ms/img)")
+    print(f"{args.format} accuracy: {art_acc:.4f} ({art_time * 1000:.2f} ms/img)")
+    print(f"Accuracy delta:    {art_acc - fp32_acc:+.4f}")
+    print(f"Prediction agreement: {agreement:.4f}")
+    print(f"Speedup:           {fp32_time / max(art_time, 1e-12):.2f}x")
+    if fp32_acc - art_acc > args.max_accuracy_drop:
+        raise SystemExit(f"Accuracy dropped by more than {args.max_accuracy_drop:.4f}")
+
+if __name__ == '__main__':
+    p = argparse.ArgumentParser(description='Export an optimized inference artifact')
+    p.add_argument('--checkpoint', type=str, default='models/detector.pth')
+    p.add_argument('--format', choices=FORMATS, default='int8-static')
+    p.add_argument('--output', type=str, required=True)
+    p.add_argument('--data_dir', type=str, default='data')
+    p.add_argument('--batch_size', type=int, default=32)
+    p.add_argument('--num_workers', type=int, default=4)
+    p.add_argument('--image_size', type=int, default=224)
+    p.add_argument('--num_classes', type=int, default=2)
+    p.add_argument('--calibration_batches', type=int, default=10,
+                   help='Val batches used to calibrate int8-static activation ranges')
+    p.add_argument('--verify', action='store_true',
+                   help='Report the accuracy delta and speedup against the fp32 checkpoint on the val split')
+    p.add_argument('--max_accuracy_drop', type=float, default=0.01,
+                   help='With --verify, exit non-zero if accuracy drops by more than this')
+    args = p.parse_args()
+    export(args)
+    if args.verify:
+        verify(args)
@@ -0,0 +1,240 @@
+"""
+Cached backbone features for fast head-only retraining
+
+The frozen backbone runs once per image; the features its final linear layer
+sees (2048-d for ResNet-50) are kept in a memory-mapped store keyed by file
+path and mtime. Retraining that layer (``fc`` on ResNets, ``classifier[-1]``
+on MobileNets) then only touches the store, and later runs re-extract
+features just for new or modified files.
+"""
+import hashlib
+import json
+import os
+import numpy as np
+import torch
+import torch.nn as nn
+import torch.optim as optim
+from torch.utils.data import DataLoader, Subset
+from tqdm import tqdm
+
+from .checkpoint import atomic_save
+from .datasets import ArtDataset, default_transforms
+from .model import checkpoint_payload, get_model, load_model
+
+class FeatureStore:
+    """
+    Memory-mapped ``float32`` feature rows with a ``path -> [row, mtime_ns]`` index
+
+    The store is tied to one backbone: opening it with a different
+    ``backbone_id`` discards the cached rows. The file holds at least
+    ``num_rows`` rows; its capacity at least doubles whenever it grows, so
+    appending batch by batch rewrites the existing rows only O(log N) times.
+    """
+    def __init__(self, store_dir, backbone_id, dim=2048):
+        self.store_dir = store_dir
+        self.dim = dim
+        self.features_path = os.path.join(store_dir, 'features.npy')
+        self.index_path = os.path.join(store_dir, 'index.json')
+        os.makedirs(store_dir, exist_ok=True)
+
+        self.index = {}
+        self.num_rows = 0
+        if os.path.exists(self.index_path) and os.path.exists(self.features_path):
+            with open(self.index_path) as f:
+                meta = json.load(f)
+            if meta['backbone_id'] == backbone_id and meta['dim'] == dim:
+                self.index = meta['index']
+                self.num_rows = meta['num_rows']
+        self.backbone_id = backbone_id
+        self.features = np.load(self.features_path, mmap_mode='r+') if self.num_rows else None
+
+    def stale(self, paths):
+        """Return positions in ``paths`` whose file is new or changed since extraction"""
+        stale = []
+        for i, path in enumerate(paths):
+            entry = self.index.get(path)
+            if entry is None or entry[1] != os.stat(path).st_mtime_ns:
+                stale.append(i)
+        return stale
+
+    def rows(self, paths):
+        """Return the store row of every path"""
+        return np.array([self.index[path][0] for path in paths], dtype=np.int64)
+
+    def reserve(self, paths):
+        """Assign rows to the new paths among ``paths``, growing the file at most once"""
+        new_paths = [path for path in dict.fromkeys(paths) if path not in self.index]
+        if new_paths:
+            self._grow(self.num_rows + len(new_paths))
+            for path in new_paths:
+                # mtime 0 never matches a real file, so the row stays stale until written
+                self.index[path] = [self.num_rows, 0]
+                self.num_rows += 1
+
+    def write(self, paths, mtimes, features):
+        """Overwrite rows of known paths and append rows for new ones"""
+        self.reserve(paths)
+        for path, mtime, feature in zip(paths, mtimes, features):
+            row = self.index[path][0]
+            self.features[row] = feature
+            self.index[path][1] = mtime
+
+    def save(self):
+        """Flush features, then atomically replace the index that points into them"""
+        if self.features is not None:
+            self.features.flush()
+        tmp = self.index_path + '.tmp'
+        with open(tmp, 'w') as f:
+            json.dump({'backbone_id': self.backbone_id, 'dim': self.dim,
+                       'num_rows': self.num_rows, 'index': self.index}, f)
+        os.replace(tmp, self.index_path)
+
+    @property
+    def capacity(self):
+        return 0 if self.features is None else len(self.features)
+
+    def _grow(self, num_rows):
+        if num_rows <= self.capacity:
+            return
+        capacity = max(num_rows, 2 * self.capacity)
+        tmp = self.features_path + '.tmp'
+        grown = np.lib.format.open_memmap(tmp, mode='w+', dtype=np.float32, shape=(capacity, self.dim))
+        if self.num_rows:
+            grown[:self.num_rows] = self.features[:self.num_rows]
+        grown.flush()
+        del grown
+        self.features = None
+        os.replace(tmp, self.features_path)
+        self.features = np.load(self.features_path, mmap_mode='r+')
+
+def get_head(model):
+    """The final linear layer: ``fc`` on ResNets, ``classifier[-1]`` on MobileNets"""
+    return model.fc if hasattr(model, 'fc') else model.classifier[-1]
+
+def set_head(model, head):
+    if hasattr(model, 'fc'):
+        model.fc = head
+    else:
+        model.classifier[-1] = head
+
+def backbone_digest(model):
+    """
+    Identify the frozen part of ``model`` by a hash of every tensor outside its head
+
+    Unlike ``checkpoint_digest``, this ignores the final linear layer, so
+    retraining the head and saving over the base checkpoint keeps the cached
+    features valid.
+    """
+    head_tensors = {id(t) for t in get_head(model).state_dict(keep_vars=True).values()}
+    digest = hashlib.sha256()
+    for name, tensor in sorted(model.state_dict(keep_vars=True).items()):
+        if id(tensor) in head_tensors:
+            continue
+        digest.update(name.encode())
+        digest.update(tensor.detach().cpu().contiguous().numpy().tobytes())
+    return digest.hexdigest()[:16]
+
+def load_backbone(checkpoint, num_classes, arch='resnet50'):
+    """
+    Build the model whose final linear layer is retrained
+
+    Uses ``checkpoint`` when it exists, otherwise ImageNet weights for
+    ``arch``. Tagged checkpoints record their own architecture; plain
+    state_dicts are taken to be ``arch``.
+
+    Returns:
+        tuple: ``(model, arch, backbone_id, dim)``, the full model (for saving
+        later) and the input size of its final layer
+    """
+    if checkpoint and os.path.exists(checkpoint):
+        model, arch = load_model(checkpoint, num_classes=num_classes, default_arch=arch)
+    else:
+        model = get_model(num_classes=num_classes, pretrained=True, arch=arch)
+    return model, arch, backbone_digest(model), get_head(model).in_features
+
+def extract_features(backbone, dataset, store, batch_size=64, num_workers=4, device='cpu'):
+    """Run ``backbone`` over the samples of ``dataset`` that are missing or stale in ``store``"""
+    paths = [path for path, _ in dataset.samples]
+    stale = store.stale(paths)
+    if not stale:
+        return 0
+    # Size the store for every new file up front instead of once per batch
+    store.reserve([paths[i] for i in stale])
+    loader = DataLoader(Subset(dataset, stale), batch_size=batch_size, shuffle=False, num_workers=num_workers)
+    offset = 0
+    with torch.no_grad():
+        for x, _ in tqdm(loader, desc="Extract features"):
+            batch_paths = [paths[i] for i in stale[offset:offset + len(x)]]
+            mtimes = [os.stat(path).st_mtime_ns for path in batch_paths]
+            store.write(batch_paths, mtimes, backbone(x.to(device)).cpu().numpy())
+            offset += len(x)
+    store.save()
+    return len(stale)
+
+def evaluate_head(head, features, labels, device, batch_size=1024):
+    correct = 0
+    with torch.no_grad():
+        for start in range(0, len(labels), batch_size):
+            x = torch.from_numpy(features[start:start + batch_size]).to(device)
+            y = torch.from_numpy(labels[start:start + batch_size]).to(device)
+            correct += (head(x).argmax(1) == y).sum().item()
+    return correct / max(len(labels), 1)
+
+def train_head(args):
+    """Retrain only the classifier from cached features and save a full checkpoint"""
+    if args.epochs < 1:
+        raise ValueError(f"Head-only retraining needs at least one epoch, got {args.epochs}")
+    device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
+    class_names = ['AI', 'Human'] if args.num_classes == 2 else None
+    # No augmentation: each image's features are computed once and reused every epoch
+    _, val_tfms = default_transforms(args.image_size)
+    base = args.base_checkpoint or args.checkpoint
+
+    model, arch, backbone_id, dim = load_backbone(base, args.num_classes, args.arch)
+    print(f"Retraining the {arch} head on {dim}-d features")
+    head = get_head(model)
+    set_head(model, nn.Identity())
+    model = model.to(device).eval()
+    store = FeatureStore(args.feature_dir, backbone_id, dim)
+
+    splits = {}
+    for split in ('train', 'val'):
+        ds = ArtDataset(args.data_dir, split=split, transform=val_tfms, class_names=class_names)
+        extracted = extract_features(model, ds, store, args.batch_size, args.num_workers, device)
+        print(f"{split}: extracted {extracted} new/changed, reused {len(ds) - extracted} cached features")
+        rows = store.rows([path for path, _ in ds.samples])
+        # Gather once so each epoch reads contiguous rows instead of random ones
+        splits[split] = (np.ascontiguousarray(store.features[rows]),
+                         np.array([label for _, label in ds.samples], dtype=np.int64))
+
+    train_x, train_y = splits['train']
+    val_x, val_y = splits['val']
+    head = head.to(device)
+    optimizer = optim.AdamW(head.parameters(), lr=args.head_lr, weight_decay=1e-4)
+    criterion = nn.CrossEntropyLoss()
+    best_acc, best_state = -1.0, None
+    for epoch in range(args.epochs):
+        head.train()
+        order = np.random.permutation(len(train_y))
+        for start in range(0, len(order), args.batch_size):
+            idx = np.sort(order[start:start + args.batch_size])
+            x = torch.from_numpy(train_x[idx]).to(device)
+            y = torch.from_numpy(train_y[idx]).to(device)
+            optimizer.zero_grad()
+            loss = criterion(head(x), y)
+            loss.backward()
+            optimizer.step()
+        head.eval()
+        train_acc = evaluate_head(head, train_x, train_y, device)
+        val_acc = evaluate_head(head, val_x, val_y, device)
+        print(f"Head epoch {epoch+1}: train acc={train_acc:.4f} | val acc={val_acc:.4f}")
+        if val_acc > best_acc:
+            best_acc = val_acc
+            best_state = {k: v.detach().cpu().clone() for k, v in head.state_dict().items()}
+
+    head.load_state_dict(best_state)
+    set_head(model, head)
+    # Atomic, so servers watching the checkpoint never read a half-written file
+    atomic_save(checkpoint_payload(model.cpu().state_dict(), arch), args.checkpoint)
+    print("Saved head-retrained model ->", args.checkpoint)
+    print("Best val acc:", best_acc)
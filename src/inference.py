@@ -5,46 +5,158 @@ import torch
 import torch.nn.functional as F
 from PIL import Image
 import torchvision.transforms as transforms
+import csv
 import io
+import itertools
+import json
 import os
+import queue
+import random
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+
+from .metrics import timer
+from .preprocess import open_image
+from .serving import QueueFullError
 
 class ArtDetector:
-    def __init__(self, checkpoint_path='models/detector.pth', device=None):
+    def __init__(self, checkpoint_path='models/detector.pth', device=None, mmap_weights=False, cache=None,
+                 backend='eager', preprocess='pil', tta_tiles=0, tta_flip=False, tta_budget_ms=None,
+                 tta_max_side=1024, cascade_checkpoint=None, cascade_arch='resnet18', cascade_threshold=None):
         """
         Initialize the AI Art Detector
         
         Args:
             checkpoint_path (str): Path to the trained model checkpoint
             device (str): Device to run inference on ('cuda' or 'cpu')
+            mmap_weights (bool): Memory-map the checkpoint so forked or sibling
+                processes share one copy of the weights (CPU only)
+            cache (PredictionCache): Optional cache of results keyed by image content
+            backend (str): 'eager' for a state_dict checkpoint, or 'torchscript' /
+                'onnx' for an artifact written by ``python -m src.export``
+            preprocess (str): 'pil' for the torchvision PIL transforms, or 'fast'
+                for reduced-size JPEG decoding and tensor-native resize/normalize
+            tta_tiles (int): If > 0, also classify this many 224x224 tiles and
+                average the probabilities of all views
+            tta_flip (bool): Add horizontally flipped copies of every view
+            tta_max_side (int): Tiles are cut from the image scaled so its
+                shorter side is at most this (None or 0 keeps full resolution)
+            tta_budget_ms (float): Drop views (flips first) so one image's
+                forward pass stays within this many milliseconds
+            cascade_checkpoint (str): Optional small first-stage model; images it
+                classifies with at least ``cascade_threshold`` confidence skip
+                the main model
+            cascade_arch (str): Architecture of ``cascade_checkpoint`` if it is a
+                plain state_dict (tagged checkpoints record their own)
+            cascade_threshold (float): First-stage confidence needed to answer;
+                defaults to the value calibrated by ``python -m src.cascade``
         """
         self.device = device or torch.device('cuda' if torch.cuda.is_available() else 'cpu')
+        self.checkpoint_path = checkpoint_path
         self.class_names = ['AI', 'Human']
         self.model = None
         self.transform = None
+        self.mmap_weights = mmap_weights and torch.device(self.device).type == 'cpu'
+        self.cache = cache
+        self.backend = backend
+        self.preprocess = preprocess
+        self.model_id = None
+        self.arch = 'resnet50'
+        self.tta = tta_tiles > 0 or tta_flip
+        self.tta_tiles = tta_tiles
+        self.tta_flip = tta_flip
+        self.tta_budget_ms = tta_budget_ms
+        self.tta_max_side = tta_max_side or None
+        # Moving average of forward-pass milliseconds per view, used for the TTA budget
+        self._ms_per_view = None
+        self.fast_model = None
+        self.cascade_threshold = None
+        self.stage_counts = {'fast': 0, 'full': 0}
+        self._stage_lock = threading.Lock()
         
         self._load_model(checkpoint_path)
+        if cascade_checkpoint:
+            self._load_cascade(cascade_checkpoint, cascade_arch, cascade_threshold)
         self._setup_transforms()
     
     def _load_model(self, checkpoint_path):
         """Load the trained model"""
-        from .model import get_model
+        from .model import checkpoint_digest, get_model, load_model
         
-        self.model = get_model(num_classes=2, pretrained=False).to(self.device)
+        if self.backend != 'eager':
+            from .export import load_artifact
+            
+            if self.backend == 'onnx':
+                self.device = torch.device('cpu')
+            self.model = load_artifact(checkpoint_path, self.backend, device=self.device)
+            self.model_id = f"{self.backend}-{checkpoint_digest(checkpoint_path)}"
+            print(f"Model loaded from {checkpoint_path} ({self.backend} backend)")
+            return
         
         if os.path.exists(checkpoint_path):
-            self.model.load_state_dict(torch.load(checkpoint_path, map_location=self.device))
-            self.model.eval()
-            print(f"Model loaded from {checkpoint_path}")
+            # Plain state_dicts are ResNet-50; distilled students record their architecture
+            self.model, self.arch = load_model(checkpoint_path, num_classes=2, map_location=self.device,
+                                               mmap=self.mmap_weights)
+            self.model_id = checkpoint_digest(checkpoint_path)
+            print(f"Model loaded from {checkpoint_path} ({self.arch})")
         else:
+            self.model = get_model(num_classes=2, pretrained=False).to(self.device)
+            # Random weights differ per process, so give them an identity no one else shares
+            self.model_id = f"untrained-{os.getpid()}-{id(self)}"
             print(f"Warning: Checkpoint {checkpoint_path} not found. Using untrained model.")
+        
+        # Always run in eval mode so batch norm never mixes statistics across batched requests.
+        # Inference never writes to the weights, so pages shared with other processes stay shared.
+        self.model.eval()
+        self.model.requires_grad_(False)
+    
+    def _load_cascade(self, checkpoint_path, arch, threshold):
+        """Load the first-stage model and its confidence threshold"""
+        from .model import checkpoint_digest, load_model
+        
+        # ``arch`` only matters for plain state_dicts; tagged checkpoints name their own
+        self.fast_model, arch = load_model(checkpoint_path, num_classes=2, map_location=self.device,
+                                           mmap=self.mmap_weights, default_arch=arch)
+        self.fast_model.eval()
+        self.fast_model.requires_grad_(False)
+        if threshold is None:
+            calibration_path = cascade_calibration_path(checkpoint_path)
+            if os.path.exists(calibration_path):
+                with open(calibration_path) as f:
+                    threshold = json.load(f)['threshold']
+            else:
+                threshold = 0.9
+                print(f"Warning: {calibration_path} not found; using cascade threshold {threshold}. "
+                      f"Run python -m src.cascade to calibrate it.")
+        self.cascade_threshold = float(threshold)
+        # Cached results depend on both stages and the threshold
+        self.model_id = f"{self.model_id}+{arch}-{checkpoint_digest(checkpoint_path)}@{self.cascade_threshold:g}"
+        print(f"Cascade first stage loaded from {checkpoint_path} ({arch}, threshold {self.cascade_threshold:g})")
     
     def _setup_transforms(self):
         """Setup image preprocessing transforms"""
+        if self.tta:
+            from .preprocess import TileTransform
+            
+            self.transform = TileTransform(224, tiles=self.tta_tiles, flip=self.tta_flip, max_side=self.tta_max_side)
+            self.array_transform = self.transform
+            return
+        if self.preprocess == 'fast':
+            from .preprocess import TensorTransform
+            
+            self.transform = TensorTransform(224)
+            self.array_transform = self.transform
+            return
         self.transform = transforms.Compose([
             transforms.Resize((224, 224)),
             transforms.ToTensor(),
             transforms.Normalize(mean=[0.485, 0.456, 0.406], std=[0.229, 0.224, 0.225]),
         ])
+        from .preprocess import TensorTransform
+        
+        # Decoded arrays and tensors skip PIL, which would need a copy of their pixels
+        self.array_transform = TensorTransform(224)
     
     def preprocess_image(self, image_bytes):
         """
@@ -56,12 +168,71 @@ class ArtDetector:
         Returns:
             torch.Tensor: Preprocessed image tensor
         """
-        # Load image from bytes
-        image = Image.open(io.BytesIO(image_bytes)).convert('RGB')
+        # Load image from bytes (tensor transforms may decode JPEGs at reduced size)
+        with timer('decode'):
+            image = open_image(image_bytes, draft_size=getattr(self.transform, 'draft_size', None))
+        
+        # Apply transforms and add batch dimension (TTA transforms already return a batch of views)
+        with timer('transform'):
+            image_tensor = self.transform(image)
+            if not self.tta:
+                image_tensor = image_tensor.unsqueeze(0)
+        return image_tensor.to(self.device)
+    
+    def preprocess_images(self, images):
+        """
+        Preprocess already-decoded images into one model-ready batch
+        
+        Pixels go straight from the caller's buffer into the transform: NumPy
+        arrays (memory-mapped ones included) and tensors are wrapped, not
+        copied, and a stacked batch is resized and normalized in one call.
+        Arrays and uint8 tensors use the tensor-native pipeline even when
+        ``preprocess='pil'``, since building a PIL image would copy them.
+        
+        Args:
+            images: A PIL image, uint8 HWC array or uint8 CHW tensor, a list
+                of these, or a stacked (N, H, W, C) array / (N, C, H, W)
+                tensor. Float tensors are taken as already-normalized model
+                input of shape (3, 224, 224) or (N, 3, 224, 224).
+            
+        Returns:
+            tuple: ``(image_tensors, views)`` for ``predict_tensors``
+        """
+        from .preprocess import to_uint8_tensor
+        
+        if isinstance(images, torch.Tensor) and images.is_floating_point():
+            return (images.unsqueeze(0) if images.dim() == 3 else images), None
+        stacked = getattr(images, 'ndim', 0) == 4
+        if not stacked and (isinstance(images, Image.Image) or hasattr(images, 'ndim')):
+            images = [images]
+        with timer('transform'):
+            if stacked and not self.tta:
+                return self.array_transform(to_uint8_tensor(images)), None
+            tensors = []
+            for image in images:
+                if isinstance(image, Image.Image):
+                    tensors.append(self.transform(image.convert('RGB') if image.mode != 'RGB' else image))
+                else:
+                    tensors.append(self.array_transform(to_uint8_tensor(image)))
+            if self.tta:
+                return torch.cat(tensors), [len(t) for t in tensors]
+            return torch.stack(tensors), None
+    
+    def predict_images(self, images):
+        """
+        Predict already-decoded images in one forward pass, skipping decode entirely
+        
+        Results are not cached: the prediction cache is keyed by encoded image
+        bytes, which these inputs don't have.
         
-        # Apply transforms and add batch dimension
-        image_tensor = self.transform(image).unsqueeze(0).to(self.device)
-        return image_tensor
+        Args:
+            images: Any input accepted by ``preprocess_images``
+            
+        Returns:
+            list: One prediction result dict per image
+        """
+        image_tensors, views = self.preprocess_images(images)
+        return self.predict_tensors(image_tensors, views=views)
     
     def predict(self, image_bytes):
         """
@@ -73,27 +244,251 @@ class ArtDetector:
         Returns:
             dict: Prediction results with class, confidence, and probabilities
         """
+        cache_key, cached = self.cache_lookup(image_bytes)
+        if cached is not None:
+            return cached
+        
         # Preprocess image
         image_tensor = self.preprocess_image(image_bytes)
         
-        # Make prediction
-        with torch.no_grad():
-            logits = self.model(image_tensor)
-            probabilities = F.softmax(logits, dim=1)
-            predicted_class_idx = logits.argmax(1).item()
-            confidence = probabilities[0][predicted_class_idx].item()
+        # Make prediction (all TTA views of the image share one forward pass)
+        result = self.predict_tensors(image_tensor, views=[len(image_tensor)])[0]
+        self.cache_store(cache_key, result)
+        return result
+    
+    def cache_lookup(self, image_bytes):
+        """
+        Look an image up in the prediction cache
+        
+        Returns:
+            tuple: ``(key, result)``; ``result`` is None on a miss and both are
+            None when caching is disabled
+        """
+        if self.cache is None:
+            return None, None
+        # Preprocessing pipelines differ slightly numerically, so they get separate entries
+        key = self.cache.make_key(image_bytes, f"{self.model_id}:{self.preprocess}:{self.tta_id}")
+        cached = self.cache.get(key)
+        if cached is not None and 'model_version' not in cached:
+            # Entries persisted before responses carried the version
+            cached = {**cached, 'model_version': self.model_id}
+        return key, cached
+    
+    def cache_store(self, key, result):
+        """Store a result under a key returned by ``cache_lookup``"""
+        if self.cache is not None and key is not None:
+            self.cache.put(key, result)
+    
+    @property
+    def tta_id(self):
+        """Identifies the TTA configuration in cache keys"""
+        if not self.tta:
+            return 'single'
+        return (f"tta{self.tta_tiles}{'f' if self.tta_flip else ''}v{self.transform.max_views}"
+                f"s{self.tta_max_side or 'full'}")
+    
+    def predict_tensors(self, image_tensors, views=None):
+        """
+        Run one forward pass over a batch of preprocessed images
+        
+        Args:
+            image_tensors (torch.Tensor): Batch of shape (N, 3, H, W)
+            views (list): Optional number of consecutive rows belonging to each
+                image; their probabilities are averaged into one result
+            
+        Returns:
+            list: One prediction result dict per image
+        """
+        views = [1] * len(image_tensors) if views is None else list(views)
+        start = time.perf_counter()
+        with timer('forward'), torch.no_grad():
+            image_tensors = image_tensors.to(self.device)
+            if self.fast_model is None:
+                probabilities, stages = self._forward(self.model, image_tensors, views), None
+            else:
+                probabilities, stages = self._cascade(image_tensors, views)
+        if self.tta:
+            self._update_view_budget((time.perf_counter() - start) * 1000.0 / len(image_tensors))
         
-        # Prepare results
-        result = {
+        with timer('postprocess'):
+            results = [self._format_result(row) for row in probabilities]
+            if self.tta:
+                for result, n in zip(results, views):
+                    result['views'] = n
+            if stages is not None:
+                for result, stage in zip(results, stages):
+                    result['stage'] = stage
+            for result in results:
+                result['model_version'] = self.model_id
+            return results
+    
+    def _forward(self, model, image_tensors, views):
+        """Softmax probabilities per image, averaging each image's consecutive view rows"""
+        probabilities = F.softmax(model(image_tensors), dim=1).cpu()
+        if len(views) == len(probabilities):
+            return probabilities
+        return torch.stack([group.mean(0) for group in torch.split(probabilities, views)])
+    
+    def _cascade(self, image_tensors, views):
+        """
+        Answer confident images with the first stage; rerun the rest on the main model
+        
+        Returns:
+            tuple: ``(probabilities, stages)`` where each stage is 'fast' or 'full'
+        """
+        probabilities = self._forward(self.fast_model, image_tensors, views)
+        confident = (probabilities.max(1).values >= self.cascade_threshold).tolist()
+        unsure = [i for i, ok in enumerate(confident) if not ok]
+        if unsure:
+            starts = [0]
+            for n in views:
+                starts.append(starts[-1] + n)
+            rows = torch.cat([torch.arange(starts[i], starts[i + 1]) for i in unsure]).to(image_tensors.device)
+            probabilities[unsure] = self._forward(self.model, image_tensors[rows], [views[i] for i in unsure])
+        stages = ['fast' if ok else 'full' for ok in confident]
+        with self._stage_lock:
+            self.stage_counts['fast'] += len(confident) - len(unsure)
+            self.stage_counts['full'] += len(unsure)
+        return probabilities, stages
+    
+    def _update_view_budget(self, ms_per_view):
+        """Track forward cost per view and cap the TTA view count to the latency budget"""
+        if self._ms_per_view is None:
+            # The first forward pass pays one-off warmup costs, so it only primes the estimate
+            self._ms_per_view = 0.0
+            return
+        if self._ms_per_view == 0.0:
+            self._ms_per_view = ms_per_view
+        else:
+            self._ms_per_view = 0.8 * self._ms_per_view + 0.2 * ms_per_view
+        if self.tta_budget_ms:
+            fit = int(self.tta_budget_ms // max(self._ms_per_view, 1e-3))
+            self.transform.max_views = max(1, min(self.transform.num_views, fit))
+    
+    def _format_result(self, probabilities):
+        """Build the result dict for a single row of class probabilities"""
+        predicted_class_idx = int(probabilities.argmax())
+        return {
             'predicted_class': self.class_names[predicted_class_idx],
-            'confidence': float(confidence),
+            'confidence': float(probabilities[predicted_class_idx]),
             'probabilities': {
-                self.class_names[i]: float(probabilities[0][i]) 
+                self.class_names[i]: float(probabilities[i]) 
                 for i in range(len(self.class_names))
             }
         }
+    
+    def predict_batch(self, inputs, batch_size=32, num_workers=4):
+        """
+        Stream predictions for many images, decoding them in parallel
         
-        return result
+        Images are decoded and preprocessed by a DataLoader worker pool and run
+        through the model ``batch_size`` at a time; results are yielded as each
+        batch finishes so memory stays bounded regardless of the input size.
+        
+        Args:
+            inputs: Directory, text file of image paths, or a sequence/iterable
+                of image paths or raw image bytes
+            batch_size (int): Images per forward pass
+            num_workers (int): Decode worker processes (0 decodes in this process)
+            
+        Yields:
+            dict: ``{'path': ..., **prediction}`` or ``{'path': ..., 'error': ...}``
+        """
+        from torch.utils.data import DataLoader
+        from .datasets import ImageStreamDataset
+        
+        # One-shot iterators can't be split across worker processes
+        if not isinstance(inputs, (str, os.PathLike, list, tuple)):
+            num_workers = 0
+        dataset = ImageStreamDataset(inputs, self.transform)
+        loader = DataLoader(dataset, batch_size=batch_size, num_workers=num_workers)
+        
+        for keys, image_tensors, errors in loader:
+            ok = [i for i, error in enumerate(errors) if not error]
+            if not ok:
+                results = []
+            elif self.tta:
+                # (B, V, 3, H, W): every image's views go through the same forward pass
+                views = image_tensors[ok]
+                results = self.predict_tensors(views.flatten(0, 1), views=[views.shape[1]] * len(ok))
+            else:
+                results = self.predict_tensors(image_tensors[ok])
+            results = dict(zip(ok, results))
+            for i, key in enumerate(keys):
+                if errors[i]:
+                    yield {'path': key, 'error': errors[i]}
+                else:
+                    yield {'path': key, **results[i]}
+    
+    def predict_directory(self, directory, batch_size=32, num_workers=4):
+        """
+        Stream predictions for every image below a directory
+        
+        Args:
+            directory (str): Root directory, searched recursively
+            batch_size (int): Images per forward pass
+            num_workers (int): Decode worker processes
+            
+        Yields:
+            dict: Prediction results keyed by ``path``
+        """
+        return self.predict_batch(directory, batch_size=batch_size, num_workers=num_workers)
+    
+    def warmup(self, batch_sizes=(1,)):
+        """
+        Run throwaway passes so real requests don't pay one-time costs
+        
+        The first forward pass at each batch shape allocates buffers and
+        selects kernels; decoding the first JPEG initializes PIL's codec. Every
+        model (including the cascade first stage) runs once per batch size.
+        
+        Args:
+            batch_sizes: Images per warmup forward pass
+            
+        Returns:
+            dict: Seconds taken by each batch size's passes
+        """
+        buffer = io.BytesIO()
+        Image.new('RGB', (256, 256), (127, 127, 127)).save(buffer, format='JPEG')
+        views = self.preprocess_image(buffer.getvalue()).shape[0]
+        models = [m for m in (self.fast_model, self.model) if m is not None]
+        timings = {}
+        with torch.no_grad():
+            for batch_size in batch_sizes:
+                x = torch.zeros(batch_size * views, 3, 224, 224, device=self.device)
+                start = time.perf_counter()
+                for model in models:
+                    model(x)
+                timings[batch_size] = time.perf_counter() - start
+        if self._ms_per_view is None:
+            # Warm passes already happened, so the TTA budget can trust the first real measurement
+            self._ms_per_view = 0.0
+        return timings
+    
+    def validate(self, batch_size=4):
+        """
+        Check that every model returns finite, well-formed outputs on a random batch
+        
+        Raises:
+            ValueError: If a model's output has the wrong shape or is not finite
+            
+        Returns:
+            torch.Tensor: The main model's probabilities for the batch, which
+            ``ModelRegistry`` compares against the serving model
+        """
+        generator = torch.Generator().manual_seed(0)
+        x = torch.randn(batch_size, 3, 224, 224, generator=generator).to(self.device)
+        with torch.no_grad():
+            for name, model in (('cascade first stage', self.fast_model), ('model', self.model)):
+                if model is None:
+                    continue
+                logits = model(x)
+                if tuple(logits.shape) != (batch_size, len(self.class_names)):
+                    raise ValueError(f"{name} returned shape {tuple(logits.shape)}, "
+                                     f"expected {(batch_size, len(self.class_names))}")
+                if not torch.isfinite(logits).all():
+                    raise ValueError(f"{name} returned non-finite outputs")
+        return F.softmax(logits.float(), dim=1).cpu()
     
     def predict_from_file(self, file_path):
         """
@@ -119,12 +514,802 @@ class ArtDetector:
         Returns:
             dict: Prediction results
         """
-        # Convert PIL image to bytes
-        img_byte_arr = io.BytesIO()
-        pil_image.save(img_byte_arr, format='JPEG')
-        image_bytes = img_byte_arr.getvalue()
+        return self.predict_images(pil_image)[0]
+
+class MicroBatcher:
+    """
+    Collect concurrent prediction requests into batched forward passes
+    
+    Callers decode and preprocess their image on their own thread, then wait
+    while a single scheduler thread groups queued tensors into batches of up
+    to ``max_batch_size`` images, waiting at most ``max_wait_ms`` after the
+    first request of a batch arrives before running the forward pass.
+    
+    With ``max_queue_size`` set, at most that many requests may be admitted
+    (decoding, queued or in the running batch); further submissions raise
+    ``QueueFullError`` immediately instead of piling up. Images inferred
+    outside the queue, such as ``/predict_batch`` chunks, count against the
+    same limit through ``admit`` and ``release``.
+    """
+    def __init__(self, detector, max_batch_size=8, max_wait_ms=5.0, max_queue_size=0):
+        """
+        Args:
+            detector (ArtDetector): Detector used for preprocessing and inference
+            max_batch_size (int): Maximum number of images per forward pass
+            max_wait_ms (float): Maximum time to hold a batch open for more requests
+            max_queue_size (int): Maximum admitted requests, 0 for unbounded
+        """
+        self.detector = detector
+        self.max_batch_size = max(1, int(max_batch_size))
+        self.max_wait = max(0.0, max_wait_ms) / 1000.0
+        self.max_queue_size = max(0, int(max_queue_size))
+        self._pending = 0
+        self._rejected = 0
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._batch_size_counts = [0] * (self.max_batch_size + 1)
+        self._requests = 0
+        self._batches = 0
+        self._max_queue_depth = 0
+        self._queue_wait_total = 0.0
+        self._thread = threading.Thread(target=self._run, name='micro-batcher', daemon=True)
+        self._thread.start()
+    
+    def submit(self, image_bytes):
+        """
+        Queue an image for batched prediction
         
-        return self.predict(image_bytes)
+        Bypasses the prediction cache; ``predict`` checks and fills it on the
+        caller's thread so cache writes never stall the batcher thread.
+        
+        Args:
+            image_bytes (bytes): Raw image bytes
+            
+        Returns:
+            concurrent.futures.Future: Resolves to the prediction result dict
+            
+        Raises:
+            QueueFullError: If ``max_queue_size`` requests are already admitted
+        """
+        future = Future()
+        with self._lock:
+            self._check_capacity()
+            self._pending += 1
+        try:
+            image_tensor = self.detector.preprocess_image(image_bytes)
+        except Exception:
+            with self._lock:
+                self._pending -= 1
+            raise
+        self._queue.put((image_tensor, future, time.perf_counter()))
+        depth = self._queue.qsize()
+        with self._lock:
+            self._max_queue_depth = max(self._max_queue_depth, depth)
+        return future
+    
+    def predict(self, image_bytes, timeout=None):
+        """
+        Predict the class of an image, blocking until its batch has run
+        
+        Args:
+            image_bytes (bytes): Raw image bytes
+            timeout (float): Seconds to wait for the result, or None to wait forever
+            
+        Returns:
+            dict: Prediction results
+        """
+        cache_key, cached = self.detector.cache_lookup(image_bytes)
+        if cached is not None:
+            return cached
+        result = self.submit(image_bytes).result(timeout)
+        self.detector.cache_store(cache_key, result)
+        return result
+    
+    def check_capacity(self):
+        """
+        Raise ``QueueFullError`` if a new request would be rejected
+        
+        Lets callers shed load before doing any work, such as reading the upload.
+        """
+        with self._lock:
+            self._check_capacity()
+    
+    def admit(self, count):
+        """
+        Count ``count`` images inferred outside the queue as admitted until ``release``
+        
+        A group larger than ``max_queue_size`` is admitted only when nothing else is.
+        
+        Raises:
+            QueueFullError: If the images don't fit under ``max_queue_size``
+        """
+        with self._lock:
+            self._check_capacity(count)
+            self._pending += count
+    
+    def release(self, count):
+        """Return capacity taken by ``admit``"""
+        with self._lock:
+            self._pending -= count
+    
+    def _check_capacity(self, count=1):
+        if self.max_queue_size > 0 and self._pending + min(count, self.max_queue_size) > self.max_queue_size:
+            self._rejected += 1
+            raise QueueFullError(f"Inference queue is full ({self.max_queue_size} requests admitted)")
+    
+    def stats(self):
+        """Return queue-depth and batch-size metrics"""
+        with self._lock:
+            batches = self._batches
+            requests = self._requests
+            return {
+                'max_batch_size': self.max_batch_size,
+                'max_wait_ms': self.max_wait * 1000.0,
+                'queue_depth': self._queue.qsize(),
+                'max_queue_depth': self._max_queue_depth,
+                'max_queue_size': self.max_queue_size,
+                'pending': self._pending,
+                'rejected': self._rejected,
+                'requests': requests,
+                'batches': batches,
+                'mean_batch_size': requests / batches if batches else 0.0,
+                'mean_queue_wait_ms': 1000.0 * self._queue_wait_total / requests if requests else 0.0,
+                'batch_size_counts': {
+                    str(size): count for size, count in enumerate(self._batch_size_counts) if count
+                },
+            }
+    
+    def close(self):
+        """Stop the scheduler thread once already queued requests have been served"""
+        self._queue.put(None)
+        self._thread.join()
+    
+    def _collect(self):
+        """Block for the first request, then gather more until the batch is full or the wait expires"""
+        item = self._queue.get()
+        if item is None:
+            return None
+        batch = [item]
+        deadline = time.perf_counter() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.perf_counter()
+            try:
+                item = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is None:
+                # Re-queue the shutdown sentinel so the loop exits after this batch
+                self._queue.put(None)
+                break
+            batch.append(item)
+        return batch
+    
+    def _run(self):
+        while True:
+            batch = self._collect()
+            if batch is None:
+                return
+            started = time.perf_counter()
+            futures = [future for _, future, _ in batch]
+            try:
+                # Each request contributes one row, or one row per view with TTA
+                results = self.detector.predict_tensors(torch.cat([tensor for tensor, _, _ in batch]),
+                                                        views=[len(tensor) for tensor, _, _ in batch])
+            except Exception as e:
+                for future in futures:
+                    future.set_exception(e)
+            else:
+                for future, result in zip(futures, results):
+                    future.set_result(result)
+            with self._lock:
+                self._pending -= len(batch)
+                self._batches += 1
+                self._requests += len(batch)
+                self._batch_size_counts[len(batch)] += 1
+                self._queue_wait_total += sum(started - queued_at for _, _, queued_at in batch)
+
+class ModelRegistry:
+    """
+    Serve an ``ArtDetector`` whose checkpoint can be replaced without downtime
+    
+    New checkpoints load on a background thread, are warmed up and validated
+    (see ``ArtDetector.validate``), and only then swapped in. The swap replaces
+    one reference, so requests already running finish on the model they
+    started with and none of them wait. A candidate model can take a fraction
+    of the traffic, either answering it ('ab') or running on a copy of it
+    off the request path for comparison only ('shadow').
+    
+    The registry offers the detector's serving methods (``predict``,
+    ``preprocess_image``, ``cache_lookup``, ``cache_store``,
+    ``predict_tensors``), so ``MicroBatcher`` and the web app use it in place
+    of an ``ArtDetector``; other attributes come from the active detector.
+    Every result carries ``model_version``, the checkpoint digest of the model
+    that answered it.
+    
+    Models the registry loads are read into private memory, never
+    memory-mapped: a checkpoint overwritten in place must not change (or,
+    if it shrinks, crash with SIGBUS) a model that is still serving.
+    """
+    MODES = ('ab', 'shadow')
+    
+    def __init__(self, detector, detector_kwargs=None, warmup_batch_sizes=(1,), max_shadow_backlog=64):
+        """
+        Args:
+            detector (ArtDetector): Initially active detector
+            detector_kwargs (dict): ``ArtDetector`` arguments (other than the
+                checkpoint) used for every model this registry loads
+            warmup_batch_sizes: Warmup batch sizes for newly loaded models
+            max_shadow_backlog (int): Shadow batches allowed to wait for the
+                candidate before further ones are skipped
+        """
+        self.detector_kwargs = {**(detector_kwargs or {}), 'mmap_weights': False}
+        self.warmup_batch_sizes = tuple(warmup_batch_sizes)
+        self.max_shadow_backlog = max_shadow_backlog
+        # (active, candidate, mode, fraction), replaced as a whole so readers never need the lock
+        self._route = (detector, None, 'ab', 0.0)
+        self._lock = threading.Lock()
+        self._loading = None
+        self._last_error = None
+        self._swaps = 0
+        self._served = {}
+        self._shadow = {'compared': 0, 'agreed': 0, 'abs_diff_total': 0.0, 'skipped': 0}
+        self._shadow_pool = None
+        self._shadow_pid = None
+        self._shadow_backlog = 0
+        self._watcher_pid = None
+    
+    @property
+    def active(self):
+        return self._route[0]
+    
+    @property
+    def candidate(self):
+        return self._route[1]
+    
+    def __getattr__(self, name):
+        # Only reached for attributes the registry doesn't define (device, cache, tta, ...)
+        if name.startswith('_'):
+            raise AttributeError(name)
+        return getattr(self._route[0], name)
+    
+    def load(self, checkpoint_path, candidate=False, mode='ab', fraction=0.0, background=True):
+        """
+        Load, warm up and validate a checkpoint, then make it active or the candidate
+        
+        Args:
+            checkpoint_path (str): Checkpoint to load
+            candidate (bool): Install it as the candidate instead of replacing
+                the active model
+            mode (str): 'ab' serves ``fraction`` of the images from the
+                candidate; 'shadow' also runs that fraction on the candidate
+                but always answers from the active model
+            fraction (float): Share of images routed to the candidate (0-1)
+            background (bool): Return immediately and load on a thread
+            
+        Returns:
+            ArtDetector: The loaded detector, or None when loading in the background
+            
+        Raises:
+            RuntimeError: If another load is still in progress
+        """
+        if mode not in self.MODES:
+            raise ValueError(f"mode must be one of {self.MODES}, got {mode!r}")
+        with self._lock:
+            if self._loading is not None:
+                raise RuntimeError(f"Already loading {self._loading}")
+            self._loading = checkpoint_path
+        args = (checkpoint_path, candidate, mode, min(max(float(fraction), 0.0), 1.0))
+        if not background:
+            return self._load(*args)
+        threading.Thread(target=self._load_quietly, args=args, name='model-reload', daemon=True).start()
+        return None
+    
+    def _load_quietly(self, *args):
+        try:
+            self._load(*args)
+        except Exception as e:
+            print(f"Model reload failed: {e}")
+    
+    def _load(self, checkpoint_path, candidate, mode, fraction):
+        try:
+            if not os.path.exists(checkpoint_path):
+                # ArtDetector would fall back to random weights, which must never be swapped in
+                raise FileNotFoundError(f"Checkpoint {checkpoint_path} not found")
+            detector = ArtDetector(checkpoint_path, **self.detector_kwargs)
+            detector.warmup(self.warmup_batch_sizes)
+            probabilities = detector.validate()
+            agreement = float((probabilities.argmax(1) == self.active.validate().argmax(1)).float().mean())
+        except Exception as e:
+            with self._lock:
+                self._loading = None
+                self._last_error = f"{checkpoint_path}: {type(e).__name__}: {e}"
+            raise
+        with self._lock:
+            active, current_candidate, current_mode, current_fraction = self._route
+            if candidate:
+                self._route = (active, detector, mode, fraction)
+            else:
+                # The candidate and its traffic split carry over to the new active model
+                self._route = (detector, current_candidate, current_mode, current_fraction)
+                self._swaps += 1
+            self._loading = None
+            self._last_error = None
+        role = f"candidate ({mode}, {fraction:.0%} of traffic)" if candidate else 'active model'
+        print(f"Loaded {checkpoint_path} [{detector.model_id}] as the {role}; "
+              f"agrees with the serving model on {agreement:.0%} of the validation batch")
+        return detector
+    
+    def promote(self):
+        """Make the candidate the active model"""
+        with self._lock:
+            _, candidate, _, _ = self._route
+            if candidate is None:
+                raise RuntimeError("No candidate model to promote")
+            self._route = (candidate, None, 'ab', 0.0)
+            self._swaps += 1
+    
+    def set_traffic(self, mode=None, fraction=None):
+        """Change how the candidate is used; ``fraction=0`` stops routing to it"""
+        with self._lock:
+            active, candidate, current_mode, current_fraction = self._route
+            mode = current_mode if mode is None else mode
+            if mode not in self.MODES:
+                raise ValueError(f"mode must be one of {self.MODES}, got {mode!r}")
+            fraction = current_fraction if fraction is None else min(max(float(fraction), 0.0), 1.0)
+            self._route = (active, candidate, mode, fraction)
+    
+    def drop_candidate(self):
+        with self._lock:
+            self._route = (self._route[0], None, 'ab', 0.0)
+    
+    def watch(self, interval=10.0):
+        """
+        Reload the active checkpoint whenever its file changes (once per process)
+        
+        A change is acted on once the file's size and mtime have held still
+        for one interval, so a copy that is still being written is not loaded
+        half-way. Models already serving are unaffected either way, since
+        their weights live in private memory (the active model must not be
+        memory-mapped; ``load_detector`` ensures that when watching). Atomic
+        replacement, as ``train.py`` does it, still avoids the wait.
+        """
+        if interval <= 0 or self._watcher_pid == os.getpid():
+            return
+        self._watcher_pid = os.getpid()
+        threading.Thread(target=self._watch, args=(interval,), name='checkpoint-watcher', daemon=True).start()
+    
+    def _watch(self, interval):
+        def signature(path):
+            try:
+                stat = os.stat(path)
+            except OSError:
+                return None
+            return stat.st_mtime_ns, stat.st_size
+        
+        path = None
+        while True:
+            if self.active.checkpoint_path != path:
+                # Started, or a different checkpoint was loaded explicitly: watch that file from now on
+                path = self.active.checkpoint_path
+                loaded = previous = signature(path)
+            time.sleep(interval)
+            current = signature(path)
+            if current is not None and current != loaded and current == previous and self._loading is None:
+                loaded = current
+                try:
+                    self.load(path, background=False)
+                except Exception as e:
+                    print(f"Model reload failed: {e}")
+            previous = current
+    
+    def status(self):
+        """Versions, traffic split, shadow agreement and reload state for /health"""
+        active, candidate, mode, fraction = self._route
+        with self._lock:
+            shadow = dict(self._shadow)
+            info = {
+                'active': {'version': active.model_id, 'checkpoint': active.checkpoint_path},
+                'swaps': self._swaps,
+                'loading': self._loading,
+                'served': dict(self._served),
+            }
+            if self._last_error:
+                info['last_error'] = self._last_error
+        if candidate is not None:
+            info['candidate'] = {'version': candidate.model_id, 'checkpoint': candidate.checkpoint_path,
+                                 'mode': mode, 'fraction': fraction}
+        if shadow['compared'] or shadow['skipped']:
+            compared = max(shadow['compared'], 1)
+            info['shadow'] = {
+                'compared': shadow['compared'],
+                'skipped': shadow['skipped'],
+                'agreement': shadow['agreed'] / compared,
+                'mean_abs_diff': shadow['abs_diff_total'] / compared,
+            }
+        return info
+    
+    def predict(self, image_bytes):
+        """``ArtDetector.predict`` routed through the registry"""
+        cache_key, cached = self.cache_lookup(image_bytes)
+        if cached is not None:
+            return cached
+        image_tensor = self.preprocess_image(image_bytes)
+        result = self.predict_tensors(image_tensor, views=[len(image_tensor)])[0]
+        self.cache_store(cache_key, result)
+        return result
+    
+    def preprocess_image(self, image_bytes):
+        # Every model loaded here shares the same preprocessing settings
+        return self.active.preprocess_image(image_bytes)
+    
+    def cache_lookup(self, image_bytes):
+        return self.active.cache_lookup(image_bytes)
+    
+    def cache_store(self, key, result):
+        """Cache only the active model's answers (A/B answers from the candidate are not cached)"""
+        active = self.active
+        if result.get('model_version') == active.model_id:
+            active.cache_store(key, result)
+    
+    def predict_tensors(self, image_tensors, views=None):
+        """``ArtDetector.predict_tensors``, splitting or shadowing images to the candidate"""
+        active, candidate, mode, fraction = self._route
+        views = [1] * len(image_tensors) if views is None else list(views)
+        picked = [] if candidate is None or fraction <= 0 else \
+            [i for i in range(len(views)) if random.random() < fraction]
+        if not picked:
+            results = active.predict_tensors(image_tensors, views)
+        elif mode == 'shadow':
+            results = active.predict_tensors(image_tensors, views)
+            self._submit_shadow(candidate, image_tensors, views, picked, results)
+        else:
+            results = [None] * len(views)
+            chosen = set(picked)
+            rest = [i for i in range(len(views)) if i not in chosen]
+            for detector, indices in ((candidate, picked), (active, rest)):
+                if indices:
+                    rows, group_views = self._select(image_tensors, views, indices)
+                    for i, result in zip(indices, detector.predict_tensors(rows, group_views)):
+                        results[i] = result
+        with self._lock:
+            for result in results:
+                version = result['model_version']
+                self._served[version] = self._served.get(version, 0) + 1
+        return results
+    
+    @staticmethod
+    def _select(image_tensors, views, indices):
+        """Rows and view counts of the images at ``indices``"""
+        starts = [0]
+        for n in views:
+            starts.append(starts[-1] + n)
+        if all(n == 1 for n in views):
+            return image_tensors[indices], [1] * len(indices)
+        rows = torch.cat([torch.arange(starts[i], starts[i + 1]) for i in indices])
+        return image_tensors[rows], [views[i] for i in indices]
+    
+    def _submit_shadow(self, candidate, image_tensors, views, picked, results):
+        """Run the picked images on the candidate in the background and record agreement"""
+        if self._shadow_pool is None or self._shadow_pid != os.getpid():
+            with self._lock:
+                if self._shadow_pool is None or self._shadow_pid != os.getpid():
+                    self._shadow_pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix='shadow')
+                    self._shadow_pid = os.getpid()
+                    self._shadow_backlog = 0
+        with self._lock:
+            if self._shadow_backlog >= self.max_shadow_backlog:
+                self._shadow['skipped'] += len(picked)
+                return
+            self._shadow_backlog += 1
+        rows, group_views = self._select(image_tensors, views, picked)
+        expected = [results[i] for i in picked]
+        self._shadow_pool.submit(self._compare_shadow, candidate, rows, group_views, expected)
+    
+    def _compare_shadow(self, candidate, rows, views, expected):
+        try:
+            shadow_results = candidate.predict_tensors(rows, views)
+        except Exception as e:
+            print(f"Shadow prediction failed: {e}")
+            shadow_results = []
+        with self._lock:
+            self._shadow_backlog -= 1
+            for mine, theirs in zip(expected, shadow_results):
+                self._shadow['compared'] += 1
+                self._shadow['agreed'] += int(mine['predicted_class'] == theirs['predicted_class'])
+                self._shadow['abs_diff_total'] += abs(mine['confidence'] - theirs['probabilities'][mine['predicted_class']])
+
+def _replica_main(index, cores, checkpoint_path, detector_kwargs, requests, results, max_batch_size,
+                  warmup_batch_sizes):
+    """Body of one ``InferencePool`` replica process"""
+    if cores and hasattr(os, 'sched_setaffinity'):
+        os.sched_setaffinity(0, cores)
+    torch.set_num_threads(max(1, len(cores)))
+    try:
+        detector = ArtDetector(checkpoint_path, device='cpu', **detector_kwargs)
+        detector.warmup(warmup_batch_sizes)
+    except Exception as e:
+        results.put(('failed', index, f'{type(e).__name__}: {e}'))
+        return
+    results.put(('ready', index, detector.model_id))
+    
+    stop = False
+    while not stop:
+        item = requests.get()
+        if item is None:
+            break
+        batch = [item]
+        # Take whatever else is already queued, without waiting for more
+        while len(batch) < max_batch_size:
+            try:
+                item = requests.get_nowait()
+            except queue.Empty:
+                break
+            if item is None:
+                stop = True
+                break
+            batch.append(item)
+        
+        ids, tensors, views = [], [], []
+        for request_id, payload, num_views in batch:
+            try:
+                if payload.dtype == torch.uint8:
+                    # Encoded image bytes: decode here so the parent process never holds the GIL for it
+                    payload = detector.preprocess_image(memoryview(payload.numpy()))
+                    num_views = len(payload)
+            except Exception as e:
+                results.put(('error', index, ([request_id], f'Could not decode image: {e}')))
+                continue
+            ids.append(request_id)
+            tensors.append(payload)
+            views.append(num_views)
+        if not ids:
+            continue
+        try:
+            predictions = detector.predict_tensors(torch.cat(tensors), views=views)
+        except Exception as e:
+            results.put(('error', index, (ids, str(e))))
+        else:
+            results.put(('done', index, list(zip(ids, predictions))))
+
+class InferencePool:
+    """
+    K model replicas in separate processes, each pinned to its own cores
+    
+    One PyTorch process scales poorly on small batches across many cores, so
+    the pool runs several replicas, each with a disjoint core set from
+    ``plan_core_sets`` (NUMA-aware) and a matching ``torch.set_num_threads``.
+    Requests travel over ``torch.multiprocessing`` queues: tensors and
+    encoded images (as uint8 tensors) are passed through shared memory rather
+    than pickled. Each request goes to the replica with the fewest requests
+    outstanding, which batches whatever is already waiting for it, up to
+    ``max_batch_size``. Every replica has its own queues, so one that dies
+    fails only its own requests and is restarted.
+    
+    ``python benchmark.py autotune`` picks K and the threads per replica for
+    a latency target.
+    
+    Example:
+        pool = InferencePool('models/detector.pth', replicas=4)
+        result = pool.predict(image_bytes)
+        pool.close()
+    """
+    def __init__(self, checkpoint_path='models/detector.pth', replicas=None, threads_per_replica=None,
+                 max_batch_size=1, warmup_batch_sizes=(1,), start_timeout=600, **detector_kwargs):
+        """
+        Args:
+            checkpoint_path (str): Checkpoint every replica loads
+            replicas (int): Number of replica processes (default: one per NUMA node)
+            threads_per_replica (int): Cores per replica (default: an even split)
+            max_batch_size (int): Most queued requests a replica runs in one forward pass
+            warmup_batch_sizes: Warmup batch sizes each replica runs before serving
+            start_timeout (float): Seconds to wait for all replicas to load
+            **detector_kwargs: Further ``ArtDetector`` arguments (preprocess, backend,
+                tta_*, cascade_*); the prediction cache is not supported here
+        """
+        from .serving import numa_cpu_groups, plan_core_sets
+        
+        self.core_sets = plan_core_sets(replicas or len(numa_cpu_groups()), threads_per_replica)
+        self.replicas = len(self.core_sets)
+        self.checkpoint_path = checkpoint_path
+        self.model_id = None
+        self._args = (checkpoint_path, detector_kwargs, max_batch_size, tuple(warmup_batch_sizes))
+        # spawn: forking a process that already runs threads (web servers, collectors) can deadlock
+        self._context = torch.multiprocessing.get_context('spawn')
+        self._ids = itertools.count()
+        self._lock = threading.Lock()
+        self._served = [0] * self.replicas
+        self._restarts = 0
+        self._closed = False
+        self._replicas = [self._start_replica(i) for i in range(self.replicas)]
+        
+        deadline = time.monotonic() + start_timeout
+        for index, replica in enumerate(self._replicas):
+            try:
+                kind, _, payload = replica['results'].get(timeout=max(0.0, deadline - time.monotonic()))
+            except queue.Empty:
+                self.close()
+                raise RuntimeError(f"Replica {index} did not start within {start_timeout}s")
+            if kind == 'failed':
+                self.close()
+                raise RuntimeError(f"Replica {index} failed to load: {payload}")
+            self.model_id = payload
+        for index, replica in enumerate(self._replicas):
+            self._start_collector(index, replica)
+        print(f"Inference pool: {self.replicas} replicas on cores "
+              + ' | '.join(','.join(map(str, cores)) for cores in self.core_sets))
+    
+    def _start_replica(self, index):
+        checkpoint_path, detector_kwargs, max_batch_size, warmup_batch_sizes = self._args
+        requests, results = self._context.Queue(), self._context.Queue()
+        process = self._context.Process(
+            target=_replica_main, name=f'replica-{index}', daemon=True,
+            args=(index, self.core_sets[index], checkpoint_path, detector_kwargs, requests, results,
+                  max_batch_size, warmup_batch_sizes))
+        process.start()
+        return {'process': process, 'requests': requests, 'results': results, 'outstanding': {}}
+    
+    def _start_collector(self, index, replica):
+        threading.Thread(target=self._collect, args=(index, replica), name=f'pool-collector-{index}',
+                         daemon=True).start()
+    
+    def submit(self, image, views=None):
+        """
+        Queue one image on the least busy replica
+        
+        Args:
+            image: Raw image bytes (decoded by the replica), or a preprocessed
+                float tensor of shape (3, H, W) or (V, 3, H, W)
+            views (int): Rows of ``image`` belonging to it (default: all)
+            
+        Returns:
+            concurrent.futures.Future: Resolves to the prediction result dict
+        """
+        if self._closed:
+            raise RuntimeError("Inference pool is closed")
+        if isinstance(image, (bytes, bytearray, memoryview)):
+            payload, views = torch.frombuffer(bytearray(image), dtype=torch.uint8), None
+        else:
+            payload = image.unsqueeze(0) if image.dim() == 3 else image
+            views = len(payload) if views is None else views
+        future = Future()
+        with self._lock:
+            request_id = next(self._ids)
+            replica = min(self._replicas, key=lambda r: len(r['outstanding']))
+            replica['outstanding'][request_id] = future
+        replica['requests'].put((request_id, payload, views))
+        return future
+    
+    def predict(self, image_bytes, timeout=None):
+        """Predict one image, blocking until a replica answers"""
+        return self.submit(image_bytes).result(timeout)
+    
+    def predict_tensors(self, image_tensors, views=None, timeout=None):
+        """
+        ``ArtDetector.predict_tensors`` spread over the replicas, one image per request
+        
+        Returns:
+            list: One prediction result dict per image
+        """
+        views = [1] * len(image_tensors) if views is None else list(views)
+        futures, start = [], 0
+        for n in views:
+            futures.append(self.submit(image_tensors[start:start + n], views=n))
+            start += n
+        return [future.result(timeout) for future in futures]
+    
+    def stats(self):
+        with self._lock:
+            return {
+                'replicas': self.replicas,
+                'core_sets': self.core_sets,
+                'served': list(self._served),
+                'outstanding': [len(r['outstanding']) for r in self._replicas],
+                'restarts': self._restarts,
+            }
+    
+    def close(self):
+        """Stop every replica once the requests already queued have been answered"""
+        if self._closed:
+            return
+        self._closed = True
+        for replica in self._replicas:
+            replica['requests'].put(None)
+        for replica in self._replicas:
+            replica['process'].join(timeout=30)
+            if replica['process'].is_alive():
+                replica['process'].terminate()
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, *exc):
+        self.close()
+    
+    def _collect(self, index, replica):
+        """Resolve one replica's futures; if it dies, fail its requests and start a new one"""
+        outstanding = replica['outstanding']
+        while True:
+            try:
+                kind, _, payload = replica['results'].get(timeout=1.0)
+            except queue.Empty:
+                if replica['process'].is_alive():
+                    continue
+                if self._closed:
+                    return
+                self._restart(index, replica)
+                return
+            except (EOFError, OSError):
+                return
+            if kind == 'done':
+                with self._lock:
+                    self._served[index] += len(payload)
+                    resolved = [(outstanding.pop(request_id, None), result) for request_id, result in payload]
+                for future, result in resolved:
+                    if future is not None:
+                        future.set_result(result)
+            elif kind == 'error':
+                ids, error = payload
+                with self._lock:
+                    futures = [outstanding.pop(request_id, None) for request_id in ids]
+                for future in futures:
+                    if future is not None:
+                        future.set_exception(RuntimeError(error))
+            elif kind == 'failed':
+                print(f"Replica {index} failed to restart: {payload}")
+                return
+    
+    def _restart(self, index, replica):
+        exitcode = replica['process'].exitcode
+        print(f"Replica {index} exited with code {exitcode}; restarting it")
+        new_replica = self._start_replica(index)
+        with self._lock:
+            # New requests go to the fresh process (queued until it has loaded)
+            self._replicas[index] = new_replica
+            futures = list(replica['outstanding'].values())
+            replica['outstanding'].clear()
+            self._restarts += 1
+        for future in futures:
+            future.set_exception(RuntimeError(f"Replica {index} exited with code {exitcode}"))
+        self._start_collector(index, new_replica)
+
+def cascade_calibration_path(cascade_checkpoint):
+    """Where ``python -m src.cascade`` stores the calibrated threshold for a first-stage checkpoint"""
+    return os.path.splitext(cascade_checkpoint)[0] + '_cascade.json'
+
+def write_predictions(results, output_path, class_names=('AI', 'Human')):
+    """
+    Write streamed prediction results to a JSONL or CSV file, one row at a time
+    
+    Args:
+        results: Iterable of result dicts from ``ArtDetector.predict_batch``
+        output_path (str): Destination; ``.csv`` writes CSV, anything else JSONL
+        class_names (sequence): Classes to emit probability columns for in CSV
+        
+    Returns:
+        int: Number of rows written
+    """
+    count = 0
+    with open(output_path, 'w', newline='') as f:
+        if output_path.lower().endswith('.csv'):
+            fields = ['path', 'predicted_class', 'confidence'] + [f'prob_{c}' for c in class_names] + ['error']
+            writer = csv.DictWriter(f, fieldnames=fields)
+            writer.writeheader()
+            for result in results:
+                row = {
+                    'path': result['path'],
+                    'predicted_class': result.get('predicted_class', ''),
+                    'confidence': result.get('confidence', ''),
+                    'error': result.get('error', ''),
+                }
+                for c, p in result.get('probabilities', {}).items():
+                    row[f'prob_{c}'] = p
+                writer.writerow(row)
+                count += 1
+        else:
+            for result in results:
+                f.write(json.dumps(result) + '\n')
+                count += 1
+    return count
 
 # Convenience function for quick inference
 def quick_predict(image_bytes, checkpoint_path='models/detector.pth'):
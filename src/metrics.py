@@ -0,0 +1,131 @@
+"""
+Lightweight latency metrics and sampling profiler for the serving hot path
+
+Histograms are kept in-process and rendered in the Prometheus text exposition
+format by ``render_prometheus``. Each gunicorn worker keeps its own metrics.
+"""
+import bisect
+import cProfile
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+class Histogram:
+    """Cumulative-bucket histogram with one label dimension"""
+    def __init__(self, name, help_text, label, buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.label = label
+        self.buckets = tuple(buckets)
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, label_value):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(label_value)
+            if series is None:
+                series = self._series[label_value] = [[0] * (len(self.buckets) + 1), 0.0]
+            series[0][index] += 1
+            series[1] += value
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help_text}', f'# TYPE {self.name} histogram']
+        with self._lock:
+            series = {k: (list(counts), total) for k, (counts, total) in self._series.items()}
+        for label_value, (counts, total) in sorted(series.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += count
+                le = '+Inf' if bound == float('inf') else repr(bound)
+                lines.append(f'{self.name}_bucket{{{self.label}="{label_value}",le="{le}"}} {cumulative}')
+            lines.append(f'{self.name}_sum{{{self.label}="{label_value}"}} {total}')
+            lines.append(f'{self.name}_count{{{self.label}="{label_value}"}} {cumulative}')
+        return lines
+
+# Time spent in each step of serving a prediction
+STAGE_SECONDS = Histogram(
+    'art_detector_stage_seconds',
+    'Time spent per prediction stage (read_upload, decode, transform, forward, postprocess, serialize, request)',
+    label='stage',
+)
+
+_histograms = [STAGE_SECONDS]
+_collectors = []
+
+@contextmanager
+def timer(stage, histogram=STAGE_SECONDS):
+    """Observe the duration of the ``with`` block under ``stage``"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        histogram.observe(time.perf_counter() - start, stage)
+
+def register_collector(collect):
+    """
+    Add a callable evaluated at scrape time
+
+    It returns ``(name, type, help, value)`` tuples, where ``type`` is
+    'gauge' or 'counter'.
+    """
+    _collectors.append(collect)
+
+def render_prometheus():
+    """All registered metrics in the Prometheus text exposition format"""
+    lines = []
+    for histogram in _histograms:
+        lines.extend(histogram.render())
+    for collect in _collectors:
+        for name, kind, help_text, value in collect():
+            lines.extend([f'# HELP {name} {help_text}', f'# TYPE {name} {kind}', f'{name} {value}'])
+    return '\n'.join(lines) + '\n'
+
+class RequestProfiler:
+    """
+    Profile every Nth request and dump the trace to disk
+
+    ``kind='cprofile'`` writes ``.prof`` files (open with ``snakeviz`` or
+    ``pstats``); ``kind='torch'`` writes Chrome traces from ``torch.profiler``.
+    Both only see work done on the request thread, so run without the
+    micro-batcher to capture the forward pass. At most one request is
+    profiled at a time; others in the same window are skipped.
+    """
+    def __init__(self, every_n, output_dir, kind='cprofile'):
+        self.every_n = max(1, int(every_n))
+        self.output_dir = output_dir
+        self.kind = kind
+        self._count = 0
+        self._lock = threading.Lock()
+        self._active = threading.Lock()
+        os.makedirs(output_dir, exist_ok=True)
+
+    @contextmanager
+    def maybe_profile(self, name='request'):
+        with self._lock:
+            self._count += 1
+            sample = self._count % self.every_n == 0
+        if not sample or not self._active.acquire(blocking=False):
+            yield
+            return
+        stem = os.path.join(self.output_dir, f'{name}-{int(time.time() * 1000)}-{os.getpid()}')
+        try:
+            if self.kind == 'torch':
+                import torch.profiler
+
+                with torch.profiler.profile(record_shapes=True) as prof:
+                    yield
+                prof.export_chrome_trace(stem + '.json')
+            else:
+                profiler = cProfile.Profile()
+                profiler.enable()
+                try:
+                    yield
+                finally:
+                    profiler.disable()
+                    profiler.dump_stats(stem + '.prof')
+        finally:
+            self._active.release()
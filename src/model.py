@@ -1,8 +1,71 @@
+import hashlib
+import torch
 import torch.nn as nn
 from torchvision import models
 
-def get_model(num_classes=3, pretrained=True):
-    model = models.resnet50(weights=models.ResNet50_Weights.DEFAULT if pretrained else None)
-    in_features = model.fc.in_features
-    model.fc = nn.Linear(in_features, num_classes)
+# Backbones get_model can build; the small ones serve as the cascade's first stage
+ARCHITECTURES = ('resnet50', 'resnet34', 'resnet18', 'mobilenet_v3_large', 'mobilenet_v3_small')
+
+def get_model(num_classes=3, pretrained=True, arch='resnet50'):
+    if arch not in ARCHITECTURES:
+        raise ValueError(f"Unknown architecture {arch!r}; choose from {', '.join(ARCHITECTURES)}")
+    model = models.get_model(arch, weights='DEFAULT' if pretrained else None)
+    if arch.startswith('resnet'):
+        in_features = model.fc.in_features
+        model.fc = nn.Linear(in_features, num_classes)
+    else:
+        in_features = model.classifier[-1].in_features
+        model.classifier[-1] = nn.Linear(in_features, num_classes)
     return model
+
+def load_state_dict(checkpoint_path, map_location='cpu', mmap=False):
+    """
+    Load a saved ``state_dict``
+
+    With ``mmap=True`` the tensors stay backed by the checkpoint file instead of
+    being read into private memory, so processes loading the same file share
+    the weights through the page cache.
+    """
+    return torch.load(checkpoint_path, map_location=map_location, mmap=mmap, weights_only=True)
+
+def load_checkpoint(checkpoint_path, map_location='cpu', mmap=False, default_arch='resnet50'):
+    """
+    Load a checkpoint as ``(arch, state_dict)``
+
+    Accepts plain ``state_dict`` files, taken to be ``default_arch``, and the
+    ``{'arch': ..., 'state_dict': ...}`` dicts ``checkpoint_payload`` writes
+    for other architectures.
+    """
+    checkpoint = load_state_dict(checkpoint_path, map_location=map_location, mmap=mmap)
+    if isinstance(checkpoint.get('arch'), str) and 'state_dict' in checkpoint:
+        return checkpoint['arch'], checkpoint['state_dict']
+    return default_arch, checkpoint
+
+def checkpoint_payload(state_dict, arch='resnet50'):
+    """What to save for a model: ResNet-50 stays a plain ``state_dict``, other backbones record their ``arch``"""
+    if arch == 'resnet50':
+        return state_dict
+    return {'arch': arch, 'state_dict': state_dict}
+
+def load_model(checkpoint_path, num_classes=2, map_location='cpu', mmap=False, default_arch='resnet50'):
+    """
+    Build the right architecture for a checkpoint and load its weights
+
+    With ``mmap=True`` the parameters stay backed by the checkpoint file.
+
+    Returns:
+        tuple: ``(model, arch)``
+    """
+    arch, state_dict = load_checkpoint(checkpoint_path, map_location, mmap, default_arch)
+    model = get_model(num_classes=num_classes, pretrained=False, arch=arch).to(map_location)
+    # assign=True keeps the memory-mapped tensors as the parameters instead of copying them
+    model.load_state_dict(state_dict, assign=mmap)
+    return model, arch
+
+def checkpoint_digest(checkpoint_path):
+    """Identify a checkpoint by a hash of its contents"""
+    digest = hashlib.sha256()
+    with open(checkpoint_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            digest.update(chunk)
+    return digest.hexdigest()[:16]
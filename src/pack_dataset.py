@@ -0,0 +1,69 @@
+"""
+Pack an image folder dataset into memory-mapped uint8 arrays
+
+Decoding and resizing happen once; afterwards ``PackedDataset`` serves each
+sample as a zero-copy tensor view of the mapped file. For each split this
+writes ``<split>_images.npy`` (N x H x W x 3 uint8), ``<split>_labels.npy``
+and ``<split>_meta.json``.
+"""
+import argparse
+import json
+import os
+import numpy as np
+from PIL import Image
+from torch.utils.data import DataLoader
+from tqdm import tqdm
+
+from .datasets import ArtDataset
+
+class PackTransform:
+    """Resize exactly like ``transforms.Resize`` on PIL images and return HWC uint8 pixels"""
+    def __init__(self, image_size):
+        self.size = (image_size, image_size)
+
+    def __call__(self, img):
+        return np.asarray(img.resize(self.size, Image.BILINEAR))
+
+def pack_split(data_dir, split, output_dir, image_size=224, class_names=None, batch_size=64, num_workers=4):
+    ds = ArtDataset(data_dir, split=split, transform=PackTransform(image_size), class_names=class_names)
+    images = np.lib.format.open_memmap(
+        os.path.join(output_dir, f'{split}_images.npy'), mode='w+', dtype=np.uint8,
+        shape=(len(ds), image_size, image_size, 3),
+    )
+    labels = np.empty(len(ds), dtype=np.int64)
+    loader = DataLoader(ds, batch_size=batch_size, shuffle=False, num_workers=num_workers)
+
+    offset = 0
+    for x, y in tqdm(loader, desc=f"Pack {split}"):
+        images[offset:offset + len(x)] = x.numpy()
+        labels[offset:offset + len(y)] = y.numpy()
+        offset += len(x)
+    images.flush()
+    del images
+    np.save(os.path.join(output_dir, f'{split}_labels.npy'), labels)
+
+    meta = {
+        'class_names': ds.class_names,
+        'image_size': image_size,
+        'count': len(ds),
+        'paths': [path for path, _ in ds.samples],
+    }
+    with open(os.path.join(output_dir, f'{split}_meta.json'), 'w') as f:
+        json.dump(meta, f)
+    print(f"Packed {len(ds)} {split} images -> {output_dir}")
+
+if __name__ == '__main__':
+    p = argparse.ArgumentParser(description='Pack train/val images into memory-mapped arrays')
+    p.add_argument('--data_dir', type=str, default='data')
+    p.add_argument('--output_dir', type=str, default='data/packed')
+    p.add_argument('--splits', nargs='+', default=['train', 'val'])
+    p.add_argument('--image_size', type=int, default=224)
+    p.add_argument('--num_classes', type=int, default=2)
+    p.add_argument('--batch_size', type=int, default=64)
+    p.add_argument('--num_workers', type=int, default=4)
+    args = p.parse_args()
+    os.makedirs(args.output_dir, exist_ok=True)
+    class_names = ['AI', 'Human'] if args.num_classes == 2 else None
+    for split in args.splits:
+        pack_split(args.data_dir, split, args.output_dir, args.image_size, class_names,
+                   args.batch_size, args.num_workers)
@@ -0,0 +1,34 @@
+import argparse
+import time
+
+from .inference import ArtDetector, write_predictions
+
+def predict(args):
+    detector = ArtDetector(args.checkpoint, backend=args.backend, preprocess=args.preprocess,
+                           tta_tiles=args.tta_tiles, tta_flip=args.tta_flip,
+                           tta_max_side=args.tta_max_side)
+    results = detector.predict_batch(args.input, batch_size=args.batch_size, num_workers=args.num_workers)
+    start = time.time()
+    count = write_predictions(results, args.output, class_names=detector.class_names)
+    elapsed = time.time() - start
+    print(f"Wrote {count} predictions to {args.output} in {elapsed:.1f}s ({count / max(elapsed, 1e-9):.1f} img/s)")
+
+if __name__ == '__main__':
+    p = argparse.ArgumentParser(description='Batch-predict a directory or list of images')
+    p.add_argument('--input', type=str, required=True,
+                   help='Image directory (searched recursively) or text file with one image path per line')
+    p.add_argument('--output', type=str, default='predictions.jsonl',
+                   help='Output file; .csv writes CSV, anything else JSONL')
+    p.add_argument('--checkpoint', type=str, default='models/detector.pth')
+    p.add_argument('--batch_size', type=int, default=32)
+    p.add_argument('--num_workers', type=int, default=4)
+    p.add_argument('--backend', choices=['eager', 'torchscript', 'onnx'], default='eager')
+    p.add_argument('--preprocess', choices=['pil', 'fast'], default='pil',
+                   help="'fast' decodes JPEGs at reduced size and resizes/normalizes on tensors")
+    p.add_argument('--tta_tiles', type=int, default=0,
+                   help='Also classify this many 224x224 tiles per image and average all views')
+    p.add_argument('--tta_flip', action='store_true', help='Add horizontally flipped copies of every view')
+    p.add_argument('--tta_max_side', type=int, default=1024,
+                   help='Cut tiles from the image scaled to at most this shorter side (0 keeps full resolution)')
+    args = p.parse_args()
+    predict(args)
@@ -0,0 +1,164 @@
+"""
+Fast image decoding and tensor-native preprocessing
+
+``TensorTransform`` is a drop-in replacement for the torchvision PIL pipeline
+(Resize -> ToTensor -> Normalize). JPEGs are decoded at a reduced DCT scale
+with PIL's ``draft()`` when they are much larger than the target size, the
+resize runs on the uint8 tensor, and ToTensor + Normalize collapse into a
+single multiply-add. Outputs match the PIL pipeline to within a few uint8
+steps per pixel; ``draft()`` only kicks in for images at least twice the
+target size.
+"""
+import io
+import warnings
+import numpy as np
+import torch
+import torchvision.transforms.functional as TF
+from PIL import Image
+
+IMAGENET_MEAN = (0.485, 0.456, 0.406)
+IMAGENET_STD = (0.229, 0.224, 0.225)
+
+def open_image(source, draft_size=None):
+    """
+    Open an image as RGB
+
+    Args:
+        source: File path, file object or raw image bytes
+        draft_size (tuple): If set, let JPEG decoding downscale by 1/2, 1/4 or
+            1/8 as long as the result stays at least this large
+
+    Returns:
+        PIL.Image: Decoded RGB image
+    """
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        source = io.BytesIO(source)
+    img = Image.open(source)
+    if draft_size is not None and img.format == 'JPEG':
+        img.draft('RGB', draft_size)
+    return img.convert('RGB')
+
+def to_uint8_tensor(img):
+    """
+    Convert a PIL image, HWC uint8 array or CHW uint8 tensor to a CHW uint8 tensor
+
+    Arrays and tensors are wrapped without copying the pixel data. Stacked
+    ``(N, H, W, C)`` arrays become ``(N, C, H, W)`` views, grayscale arrays
+    are broadcast to three channels and an alpha channel is sliced off.
+    """
+    if isinstance(img, torch.Tensor):
+        return img
+    if isinstance(img, Image.Image):
+        # np.asarray would give a read-only view of PIL's buffer, which torch warns about
+        img = np.array(img.convert('RGB'))
+    if img.dtype != np.uint8:
+        raise TypeError(f"Expected a uint8 image array, got {img.dtype}")
+    if img.ndim in (2, 3) and (img.ndim == 2 or img.shape[-1] == 1):
+        img = img.reshape(img.shape[:2] + (1,))
+    with warnings.catch_warnings():
+        # Read-only arrays (e.g. np.load(..., mmap_mode='r')) are only ever read here
+        warnings.simplefilter('ignore', UserWarning)
+        x = torch.from_numpy(img)
+    x = x.movedim(-1, -3)
+    if x.shape[-3] == 1:
+        x = x.expand(*x.shape[:-3], 3, *x.shape[-2:])
+    return x[..., :3, :, :]
+
+class TensorTransform:
+    """
+    Resize and normalize an image on uint8 tensors
+
+    Args:
+        image_size (int): Output height and width
+        hflip_prob (float): Probability of a random horizontal flip (training)
+    """
+    def __init__(self, image_size=224, hflip_prob=0.0):
+        self.size = [image_size, image_size]
+        # ArtDataset and ArtDetector pass this to open_image for reduced-size JPEG decoding
+        self.draft_size = (image_size, image_size)
+        self.hflip_prob = hflip_prob
+        std = torch.tensor(IMAGENET_STD).view(3, 1, 1)
+        mean = torch.tensor(IMAGENET_MEAN).view(3, 1, 1)
+        # (x / 255 - mean) / std  ==  x * scale + bias
+        self.scale = 1.0 / (255.0 * std)
+        self.bias = -mean / std
+
+    def __call__(self, img):
+        x = to_uint8_tensor(img)
+        if list(x.shape[-2:]) != self.size:
+            x = TF.resize(x, self.size, antialias=True)
+        if self.hflip_prob > 0 and torch.rand(1).item() < self.hflip_prob:
+            x = x.flip(-1)
+        return self.normalize(x)
+
+    def normalize(self, x):
+        """Fused ToTensor + Normalize for a uint8 CHW (or NCHW) tensor"""
+        return torch.addcmul(self.bias, x.to(torch.float32), self.scale)
+
+class TileTransform:
+    """
+    Test-time augmentation views of one image as a ``(V, 3, S, S)`` batch
+
+    View 0 is the whole image resized to ``S x S`` (what the model saw in
+    training). Then come ``tiles`` ``S x S`` crops spread evenly over the
+    image at up to ``max_side`` resolution, so high-frequency detail is not
+    averaged away by downscaling to ``S``. With ``flip`` set, horizontally flipped copies of those views
+    follow. ``max_views`` truncates the list in that order, so a latency budget
+    drops flips first and the global view last.
+
+    Args:
+        image_size (int): Side of every view
+        tiles (int): Number of crops taken at up to ``max_side`` resolution
+        flip (bool): Add horizontally flipped copies of each view
+        max_side (int): JPEGs are decoded at reduced scale, and other images
+            resized, so the shorter side is at most this (None keeps full size)
+    """
+    def __init__(self, image_size=224, tiles=4, flip=True, max_side=1024):
+        self.image_size = image_size
+        self.tiles = max(0, int(tiles))
+        self.flip = flip
+        self.max_side = max_side
+        self.draft_size = (max_side, max_side) if max_side else None
+        self.num_views = (1 + self.tiles) * (2 if flip else 1)
+        self.max_views = self.num_views
+        self._resize = TensorTransform(image_size)
+
+    @property
+    def output_shape(self):
+        """Shape of the stacked views, e.g. for placeholder tensors"""
+        return (min(self.max_views, self.num_views), 3, self.image_size, self.image_size)
+
+    def tile_origins(self, height, width):
+        """Top-left corners of ``tiles`` crops on an even grid (crops may overlap)"""
+        s = self.image_size
+        cols = max(1, round((self.tiles * width / height) ** 0.5))
+        rows = max(1, -(-self.tiles // cols))
+        grid = [(int(y), int(x)) for y in np.linspace(0, height - s, rows) for x in np.linspace(0, width - s, cols)]
+        # Spread the picks over the grid when it has more cells than tiles
+        picks = np.linspace(0, len(grid) - 1, self.tiles).round().astype(int)
+        return [grid[i] for i in picks]
+
+    def __call__(self, img):
+        x = to_uint8_tensor(img)
+        s = self.image_size
+        height, width = x.shape[-2:]
+        scale = 1.0
+        if self.max_side and min(height, width) > self.max_side:
+            scale = self.max_side / min(height, width)
+        if min(height, width) * scale < s:
+            scale = s / min(height, width)
+        if scale != 1.0:
+            height, width = max(s, round(height * scale)), max(s, round(width * scale))
+            x = TF.resize(x, [height, width], antialias=True)
+
+        views = [TF.resize(x, [s, s], antialias=True)]
+        views += [x[:, y:y + s, x0:x0 + s] for y, x0 in self.tile_origins(height, width)]
+        n = min(self.max_views, self.num_views)
+        views = torch.stack(views[:n])
+        if self.flip and n > len(views):
+            views = torch.cat([views, views[:n - len(views)].flip(-1)])
+        return self._resize.normalize(views)
+
+def fast_transforms(image_size=224):
+    """Tensor-native counterpart of ``datasets.default_transforms``"""
+    return TensorTransform(image_size, hflip_prob=0.5), TensorTransform(image_size)
@@ -0,0 +1,194 @@
+"""
+Torch-free serving state: startup phases, readiness, load-shedding errors and
+CPU placement
+
+``app.py`` imports only this module eagerly, so a web worker can bind its port
+and answer liveness probes while torch, the checkpoint and the warmup passes
+load in the background.
+"""
+import glob
+import os
+import re
+import threading
+import time
+from contextlib import contextmanager
+
+class QueueFullError(RuntimeError):
+    """Raised when the inference queue is at capacity and new work is rejected"""
+
+class WorkerReadiness:
+    """
+    Readiness flags of every worker forked from one master, in shared memory
+
+    Created in the master before it forks. Each worker keeps the flag of its
+    slot in step with its own status (see ``StartupState.join_workers``), so
+    whichever worker answers a readiness probe on the shared port can tell
+    whether all of them are warm.
+    """
+    def __init__(self, workers):
+        import multiprocessing
+
+        self._flags = multiprocessing.RawArray('b', max(1, workers))
+
+    def __len__(self):
+        return len(self._flags)
+
+    def set(self, slot, ready):
+        # Workers added beyond the initial count (gunicorn TTIN) have no flag
+        if slot is not None and 0 <= slot < len(self._flags):
+            self._flags[slot] = int(ready)
+
+    def ready_count(self):
+        return sum(self._flags)
+
+    @property
+    def all_ready(self):
+        return self.ready_count() == len(self._flags)
+
+class StartupState:
+    """
+    Timed startup phases and the readiness of this process
+
+    ``status`` moves from 'starting' through 'loading', 'loaded' and
+    'warming' to 'ready', or to 'failed' if loading raised. Only a 'ready'
+    process should receive traffic, and with ``join_workers`` only once all
+    sibling workers are ready too (``all_ready``).
+    """
+    def __init__(self):
+        self.created = time.perf_counter()
+        self.status = 'starting'
+        self.error = None
+        self.phases = {}
+        self.workers = None
+        self.slot = None
+        self._lock = threading.Lock()
+
+    def join_workers(self, workers, slot):
+        """Publish this process's readiness as ``slot`` of the shared ``WorkerReadiness``"""
+        with self._lock:
+            self.workers, self.slot = workers, slot
+            workers.set(slot, self.status == 'ready')
+
+    @contextmanager
+    def phase(self, name):
+        """Record the duration of the ``with`` block as startup phase ``name``"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            with self._lock:
+                self.phases[name] = time.perf_counter() - start
+
+    def record(self, name, seconds):
+        with self._lock:
+            self.phases[name] = seconds
+
+    def set_status(self, status, error=None):
+        with self._lock:
+            self.status = status
+            self.error = error
+            if self.workers is not None:
+                self.workers.set(self.slot, status == 'ready')
+            if status == 'ready':
+                self.phases['total'] = time.perf_counter() - self.created
+
+    @property
+    def ready(self):
+        return self.status == 'ready'
+
+    @property
+    def all_ready(self):
+        """This process and every worker sharing its ``WorkerReadiness`` are ready"""
+        return self.ready and (self.workers is None or self.workers.all_ready)
+
+    def snapshot(self):
+        """JSON-friendly view for /readyz and /health"""
+        with self._lock:
+            info = {
+                'status': self.status,
+                'uptime_s': round(time.perf_counter() - self.created, 3),
+                'phases_s': {name: round(seconds, 4) for name, seconds in self.phases.items()},
+            }
+            if self.error:
+                info['error'] = self.error
+            if self.workers is not None:
+                info['workers'] = {'ready': self.workers.ready_count(), 'total': len(self.workers)}
+            return info
+
+def parse_cpulist(text):
+    """'0-3,8,10-11' (the /sys cpulist format) -> [0, 1, 2, 3, 8, 10, 11]"""
+    cpus = []
+    for part in text.strip().split(','):
+        if not part:
+            continue
+        first, _, last = part.partition('-')
+        cpus.extend(range(int(first), int(last or first) + 1))
+    return cpus
+
+def usable_cpus():
+    """CPUs this process may run on"""
+    try:
+        return sorted(os.sched_getaffinity(0))
+    except AttributeError:
+        return list(range(os.cpu_count() or 1))
+
+def numa_cpu_groups(node_root='/sys/devices/system/node'):
+    """
+    Usable CPUs grouped by NUMA node
+
+    Falls back to a single group when the topology isn't exposed (non-Linux,
+    some containers). CPUs missing from every node's list form their own group.
+    """
+    allowed = usable_cpus()
+    remaining = set(allowed)
+    groups = []
+    paths = glob.glob(os.path.join(node_root, 'node[0-9]*', 'cpulist'))
+    for path in sorted(paths, key=lambda p: int(re.search(r'node(\d+)', p).group(1))):
+        with open(path) as f:
+            cpus = [cpu for cpu in parse_cpulist(f.read()) if cpu in remaining]
+        if cpus:
+            groups.append(cpus)
+            remaining.difference_update(cpus)
+    if remaining:
+        groups.append(sorted(remaining))
+    return groups
+
+def plan_core_sets(replicas, threads_per_replica=None, groups=None):
+    """
+    Split the usable CPUs into disjoint per-replica core sets
+
+    Each set is cut from the NUMA node with the most free CPUs, so replicas
+    spread over nodes and keep their memory traffic local. A set only spans
+    nodes once no single node has enough free CPUs left.
+
+    Args:
+        replicas (int): Number of core sets
+        threads_per_replica (int): CPUs per set (default: an even split)
+        groups (list): CPU groups to split (default: ``numa_cpu_groups()``)
+
+    Returns:
+        list: ``replicas`` lists of CPU ids
+
+    Raises:
+        ValueError: If there are fewer usable CPUs than requested
+    """
+    groups = [list(g) for g in (numa_cpu_groups() if groups is None else groups)]
+    total = sum(len(g) for g in groups)
+    per = threads_per_replica or total // max(replicas, 1)
+    if replicas < 1 or per < 1 or per * replicas > total:
+        raise ValueError(f"Cannot give {replicas} replicas {per} CPUs each from {total} usable CPUs")
+    core_sets = []
+    for _ in range(replicas):
+        group = max(groups, key=len)
+        if len(group) >= per:
+            core_sets.append(group[:per])
+            del group[:per]
+            continue
+        # No node has room for a whole set: gather the leftovers across nodes
+        cores = []
+        for group in sorted(groups, key=len, reverse=True):
+            take = group[:per - len(cores)]
+            cores.extend(take)
+            del group[:len(take)]
+        core_sets.append(sorted(cores))
+    return core_sets
@@ -1,67 +1,193 @@
 import os
 import argparse
+import time
+from contextlib import nullcontext
 import torch
+import torch.distributed as dist
 import torch.nn as nn
 import torch.optim as optim
-from torch.utils.data import DataLoader
+from torch.nn.parallel import DistributedDataParallel
+from torch.utils.data import DataLoader, Subset
+from torch.utils.data.distributed import DistributedSampler
 from tqdm import tqdm
 
-from .datasets import ArtDataset, default_transforms
-from .model import get_model
+from .checkpoint import CheckpointWriter, load_training_state, restore_rng_state, snapshot, training_state
+from .datasets import get_transforms, make_dataset
+from .distill import SoftTargetDataset, cache_teacher_logits, distillation_loss, teacher_logits_path
+from .model import ARCHITECTURES, checkpoint_payload, get_model
+
+def setup_distributed(args):
+    """
+    Join the process group started by torchrun
+
+    Returns:
+        tuple: ``(rank, world_size, device)``; ``(0, 1, default device)`` when not distributed
+    """
+    if not args.distributed:
+        return 0, 1, torch.device('cuda' if torch.cuda.is_available() else 'cpu')
+    dist.init_process_group(backend=args.dist_backend)
+    local_rank = int(os.environ.get('LOCAL_RANK', 0))
+    if args.dist_backend == 'nccl':
+        torch.cuda.set_device(local_rank)
+        device = torch.device('cuda', local_rank)
+    else:
+        device = torch.device('cpu')
+    return dist.get_rank(), dist.get_world_size(), device
+
+def all_reduce_sum(*tensors):
+    """Sum metric tensors across processes in place (no-op when not distributed)"""
+    if dist.is_initialized():
+        for t in tensors:
+            dist.all_reduce(t, op=dist.ReduceOp.SUM)
 
 def train(args):
-    device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
+    if args.num_threads:
+        torch.set_num_threads(args.num_threads)
+    if args.seed is not None:
+        torch.manual_seed(args.seed)
+    rank, world_size, device = setup_distributed(args)
+    is_main = rank == 0
     class_names = ['AI', 'Human'] if args.num_classes == 2 else None
-    train_tfms, val_tfms = default_transforms(args.image_size)
+    # Packed arrays hold uint8 pixels, which only the tensor-native transforms accept
+    preprocess = 'fast' if args.packed_dir else args.preprocess
+    train_tfms, val_tfms = get_transforms(args.image_size, preprocess)
 
-    train_ds = ArtDataset(args.data_dir, split='train', transform=train_tfms, class_names=class_names)
-    val_ds = ArtDataset(args.data_dir, split='val', transform=val_tfms, class_names=class_names)
+    split_args = dict(csv_path=args.split_csv, val_split=args.val_split, seed=args.split_seed)
+    train_ds = make_dataset(args.data_dir, 'train', train_tfms, class_names, args.packed_dir, **split_args)
+    val_ds = make_dataset(args.data_dir, 'val', val_tfms, class_names, args.packed_dir, **split_args)
+    if args.distill:
+        # Teacher logits come from the un-augmented images, in the same sample order as train_ds
+        teacher_ds = make_dataset(args.data_dir, 'train', val_tfms, class_names, args.packed_dir, **split_args)
+        if is_main:
+            cache_teacher_logits(args.teacher_checkpoint, teacher_ds, args.soft_target_dir, batch_size=args.batch_size,
+                                 num_workers=args.num_workers, device=device, image_size=args.image_size,
+                                 preprocess=preprocess)
+        if world_size > 1:
+            dist.barrier()
+        train_ds = SoftTargetDataset(train_ds, teacher_logits_path(args.soft_target_dir))
 
-    train_loader = DataLoader(train_ds, batch_size=args.batch_size, shuffle=True, num_workers=4, pin_memory=True)
-    val_loader = DataLoader(val_ds, batch_size=args.batch_size, shuffle=False, num_workers=4, pin_memory=True)
+    train_sampler = None
+    if world_size > 1:
+        train_sampler = DistributedSampler(train_ds, num_replicas=world_size, rank=rank, shuffle=True)
+        # Strided shards without DistributedSampler's padding, so every val image is counted exactly once
+        val_ds = Subset(val_ds, range(rank, len(val_ds), world_size))
+    train_loader = DataLoader(train_ds, batch_size=args.batch_size, shuffle=train_sampler is None, sampler=train_sampler,
+                              num_workers=args.num_workers, pin_memory=True)
+    val_loader = DataLoader(val_ds, batch_size=args.batch_size, shuffle=False, num_workers=args.num_workers, pin_memory=True)
 
-    model = get_model(num_classes=args.num_classes, pretrained=not args.no_pretrain).to(device)
+    model = get_model(num_classes=args.num_classes, pretrained=not args.no_pretrain, arch=args.arch).to(device)
+    memory_format = torch.channels_last if args.channels_last else torch.contiguous_format
+    model = model.to(memory_format=memory_format)
     criterion = nn.CrossEntropyLoss()
     optimizer = optim.AdamW(model.parameters(), lr=args.lr, weight_decay=1e-4)
-
+    # Checkpoints always come from the uncompiled module so their keys stay loadable by ArtDetector
+    raw_model = model
+    state_path = args.state_path or os.path.splitext(args.checkpoint)[0] + '_state.pt'
+    start_epoch = 0
     best_acc = 0.0
-    os.makedirs(os.path.dirname(args.checkpoint), exist_ok=True)
+    resume_state = None
+    if args.resume:
+        if os.path.exists(state_path):
+            resume_state = load_training_state(state_path, map_location=device)
+            raw_model.load_state_dict(resume_state['model'])
+            optimizer.load_state_dict(resume_state['optimizer'])
+            start_epoch = resume_state['epoch']
+            best_acc = resume_state['best_acc']
+            if is_main:
+                print(f"Resuming from {state_path} after epoch {start_epoch} (best val acc {best_acc:.4f})")
+        elif is_main:
+            print(f"No training state at {state_path}; starting from scratch")
+    if world_size > 1:
+        model = DistributedDataParallel(model, device_ids=[device.index] if device.type == 'cuda' else None)
+    if args.compile:
+        model = torch.compile(model)
 
-    for epoch in range(args.epochs):
+    def autocast():
+        return torch.autocast(device_type=device.type, dtype=torch.bfloat16, enabled=args.amp == 'bf16')
+
+    def to_device(x, y):
+        return (x.to(device, memory_format=memory_format, non_blocking=True),
+                y.to(device, non_blocking=True))
+
+    if is_main:
+        os.makedirs(os.path.dirname(args.checkpoint), exist_ok=True)
+    writer = CheckpointWriter()
+    if resume_state is not None:
+        # Restored last so the data order and augmentations continue as if the run never stopped
+        restore_rng_state(resume_state['rng'])
+        resume_state = None
+
+    for epoch in range(start_epoch, args.epochs):
         model.train()
-        running_loss, running_corrects = 0.0, 0
-        for x, y in tqdm(train_loader, desc=f"Train {epoch+1}/{args.epochs}"):
-            x, y = x.to(device), y.to(device)
-            optimizer.zero_grad()
-            logits = model(x)
-            loss = criterion(logits, y)
-            loss.backward()
-            optimizer.step()
-            running_loss += loss.item() * x.size(0)
-            running_corrects += (logits.argmax(1) == y).sum().item()
-        train_loss = running_loss / len(train_ds)
-        train_acc = running_corrects / len(train_ds)
+        if train_sampler is not None:
+            train_sampler.set_epoch(epoch)
+        # Accumulate on the device and sync once per epoch instead of calling .item() every step
+        running_loss = torch.zeros((), device=device)
+        running_corrects = torch.zeros((), dtype=torch.long, device=device)
+        train_seen = torch.zeros((), dtype=torch.long, device=device)
+        optimizer.zero_grad(set_to_none=True)
+        start = time.perf_counter()
+        for step, batch in enumerate(tqdm(train_loader, desc=f"Train {epoch+1}/{args.epochs}", disable=not is_main)):
+            x, y = to_device(batch[0], batch[1])
+            stepping = (step + 1) % args.accum_steps == 0 or step + 1 == len(train_loader)
+            # Only all-reduce gradients on the micro-batch that ends an accumulation group
+            sync = model.no_sync() if world_size > 1 and not stepping else nullcontext()
+            with sync:
+                with autocast():
+                    logits = model(x)
+                    if args.distill:
+                        loss = distillation_loss(logits.float(), batch[2].to(device, non_blocking=True), y,
+                                                 args.temperature, args.alpha)
+                    else:
+                        loss = criterion(logits, y)
+                (loss / args.accum_steps).backward()
+            if stepping:
+                optimizer.step()
+                optimizer.zero_grad(set_to_none=True)
+            running_loss += loss.detach() * x.size(0)
+            running_corrects += (logits.argmax(1) == y).sum()
+            train_seen += x.size(0)
+        all_reduce_sum(running_loss, running_corrects, train_seen)
+        train_loss = running_loss.item() / train_seen.item()
+        train_acc = running_corrects.item() / train_seen.item()
+        train_throughput = train_seen.item() / (time.perf_counter() - start)
 
         # eval
         model.eval()
-        val_corrects, val_loss_sum = 0, 0.0
+        val_corrects = torch.zeros((), dtype=torch.long, device=device)
+        val_loss_sum = torch.zeros((), device=device)
+        val_seen = torch.zeros((), dtype=torch.long, device=device)
         with torch.no_grad():
-            for x, y in tqdm(val_loader, desc="Val"):
-                x, y = x.to(device), y.to(device)
-                logits = model(x)
-                loss = criterion(logits, y)
-                val_loss_sum += loss.item() * x.size(0)
-                val_corrects += (logits.argmax(1) == y).sum().item()
-        val_loss = val_loss_sum / len(val_ds)
-        val_acc = val_corrects / len(val_ds)
-        print(f"Epoch {epoch+1}: train_loss={train_loss:.4f} acc={train_acc:.4f} | val_loss={val_loss:.4f} acc={val_acc:.4f}")
+            for x, y in tqdm(val_loader, desc="Val", disable=not is_main):
+                x, y = to_device(x, y)
+                with autocast():
+                    # The wrapped module skips DDP's forward bookkeeping during eval
+                    logits = raw_model(x) if world_size > 1 else model(x)
+                    loss = criterion(logits, y)
+                val_loss_sum += loss * x.size(0)
+                val_corrects += (logits.argmax(1) == y).sum()
+                val_seen += x.size(0)
+        all_reduce_sum(val_loss_sum, val_corrects, val_seen)
+        val_loss = val_loss_sum.item() / val_seen.item()
+        val_acc = val_corrects.item() / val_seen.item()
+        if is_main:
+            print(f"Epoch {epoch+1}: train_loss={train_loss:.4f} acc={train_acc:.4f} | val_loss={val_loss:.4f} acc={val_acc:.4f} | {train_throughput:.1f} samples/s")
 
+        # val_acc is all-reduced, so every rank agrees on whether this epoch is the best
         if val_acc > best_acc:
             best_acc = val_acc
-            torch.save(model.state_dict(), args.checkpoint)
-            print("Saved best model ->", args.checkpoint)
+            if is_main:
+                writer.save(checkpoint_payload(snapshot(raw_model.state_dict()), args.arch), args.checkpoint)
+                print("Saved best model ->", args.checkpoint)
+
+        if is_main and args.save_every and ((epoch + 1) % args.save_every == 0 or epoch + 1 == args.epochs):
+            writer.save(training_state(raw_model, optimizer, epoch + 1, best_acc, args), state_path)
 
-    print("Best val acc:", best_acc)
+    writer.wait()
+    if is_main:
+        print("Best val acc:", best_acc)
+    if dist.is_initialized():
+        dist.destroy_process_group()
 
 if __name__ == "__main__":
     p = argparse.ArgumentParser()
@@ -73,5 +199,54 @@ if __name__ == "__main__":
     p.add_argument('--image_size', type=int, default=224)
     p.add_argument('--num_classes', type=int, default=2)
     p.add_argument('--no_pretrain', action='store_true')
+    p.add_argument('--arch', choices=ARCHITECTURES, default='resnet50',
+                   help='Backbone; a small one (e.g. resnet18) can serve as the first stage of a cascade')
+    p.add_argument('--preprocess', choices=['pil', 'fast'], default='pil',
+                   help="'fast' decodes JPEGs at reduced size and resizes/normalizes on tensors")
+    p.add_argument('--packed_dir', type=str, default=None,
+                   help='Read pre-decoded arrays written by python -m src.pack_dataset instead of image files')
+    p.add_argument('--num_workers', type=int, default=4)
+    p.add_argument('--split_csv', type=str, default=None,
+                   help='CSV of file_name/path,label (e.g. Kaggle train.csv) read in place instead of data_dir folders')
+    p.add_argument('--val_split', type=float, default=0.2, help='Validation fraction when splitting --split_csv')
+    p.add_argument('--split_seed', type=int, default=42, help='Seed for the stratified --split_csv split')
+    p.add_argument('--amp', choices=['none', 'bf16'], default='none',
+                   help='bf16 autocast for forward and loss (CPU and recent GPUs)')
+    p.add_argument('--channels_last', action='store_true',
+                   help='Use channels_last memory format for the model and inputs')
+    p.add_argument('--compile', action='store_true', help='Wrap the model in torch.compile')
+    p.add_argument('--accum_steps', type=int, default=1,
+                   help='Accumulate gradients over this many batches per optimizer step')
+    p.add_argument('--distributed', action='store_true',
+                   help='DistributedDataParallel training; launch with torchrun --nproc_per_node N')
+    p.add_argument('--dist_backend', choices=['gloo', 'nccl'], default='gloo')
+    p.add_argument('--num_threads', type=int, default=0,
+                   help='torch threads per process (torchrun defaults OMP_NUM_THREADS to 1)')
+    p.add_argument('--resume', action='store_true',
+                   help='Continue from the training state at --state_path if it exists')
+    p.add_argument('--state_path', type=str, default=None,
+                   help='Full training state (model, optimizer, epoch, RNG); default: <checkpoint>_state.pt')
+    p.add_argument('--seed', type=int, default=None, help='Seed torch for a reproducible run')
+    p.add_argument('--save_every', type=int, default=1,
+                   help='Write the training state every N epochs (0 disables)')
+    p.add_argument('--head_only', action='store_true',
+                   help='Retrain only the classifier head from cached backbone features')
+    p.add_argument('--feature_dir', type=str, default='features',
+                   help='Feature store used by --head_only')
+    p.add_argument('--base_checkpoint', type=str, default=None,
+                   help='Backbone weights for --head_only (default: --checkpoint if it exists, else ImageNet)')
+    p.add_argument('--head_lr', type=float, default=1e-3)
+    p.add_argument('--distill', action='store_true',
+                   help='Train the --arch student on soft targets from --teacher_checkpoint')
+    p.add_argument('--teacher_checkpoint', type=str, default='models/detector.pth')
+    p.add_argument('--soft_target_dir', type=str, default='soft_targets',
+                   help='Where the teacher logits are cached for --distill')
+    p.add_argument('--temperature', type=float, default=4.0, help='Distillation softmax temperature')
+    p.add_argument('--alpha', type=float, default=0.7,
+                   help='Weight of the soft-target loss; the rest goes to the hard labels')
     args = p.parse_args()
-    train(args)
+    if args.head_only:
+        from .features import train_head
+        train_head(args)
+    else:
+        train(args)
@@ -0,0 +1,28 @@
+import time
+
+import torch
+
+class FakeDetector:
+    """Serving interface of ArtDetector; each image's bytes decode to a one-row tensor holding its number"""
+    def __init__(self, forward_seconds=0.0, gate=None):
+        self.forward_seconds = forward_seconds
+        self.gate = gate
+        self.batch_sizes = []
+
+    def cache_lookup(self, image_bytes):
+        return None, None
+
+    def cache_store(self, key, result):
+        pass
+
+    def preprocess_image(self, image_bytes):
+        if image_bytes == b'broken':
+            raise ValueError('Could not decode image')
+        return torch.full((1, 1), float(int(image_bytes)))
+
+    def predict_tensors(self, image_tensors, views=None):
+        if self.gate is not None:
+            self.gate.wait(5)
+        time.sleep(self.forward_seconds)
+        self.batch_sizes.append(len(views))
+        return [{'value': int(row.item())} for row in image_tensors]
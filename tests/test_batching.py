@@ -0,0 +1,135 @@
+import os
+import runpy
+import threading
+
+import pytest
+
+from conftest import FakeDetector
+from src.inference import MicroBatcher
+from src.serving import QueueFullError
+
+def predict_concurrently(batcher, payloads):
+    results = [None] * len(payloads)
+    barrier = threading.Barrier(len(payloads))
+
+    def call(i):
+        barrier.wait()
+        results[i] = batcher.predict(payloads[i], timeout=10)
+
+    threads = [threading.Thread(target=call, args=(i,)) for i in range(len(payloads))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results
+
+def test_concurrent_callers_share_forward_passes():
+    detector = FakeDetector(forward_seconds=0.05)
+    batcher = MicroBatcher(detector, max_batch_size=8, max_wait_ms=50)
+    try:
+        results = predict_concurrently(batcher, [str(i).encode() for i in range(16)])
+    finally:
+        batcher.close()
+    # Every caller gets its own row back
+    assert [r['value'] for r in results] == list(range(16))
+    assert sum(detector.batch_sizes) == 16
+    assert max(detector.batch_sizes) > 1
+    assert max(detector.batch_sizes) <= 8
+    stats = batcher.stats()
+    assert stats['requests'] == 16
+    assert stats['batches'] == len(detector.batch_sizes) < 16
+    assert stats['pending'] == 0
+
+def test_rejects_once_queue_is_full():
+    gate = threading.Event()
+    batcher = MicroBatcher(FakeDetector(gate=gate), max_batch_size=1, max_wait_ms=0, max_queue_size=2)
+    try:
+        admitted = [batcher.submit(b'1'), batcher.submit(b'2')]
+        with pytest.raises(QueueFullError):
+            batcher.submit(b'3')
+        with pytest.raises(QueueFullError):
+            batcher.check_capacity()
+        assert batcher.stats()['rejected'] == 2
+        gate.set()
+        assert [f.result(5)['value'] for f in admitted] == [1, 2]
+        # Capacity frees up once the admitted requests are answered
+        assert batcher.predict(b'4', timeout=5) == {'value': 4}
+    finally:
+        gate.set()
+        batcher.close()
+    assert batcher.stats()['pending'] == 0
+
+def test_rejection_under_concurrent_callers():
+    gate = threading.Event()
+    batcher = MicroBatcher(FakeDetector(gate=gate), max_batch_size=4, max_wait_ms=10, max_queue_size=4)
+    outcomes = []
+    lock = threading.Lock()
+    barrier = threading.Barrier(12)
+
+    def call(i):
+        barrier.wait()
+        try:
+            future = batcher.submit(str(i).encode())
+        except QueueFullError:
+            outcome = 'rejected'
+        else:
+            outcome = future
+        with lock:
+            outcomes.append(outcome)
+
+    threads = [threading.Thread(target=call, args=(i,)) for i in range(12)]
+    try:
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        admitted = [o for o in outcomes if o != 'rejected']
+        assert len(admitted) == 4
+        assert batcher.stats()['rejected'] == 8
+        gate.set()
+        assert all('value' in f.result(5) for f in admitted)
+    finally:
+        gate.set()
+        batcher.close()
+
+def test_decode_errors_stay_with_their_caller():
+    batcher = MicroBatcher(FakeDetector(), max_batch_size=4, max_wait_ms=5, max_queue_size=4)
+    try:
+        with pytest.raises(ValueError):
+            batcher.submit(b'broken')
+        assert batcher.stats()['pending'] == 0
+        assert batcher.predict(b'7', timeout=5) == {'value': 7}
+    finally:
+        batcher.close()
+
+def test_cache_writes_run_on_the_calling_thread():
+    stores = []
+
+    class CachingDetector(FakeDetector):
+        def cache_lookup(self, image_bytes):
+            return image_bytes, None
+
+        def cache_store(self, key, result):
+            stores.append((key, threading.current_thread().name))
+
+    batcher = MicroBatcher(CachingDetector(), max_batch_size=4, max_wait_ms=5)
+    try:
+        assert batcher.predict(b'3', timeout=5) == {'value': 3}
+        assert stores == [(b'3', threading.current_thread().name)]
+    finally:
+        batcher.close()
+
+def test_gunicorn_workers_can_batch(monkeypatch):
+    monkeypatch.setenv('BATCH_MAX_SIZE', '8')
+    monkeypatch.delenv('GUNICORN_THREADS', raising=False)
+    config = runpy.run_path(os.path.join(os.path.dirname(__file__), os.pardir, 'gunicorn.conf.py'))
+    assert config['worker_class'] == 'gthread'
+    assert config['threads'] >= 8
+
+def test_gunicorn_threads_exceed_queue_depth(monkeypatch):
+    monkeypatch.setenv('MAX_QUEUE_DEPTH', '16')
+    monkeypatch.setenv('BATCH_MAX_SIZE', '4')
+    monkeypatch.delenv('GUNICORN_THREADS', raising=False)
+    config = runpy.run_path(os.path.join(os.path.dirname(__file__), os.pardir, 'gunicorn.conf.py'))
+    # Spare threads answer 503 once MAX_QUEUE_DEPTH requests are admitted
+    assert config['threads'] > 16
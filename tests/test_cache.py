@@ -0,0 +1,16 @@
+from src.cache import PredictionCache
+
+def test_disk_tier_is_shared_between_instances(tmp_path):
+    db_path = str(tmp_path / 'cache.db')
+    PredictionCache(max_entries=4, db_path=db_path).put('key', {'label': 'AI'})
+    other = PredictionCache(max_entries=4, db_path=db_path)
+    assert other.get('key') == {'label': 'AI'}
+    assert other.stats()['disk_hits'] == 1
+
+def test_failing_disk_tier_counts_as_a_miss(tmp_path):
+    # The parent directory does not exist, so sqlite cannot open the file
+    cache = PredictionCache(max_entries=0, db_path=str(tmp_path / 'missing' / 'cache.db'))
+    cache.put('key', {'label': 'AI'})
+    assert cache.get('key') is None
+    stats = cache.stats()
+    assert (stats['misses'], stats['disk_errors']) == (1, 2)
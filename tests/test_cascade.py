@@ -0,0 +1,29 @@
+import numpy as np
+
+from src.cascade import choose_threshold, sweep
+
+def probs(confidences, predictions):
+    p = np.empty((len(confidences), 2), dtype=np.float32)
+    p[np.arange(len(p)), predictions] = confidences
+    p[np.arange(len(p)), 1 - np.asarray(predictions)] = 1 - np.asarray(confidences)
+    return p
+
+# The first stage is right when confident (>= 0.9) and wrong when not; the full model is always right
+LABELS = np.array([0, 1, 0, 1])
+FAST = probs([0.95, 0.99, 0.6, 0.7], [0, 1, 1, 0])
+FULL = probs([0.9, 0.9, 0.9, 0.9], [0, 1, 0, 1])
+
+def test_sweep_costs_and_accuracy():
+    rows = {row['threshold']: row for row in sweep(FAST, FULL, LABELS, 0.01, 0.04, [0.5, 0.9, 1.0])}
+    assert rows[0.5]['fast_share'] == 1.0 and rows[0.5]['accuracy'] == 0.5
+    assert rows[0.9]['fast_share'] == 0.5 and rows[0.9]['accuracy'] == 1.0
+    assert rows[1.0]['fast_share'] == 0.0
+    # Cost per image: first stage always, full model for the rest
+    assert np.isclose(rows[0.9]['ms_per_image'], (0.01 + 0.5 * 0.04) * 1000)
+    assert np.isclose(rows[0.9]['speedup'], 0.04 / 0.03)
+
+def test_choose_the_fastest_threshold_within_the_accuracy_budget():
+    rows = sweep(FAST, FULL, LABELS, 0.01, 0.04, [0.5, 0.8, 0.9, 0.96, 1.0])
+    assert choose_threshold(rows, 1.0, 0.0)['threshold'] == 0.9
+    assert choose_threshold(rows, 1.0, 0.5)['threshold'] == 0.5
+    assert choose_threshold(rows, 1.0, -0.1) is None
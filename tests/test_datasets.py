@@ -0,0 +1,66 @@
+import os
+
+import pytest
+
+from src import datasets
+from src.datasets import ArtDataset
+
+def make_kaggle_download(directory, present=20, missing=('train_data/missing.jpg',)):
+    (directory / 'train_data').mkdir(parents=True)
+    rows = ['file_name,label']
+    for i in range(present):
+        (directory / 'train_data' / f'{i}.jpg').write_bytes(b'x')
+        rows.append(f'train_data/{i}.jpg,{i % 2}')
+    rows += [f'{path},1' for path in missing]
+    csv_path = directory / 'train.csv'
+    csv_path.write_text('\n'.join(rows) + '\n')
+    # Manifests are only cached for inputs that have stopped changing
+    os.utime(csv_path, (1_000_000_000, 1_000_000_000))
+    return str(csv_path)
+
+def split_paths(data_dir, csv_path, split):
+    ds = ArtDataset(str(data_dir), split=split, class_names=['AI', 'Human'], csv_path=csv_path)
+    return [os.path.relpath(path, os.path.dirname(csv_path)) for path, _ in ds.samples]
+
+def test_csv_rows_without_a_file_are_skipped(tmp_path):
+    csv_path = make_kaggle_download(tmp_path / 'download')
+    train = split_paths(tmp_path / 'data', csv_path, 'train')
+    val = split_paths(tmp_path / 'data', csv_path, 'val')
+    assert 'train_data/missing.jpg' not in train + val
+    assert sorted(train + val) == sorted(f'train_data/{i}.jpg' for i in range(20))
+    assert not set(train) & set(val)
+
+def test_csv_manifest_is_cached_under_the_data_dir(tmp_path, monkeypatch):
+    download = tmp_path / 'download'
+    csv_path = make_kaggle_download(download)
+    first = split_paths(tmp_path / 'data', csv_path, 'train')
+    assert not any(name.endswith('.npz') for name in os.listdir(download))
+    manifests = os.listdir(tmp_path / 'data')
+    assert len(manifests) == 1 and manifests[0].startswith('train-') and manifests[0].endswith('_train_manifest.npz')
+
+    def fail(*args):
+        raise AssertionError('the cached manifest should have been used')
+
+    monkeypatch.setattr(datasets, 'read_csv_samples', fail)
+    assert split_paths(tmp_path / 'data', csv_path, 'train') == first
+
+def test_folder_manifest_is_rebuilt_when_a_class_folder_changes(tmp_path):
+    for cls in ('AI', 'Human'):
+        folder = tmp_path / 'train' / cls
+        folder.mkdir(parents=True)
+        (folder / '0.jpg').write_bytes(b'x')
+        os.utime(folder, (1_000_000_000, 1_000_000_000))
+    assert len(ArtDataset(str(tmp_path), 'train')) == 2
+    assert (tmp_path / 'train_manifest.npz').exists()
+
+    (tmp_path / 'train' / 'AI' / '1.jpg').write_bytes(b'x')
+    ds = ArtDataset(str(tmp_path), 'train')
+    assert sorted(os.path.relpath(path, tmp_path) for path, _ in ds.samples) == \
+        ['train/AI/0.jpg', 'train/AI/1.jpg', 'train/Human/0.jpg']
+
+@pytest.mark.parametrize('split', ['train', 'val'])
+def test_missing_files_do_not_shift_the_split(tmp_path, split):
+    # The split of the files that exist doesn't depend on how many listed files are missing
+    with_missing = make_kaggle_download(tmp_path / 'a', missing=('train_data/gone1.jpg', 'train_data/gone2.jpg'))
+    without = make_kaggle_download(tmp_path / 'b', missing=())
+    assert split_paths(tmp_path / 'data_a', with_missing, split) == split_paths(tmp_path / 'data_b', without, split)
@@ -0,0 +1,43 @@
+import os
+
+import numpy as np
+import torch
+import torch.nn.functional as F
+from PIL import Image
+
+from src.datasets import ArtDataset, default_transforms
+from src.distill import SoftTargetDataset, cache_teacher_logits, distillation_loss
+from src.model import checkpoint_payload, get_model
+
+def test_distillation_loss_blends_soft_and_hard_targets():
+    torch.manual_seed(0)
+    student, teacher = torch.randn(8, 2), torch.randn(8, 2)
+    labels = torch.randint(0, 2, (8,))
+    assert torch.isclose(distillation_loss(student, teacher, labels, alpha=0.0), F.cross_entropy(student, labels))
+    assert distillation_loss(teacher, teacher, labels, alpha=1.0).abs() < 1e-6
+    assert distillation_loss(student, teacher, labels, alpha=1.0) > 0
+
+def test_teacher_logits_are_cached_once(tmp_path, capsys):
+    for i, cls in enumerate(['AI', 'Human']):
+        folder = tmp_path / 'data' / 'train' / cls
+        folder.mkdir(parents=True)
+        for j in range(3):
+            Image.new('RGB', (40, 40), (i * 200, j * 60, 0)).save(folder / f'{j}.png')
+    teacher = str(tmp_path / 'teacher.pth')
+    arch = 'mobilenet_v3_small'
+    torch.save(checkpoint_payload(get_model(num_classes=2, pretrained=False, arch=arch).state_dict(), arch), teacher)
+    _, val_tfms = default_transforms(32)
+    dataset = ArtDataset(str(tmp_path / 'data'), 'train', val_tfms, class_names=['AI', 'Human'])
+    cache_dir = str(tmp_path / 'soft')
+
+    path = cache_teacher_logits(teacher, dataset, cache_dir, num_workers=0, image_size=32)
+    logits = np.load(path)
+    assert logits.shape == (6, 2)
+    modified = os.stat(path).st_mtime_ns
+    assert cache_teacher_logits(teacher, dataset, cache_dir, num_workers=0, image_size=32) == path
+    assert 'Using cached teacher logits' in capsys.readouterr().out
+    assert os.stat(path).st_mtime_ns == modified
+
+    x, y, soft = SoftTargetDataset(dataset, path)[4]
+    assert y == dataset[4][1]
+    assert torch.equal(soft, torch.from_numpy(logits[4]))
@@ -0,0 +1,54 @@
+import csv
+import subprocess
+import sys
+
+import download_dataset
+
+def write_image(path, data):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_bytes(data)
+
+def test_importing_the_script_does_not_import_torch():
+    code = "import sys, download_dataset; print('torch' in sys.modules)"
+    out = subprocess.run([sys.executable, '-c', code], capture_output=True, text=True, check=True)
+    assert out.stdout.strip() == 'False'
+
+def test_nested_files_with_the_same_name_are_all_kept(tmp_path):
+    source = tmp_path / 'download'
+    for i, folder in enumerate(['', 'a', 'b', 'a/deep']):
+        write_image(source / 'train' / 'AI' / folder / '1.jpg', f'ai-{i}'.encode())
+    write_image(source / 'train' / 'Human' / 'x' / '1.jpg', b'human')
+    write_image(source / 'train' / 'Human' / 'notes.txt', b'not an image')
+    target = tmp_path / 'data'
+
+    download_dataset.organize_dataset(source, target, val_split=0.0, workers=2, mode='copy')
+
+    with open(target / 'train_index.csv', newline='') as f:
+        rows = list(csv.DictReader(f))
+    paths = [row['path'] for row in rows]
+    assert len(paths) == len(set(paths)) == 5
+    ai_files = sorted((target / 'train' / 'AI').iterdir())
+    assert sorted(p.read_bytes() for p in ai_files) == [b'ai-0', b'ai-1', b'ai-2', b'ai-3']
+    # A name only one file uses is left alone
+    assert (target / 'train' / 'Human' / '1.jpg').read_bytes() == b'human'
+
+    # Resuming is a no-op and keeps the same names
+    download_dataset.organize_dataset(source, target, val_split=0.0, workers=2, mode='copy')
+    assert sorted((target / 'train' / 'AI').iterdir()) == ai_files
+
+def test_missing_files_do_not_change_the_split(tmp_path):
+    def organize(missing, target):
+        source = tmp_path / f'download-{len(missing)}'
+        rows = ['file_name,label']
+        for i in range(20):
+            rows.append(f'train_data/{i}.jpg,{i % 2}')
+            if i not in missing:
+                write_image(source / 'train_data' / f'{i}.jpg', str(i).encode())
+        (source / 'train.csv').write_text('\n'.join(rows) + '\n')
+        download_dataset.organize_dataset(source, target, val_split=0.3, workers=2, mode='copy')
+        return {p.read_bytes(): p.parent.parent.name for p in target.glob('*/*/*.jpg')}
+
+    complete = organize(set(), tmp_path / 'complete')
+    partial = organize({0, 5, 8}, tmp_path / 'partial')
+    assert len(partial) == 17
+    assert all(complete[content] == split for content, split in partial.items())
@@ -0,0 +1,146 @@
+import argparse
+import os
+
+import numpy as np
+import pytest
+import torch
+from PIL import Image
+
+from src.features import FeatureStore, backbone_digest, load_backbone, train_head
+from src.model import checkpoint_payload, get_model, load_model
+
+def make_files(directory, count):
+    paths = []
+    for i in range(count):
+        path = os.path.join(directory, f'{i}.jpg')
+        with open(path, 'wb') as f:
+            f.write(b'x')
+        paths.append(path)
+    return paths
+
+def count_grows(store, monkeypatch):
+    grows = []
+    original = store._grow
+
+    def grow(num_rows):
+        before = store.capacity
+        original(num_rows)
+        if store.capacity != before:
+            grows.append(store.capacity)
+
+    monkeypatch.setattr(store, '_grow', grow)
+    return grows
+
+def test_batch_appends_grow_geometrically(tmp_path, monkeypatch):
+    paths = make_files(tmp_path, 100)
+    store = FeatureStore(str(tmp_path / 'store'), 'backbone', dim=4)
+    grows = count_grows(store, monkeypatch)
+    for start in range(0, 100, 4):
+        batch = paths[start:start + 4]
+        store.write(batch, [os.stat(p).st_mtime_ns for p in batch],
+                    np.full((len(batch), 4), start, dtype=np.float32))
+    # 25 batches, but the capacity only doubles: 4, 8, ..., 128
+    assert len(grows) <= 6
+    assert store.num_rows == 100
+    assert store.capacity >= 100
+    assert store.features[store.rows(paths[96:])].tolist() == [[96.0] * 4] * 4
+
+def test_reserve_sizes_the_store_once(tmp_path, monkeypatch):
+    paths = make_files(tmp_path, 50)
+    store = FeatureStore(str(tmp_path / 'store'), 'backbone', dim=4)
+    grows = count_grows(store, monkeypatch)
+    store.reserve(paths)
+    for start in range(0, 50, 8):
+        batch = paths[start:start + 8]
+        store.write(batch, [os.stat(p).st_mtime_ns for p in batch], np.ones((len(batch), 4), np.float32))
+    assert grows == [50]
+    assert store.stale(paths) == []
+
+def test_reopened_store_keeps_rows_and_detects_changes(tmp_path):
+    paths = make_files(tmp_path, 10)
+    store_dir = str(tmp_path / 'store')
+    store = FeatureStore(store_dir, 'backbone', dim=4)
+    store.reserve(paths)
+    # Reserved but never extracted rows stay stale
+    assert store.stale(paths) == list(range(10))
+    features = np.arange(40, dtype=np.float32).reshape(10, 4)
+    store.write(paths, [os.stat(p).st_mtime_ns for p in paths], features)
+    store.save()
+
+    reopened = FeatureStore(store_dir, 'backbone', dim=4)
+    assert reopened.num_rows == 10
+    assert np.array_equal(reopened.features[reopened.rows(paths)], features)
+    stat = os.stat(paths[3])
+    os.utime(paths[3], ns=(stat.st_atime_ns, stat.st_mtime_ns + 1))
+    assert reopened.stale(paths) == [3]
+    # A new file appends after the existing rows without disturbing them
+    new_path = make_files(tmp_path / 'store', 1)[0]
+    reopened.write([new_path], [os.stat(new_path).st_mtime_ns], np.full((1, 4), -1, np.float32))
+    assert reopened.rows([new_path]).tolist() == [10]
+    assert np.array_equal(reopened.features[reopened.rows(paths)], features)
+
+def test_other_backbone_discards_rows(tmp_path):
+    paths = make_files(tmp_path, 3)
+    store_dir = str(tmp_path / 'store')
+    store = FeatureStore(store_dir, 'backbone', dim=4)
+    store.write(paths, [os.stat(p).st_mtime_ns for p in paths], np.ones((3, 4), np.float32))
+    store.save()
+    assert FeatureStore(store_dir, 'other', dim=4).stale(paths) == [0, 1, 2]
+
+@pytest.mark.parametrize('arch, dim', [('resnet18', 512), ('mobilenet_v3_small', 1024)])
+def test_head_only_retrains_tagged_checkpoints(tmp_path, arch, dim):
+    for split in ('train', 'val'):
+        for i, cls in enumerate(['AI', 'Human']):
+            folder = tmp_path / 'data' / split / cls
+            folder.mkdir(parents=True)
+            for j in range(2):
+                Image.new('RGB', (40, 40), (i * 200, j * 50, 0)).save(folder / f'{j}.png')
+    base = str(tmp_path / 'base.pth')
+    base_model = get_model(num_classes=2, pretrained=False, arch=arch)
+    torch.save(checkpoint_payload(base_model.state_dict(), arch), base)
+
+    model, loaded_arch, backbone_id, feature_dim = load_backbone(base, 2)
+    assert (loaded_arch, feature_dim) == (arch, dim)
+    assert backbone_id == backbone_digest(base_model)
+
+    args = argparse.Namespace(
+        data_dir=str(tmp_path / 'data'), checkpoint=str(tmp_path / 'head.pth'), base_checkpoint=base,
+        arch='resnet50', num_classes=2, image_size=32, batch_size=4, num_workers=0, epochs=1, head_lr=1e-3,
+        feature_dir=str(tmp_path / 'features'))
+    train_head(args)
+
+    retrained, saved_arch = load_model(args.checkpoint)
+    assert saved_arch == arch
+    assert retrained.eval()(torch.zeros(1, 3, 32, 32)).shape == (1, 2)
+    # Only the head changed
+    original = dict(model.named_parameters())
+    changed = {name for name, p in retrained.named_parameters() if not torch.equal(p, original[name])}
+    assert changed and all(name.startswith(('fc.', 'classifier.')) for name in changed)
+
+def test_retraining_over_the_base_checkpoint_reuses_features(tmp_path, capsys):
+    for split in ('train', 'val'):
+        for i, cls in enumerate(['AI', 'Human']):
+            folder = tmp_path / 'data' / split / cls
+            folder.mkdir(parents=True)
+            Image.new('RGB', (40, 40), (i * 200, 0, 0)).save(folder / '0.png')
+    checkpoint = str(tmp_path / 'detector.pth')
+    torch.save(checkpoint_payload(get_model(num_classes=2, pretrained=False, arch='resnet18').state_dict(),
+                                  'resnet18'), checkpoint)
+    args = argparse.Namespace(
+        data_dir=str(tmp_path / 'data'), checkpoint=checkpoint, base_checkpoint=None,
+        arch='resnet50', num_classes=2, image_size=32, batch_size=4, num_workers=0, epochs=1, head_lr=1e-3,
+        feature_dir=str(tmp_path / 'features'))
+    train_head(args)
+    assert 'train: extracted 2 new/changed' in capsys.readouterr().out
+    # The first run overwrote the checkpoint with a new head; the backbone is unchanged
+    train_head(args)
+    out = capsys.readouterr().out
+    assert 'train: extracted 0 new/changed' in out and 'val: extracted 0 new/changed' in out
+
+def test_head_only_rejects_zero_epochs(tmp_path):
+    args = argparse.Namespace(
+        data_dir=str(tmp_path / 'data'), checkpoint=str(tmp_path / 'head.pth'), base_checkpoint=None,
+        arch='resnet18', num_classes=2, image_size=32, batch_size=4, num_workers=0, epochs=0, head_lr=1e-3,
+        feature_dir=str(tmp_path / 'features'))
+    with pytest.raises(ValueError, match='at least one epoch'):
+        train_head(args)
@@ -0,0 +1,57 @@
+import io
+
+import pytest
+import torch
+from PIL import Image
+
+from src.inference import ArtDetector, InferencePool
+from src.model import checkpoint_payload, get_model
+from src.serving import numa_cpu_groups, parse_cpulist, plan_core_sets
+
+def test_parse_cpulist():
+    assert parse_cpulist('0-3,8,10-11\n') == [0, 1, 2, 3, 8, 10, 11]
+    assert parse_cpulist('') == []
+
+def test_core_sets_stay_on_one_numa_node():
+    groups = [list(range(0, 32)), list(range(32, 64))]
+    core_sets = plan_core_sets(4, 16, groups=groups)
+    assert sorted(cpu for cores in core_sets for cpu in cores) == list(range(64))
+    for cores in core_sets:
+        assert len(cores) == 16
+        assert all(cpu < 32 for cpu in cores) or all(cpu >= 32 for cpu in cores)
+    # Replicas alternate between nodes instead of filling one first
+    assert core_sets[0][0] < 32 <= core_sets[1][0]
+
+def test_core_sets_span_nodes_only_when_they_must():
+    core_sets = plan_core_sets(3, 8, groups=[list(range(12)), list(range(12, 24))])
+    assert [len(cores) for cores in core_sets] == [8, 8, 8]
+    assert len({cpu for cores in core_sets for cpu in cores}) == 24
+
+def test_too_few_cpus():
+    with pytest.raises(ValueError):
+        plan_core_sets(3, 4, groups=[list(range(8))])
+
+def test_numa_groups_from_sysfs(tmp_path, monkeypatch):
+    monkeypatch.setattr('src.serving.usable_cpus', lambda: list(range(8)))
+    for node, cpus in ((0, '0-3'), (1, '4-5')):
+        (tmp_path / f'node{node}').mkdir()
+        (tmp_path / f'node{node}' / 'cpulist').write_text(cpus + '\n')
+    # CPUs no node lists still get used
+    assert numa_cpu_groups(str(tmp_path)) == [[0, 1, 2, 3], [4, 5], [6, 7]]
+
+def test_pool_matches_in_process_detector(tmp_path):
+    path = str(tmp_path / 'detector.pth')
+    arch = 'mobilenet_v3_small'
+    torch.save(checkpoint_payload(get_model(num_classes=2, pretrained=False, arch=arch).state_dict(), arch), path)
+    buffer = io.BytesIO()
+    Image.new('RGB', (80, 60), (10, 200, 40)).save(buffer, format='JPEG')
+    expected = ArtDetector(path, device='cpu').predict(buffer.getvalue())
+
+    with InferencePool(path, replicas=1, warmup_batch_sizes=()) as pool:
+        result = pool.predict(buffer.getvalue(), timeout=60)
+        with pytest.raises(Exception, match='decode'):
+            pool.predict(b'not an image', timeout=60)
+        stats = pool.stats()
+    assert result['predicted_class'] == expected['predicted_class']
+    assert result['probabilities'] == pytest.approx(expected['probabilities'], abs=1e-6)
+    assert stats['served'] == [1] and stats['outstanding'] == [0] and stats['restarts'] == 0
@@ -0,0 +1,91 @@
+import io
+import json
+import tarfile
+import threading
+import zipfile
+
+import pytest
+
+import app as web
+from conftest import FakeDetector
+
+MB = 1024 * 1024
+
+def zip_archive(members):
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, 'w', zipfile.ZIP_DEFLATED) as archive:
+        for name, data in members:
+            archive.writestr(name, data)
+    buffer.seek(0)
+    return buffer
+
+def tar_archive(members):
+    buffer = io.BytesIO()
+    with tarfile.open(fileobj=buffer, mode='w:gz') as archive:
+        for name, data in members:
+            info = tarfile.TarInfo(name)
+            info.size = len(data)
+            archive.addfile(info, io.BytesIO(data))
+    buffer.seek(0)
+    return buffer
+
+@pytest.mark.parametrize('make_archive', [zip_archive, tar_archive])
+def test_archive_members_over_the_image_limit_are_skipped(make_archive):
+    # 4 MB of zeros compresses to a few KB
+    archive = make_archive([('a.jpg', b'1'), ('bomb.jpg', bytes(4 * MB)), ('b.png', b'2'), ('notes.txt', b'x')])
+    items = list(web.iter_archive_images(archive, max_image_bytes=MB, max_total_bytes=10 * MB))
+    assert [name for name, _ in items] == ['a.jpg', 'bomb.jpg', 'b.png']
+    assert items[0][1] == b'1' and items[2][1] == b'2'
+    assert isinstance(items[1][1], ValueError)
+    assert 'over the 1.0 MB limit' in str(items[1][1])
+
+@pytest.mark.parametrize('make_archive', [zip_archive, tar_archive])
+def test_archive_total_limit_stops_reading(make_archive):
+    archive = make_archive([(f'{i}.jpg', bytes(MB)) for i in range(5)])
+    items = list(web.iter_archive_images(archive, max_image_bytes=2 * MB, max_total_bytes=int(2.5 * MB)))
+    assert [name for name, _ in items] == ['0.jpg', '1.jpg', '2.jpg']
+    assert [len(data) for _, data in items[:2]] == [MB, MB]
+    assert 'remaining images were skipped' in str(items[2][1])
+
+@pytest.fixture
+def client(monkeypatch):
+    """Test client serving a FakeDetector behind a micro-batcher admitting 2 requests"""
+    for name in ('detector', 'batcher', 'batcher_config', '_batcher_pid', 'decode_pool', '_decode_pool_pid'):
+        monkeypatch.setattr(web, name, getattr(web, name))
+    monkeypatch.setitem(web.app.config, 'BATCH_ENDPOINT_SIZE', 2)
+    monkeypatch.setitem(web.app.config, 'MAX_ARCHIVE_IMAGE_MB', 1)
+    web.detector = FakeDetector(gate=threading.Event())
+    web.batcher = web._batcher_pid = None
+    web.batcher_config = {'max_batch_size': 1, 'max_wait_ms': 0, 'max_queue_size': 2}
+    yield web.app.test_client()
+    web.detector.gate.set()
+    if web.batcher is not None:
+        web.batcher.close()
+
+def post_batch(client, **files):
+    response = client.post('/predict_batch', data=files, content_type='multipart/form-data')
+    assert response.status_code == 200
+    return [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+
+def test_predict_batch_reports_archive_limits_per_image(client):
+    web.detector.gate.set()
+    archive = zip_archive([('a.jpg', b'1'), ('bomb.jpg', bytes(2 * MB)), ('b.jpg', b'2')])
+    lines = post_batch(client, archive=(archive, 'gallery.zip'))
+    assert [line.get('value') for line in lines] == [1, None, 2]
+    assert 'over the 1.0 MB limit' in lines[1]['error']
+    assert web.get_batcher().stats()['pending'] == 0
+
+def test_predict_batch_counts_against_queue_capacity(client):
+    batcher = web.get_batcher()
+    # One /predict request is admitted and stuck in the model
+    stuck = batcher.submit(b'9')
+    lines = post_batch(client, images=[(io.BytesIO(b'1'), '1.jpg'), (io.BytesIO(b'2'), '2.jpg')])
+    assert [line['error'] for line in lines] == ['Server is at capacity, retry shortly'] * 2
+    assert batcher.stats()['pending'] == 1
+
+    web.detector.gate.set()
+    assert stuck.result(5) == {'value': 9}
+    lines = post_batch(client, images=[(io.BytesIO(b'1'), '1.jpg'), (io.BytesIO(b'2'), '2.jpg'),
+                                       (io.BytesIO(b'3'), '3.jpg')])
+    assert [line['value'] for line in lines] == [1, 2, 3]
+    assert batcher.stats()['pending'] == 0
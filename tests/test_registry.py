@@ -0,0 +1,83 @@
+import io
+import shutil
+import time
+
+import pytest
+import torch
+from PIL import Image
+
+import app as web
+from src.inference import ArtDetector, ModelRegistry
+from src.model import checkpoint_digest, checkpoint_payload, get_model
+
+ARCH = 'mobilenet_v3_small'
+
+def save_checkpoint(path, seed, arch=ARCH):
+    torch.manual_seed(seed)
+    torch.save(checkpoint_payload(get_model(num_classes=2, pretrained=False, arch=arch).state_dict(), arch), path)
+    return str(path)
+
+def image_bytes():
+    buffer = io.BytesIO()
+    Image.new('RGB', (64, 64), (200, 30, 90)).save(buffer, format='JPEG')
+    return buffer.getvalue()
+
+def wait_for(condition, timeout=60):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            raise AssertionError('timed out')
+        time.sleep(0.05)
+
+def test_checkpoint_overwritten_in_place_is_reloaded_safely(tmp_path):
+    path = save_checkpoint(tmp_path / 'detector.pth', seed=0)
+    # A ResNet-18 checkpoint is much larger, so copying it over the live file
+    # and then a short one back exercises both growth and truncation in place
+    bigger = save_checkpoint(tmp_path / 'bigger.pth', seed=1, arch='resnet18')
+    smaller = save_checkpoint(tmp_path / 'smaller.pth', seed=2)
+    registry = ModelRegistry(ArtDetector(path, device='cpu'), {'device': 'cpu', 'mmap_weights': True},
+                             warmup_batch_sizes=())
+    first = registry.load(path, background=False)
+    assert not first.mmap_weights
+    expected = first.predict(image_bytes())['probabilities']
+
+    registry.watch(interval=0.1)
+    shutil.copyfile(bigger, path)
+    wait_for(lambda: registry.active.model_id == checkpoint_digest(bigger))
+    assert registry.active.arch == 'resnet18'
+    # The replaced model still answers from its own copy of the weights
+    assert first.predict(image_bytes())['probabilities'] == expected
+
+    serving = registry.active
+    before = serving.predict(image_bytes())['probabilities']
+    shutil.copyfile(smaller, path)
+    wait_for(lambda: registry.active.model_id == checkpoint_digest(smaller))
+    assert serving.predict(image_bytes())['probabilities'] == before
+    assert registry.predict(image_bytes())['model_version'] == checkpoint_digest(smaller)
+    assert registry.status()['swaps'] == 3
+
+def test_watching_disables_memory_mapped_weights(tmp_path, monkeypatch):
+    for name in ('detector', 'batcher', 'batcher_config', '_batcher_pid', '_registry_tasks', 'startup'):
+        monkeypatch.setattr(web, name, getattr(web, name))
+    path = save_checkpoint(tmp_path / 'detector.pth', seed=0)
+    registry = web.load_detector(path, mmap_weights=True, watch_interval=5)
+    assert not registry.active.mmap_weights
+    registry = web.load_detector(path, mmap_weights=True)
+    assert registry.active.mmap_weights
+
+@pytest.fixture
+def admin_client(monkeypatch):
+    monkeypatch.setitem(web.app.config, 'ADMIN_TOKEN', 's3cret')
+    monkeypatch.setattr(web, 'detector', None)
+    return web.app.test_client()
+
+@pytest.mark.parametrize('headers, status', [
+    ({}, 403),
+    ({'X-Admin-Token': 's3cre'}, 403),
+    ({'X-Admin-Token': 's3cret!'}, 403),
+    ({'X-Admin-Token': 'sécret'}, 403),
+    # Past the token check; the model is not loaded yet
+    ({'X-Admin-Token': 's3cret'}, 503),
+])
+def test_admin_token(admin_client, headers, status):
+    assert admin_client.post('/models/promote', headers=headers).status_code == status
@@ -0,0 +1,57 @@
+import os
+
+import pytest
+
+import app as web
+from src.serving import StartupState, WorkerReadiness
+
+def test_readiness_waits_for_every_worker():
+    readiness = WorkerReadiness(2)
+    first, second = StartupState(), StartupState()
+    first.join_workers(readiness, 0)
+    second.join_workers(readiness, 1)
+
+    first.set_status('ready')
+    assert first.ready and not first.all_ready
+    assert first.snapshot()['workers'] == {'ready': 1, 'total': 2}
+    second.set_status('ready')
+    assert first.all_ready and second.all_ready
+    # A replacement worker in slot 1 starts out not ready
+    StartupState().join_workers(readiness, 1)
+    assert not first.all_ready
+
+def test_flags_are_shared_with_forked_workers():
+    readiness = WorkerReadiness(2)
+    for slot in range(2):
+        pid = os.fork()
+        if pid == 0:
+            state = StartupState()
+            state.join_workers(readiness, slot)
+            state.set_status('ready')
+            os._exit(0)
+        os.waitpid(pid, 0)
+    assert readiness.all_ready
+
+def test_slots_beyond_the_initial_workers_are_ignored():
+    readiness = WorkerReadiness(1)
+    readiness.set(3, True)
+    readiness.set(None, True)
+    assert readiness.ready_count() == 0
+
+@pytest.fixture
+def shared_startup(monkeypatch):
+    readiness = WorkerReadiness(2)
+    state = StartupState()
+    state.join_workers(readiness, 0)
+    monkeypatch.setattr(web, 'startup', state)
+    return state, readiness
+
+def test_readyz_reports_all_workers(shared_startup):
+    state, readiness = shared_startup
+    client = web.app.test_client()
+    state.set_status('ready')
+    response = client.get('/readyz')
+    assert response.status_code == 503
+    assert response.get_json()['workers'] == {'ready': 1, 'total': 2}
+    readiness.set(1, True)
+    assert client.get('/readyz').status_code == 200